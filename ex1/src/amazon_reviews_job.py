@@ -0,0 +1,203 @@
+import logging
+import sys
+from collections import defaultdict
+
+from mrjob.job import MRJob
+from mrjob.protocol import JSONProtocol
+
+from compact_protocol import CompactProtocol
+from review_parser import REVIEW_PARSERS, get_review_parser
+
+logger = logging.getLogger(__name__)
+
+# counter group used for reporting the effect of in-mapper combining
+IN_MAPPER_COMBINING_COUNTER_GROUP = "in-mapper combining"
+
+# rough estimate of the memory used by a single buffer entry (dict slot, key tuple, count) in bytes
+BUFFER_ENTRY_OVERHEAD = 150
+
+
+class AmazonReviewsJob(MRJob):
+    """
+    Base class of the jobs processing the Amazon reviews dataset.
+    Declares the options shared by all jobs (the runner passes the same command line to each of them)
+    and implements in-mapper combining.
+
+    Mappers parse the reviews with the parser chosen with --review-parser (see review_parser.py), which only extracts
+    the category and the review text. The intermediate data is written with the protocol chosen with
+    --internal-protocol (see compact_protocol.py).
+
+    With in-mapper combining enabled, mappers do not emit a record for every occurrence but add it to a buffer
+    that is flushed in mapper_final and whenever the buffer exceeds its entry or memory budget.
+    """
+
+    # modules the jobs depend on, uploaded to the working directory of the tasks
+    FILES = [
+        "amazon_reviews_job.py", "chi_squared_kernel.py", "compact_protocol.py", "review_parser.py", "tokenizer.py"]
+
+    def __init__(self, *args, **kwargs):
+        """
+        Initialize the job.
+        :param args: Positional arguments.
+        :param kwargs: Keyword arguments.
+        """
+        super().__init__(*args, **kwargs)
+
+        # function parsing a line into a tuple of the form (category, review text)
+        self.parse_review = None
+        # dictionary of buffered records and their counts
+        self.buffer = None
+        # estimated memory used by the buffer in bytes
+        self.buffer_memory = 0
+        # number of records added to the buffer since the last flush
+        self.records_buffered = 0
+
+    def configure_args(self):
+        """
+        Add the command line options shared by all jobs.
+        :return: Nothing.
+        """
+        super().configure_args()
+        self.add_passthru_arg(
+            "--in-mapper-combining", action="store_true",
+            help="Aggregate the records in the mappers before emitting them")
+        self.add_passthru_arg(
+            "--combining-buffer-entries", type=int, default=100000,
+            help="Maximum number of records buffered by in-mapper combining before flushing")
+        self.add_passthru_arg(
+            "--combining-buffer-memory", type=int, default=64,
+            help="Maximum (estimated) memory used by in-mapper combining before flushing, in MB")
+        self.add_passthru_arg(
+            "--review-parser", choices=REVIEW_PARSERS, default="auto",
+            help="Parser used for extracting the category and the review text from the input lines")
+        self.add_passthru_arg(
+            "--internal-protocol", choices=["compact", "json"], default="compact",
+            help="Protocol used for the intermediate keys and values")
+        self.add_passthru_arg(
+            "--top-k", type=int, default=75,
+            help="Number of terms with the highest chi-squared values to select for each category")
+        self.add_passthru_arg(
+            "--chi-squared-batch-size", type=int, default=0,
+            help="Number of terms whose chi-squared values the reducers calculate at once with NumPy "
+                 "(0 calculates them term by term in Python)")
+        self.add_passthru_arg(
+            "--term-counts-store", type=str, default=None,
+            help="Directory of the store of term and category counts (see term_count_store.py) "
+                 "the runner writes the counts of the chi-squared job to")
+        self.add_passthru_arg(
+            "--term-counts-matrix", type=str, default=None,
+            help="Directory the runner writes the counts of the chi-squared job to as a sparse term x category matrix "
+                 "(see term_count_matrix.py)")
+        self.add_passthru_arg(
+            "--processes", type=int, default=0,
+            help="Run the jobs on the local machine with this many processes (see multiprocess_runner.py) "
+                 "instead of the mrjob runner chosen with -r")
+        self.add_passthru_arg(
+            "--compact-store", action="store_true",
+            help="Merge all segments of the store of term and category counts into one (runner_incremental.py)")
+        self.add_passthru_arg(
+            "--balance-partitions", action="store_true",
+            help="Run a sampling pre-pass to size the number of reducers and balance the terms across them")
+        self.add_passthru_arg(
+            "--sample-lines", type=int, default=100000,
+            help="Number of input lines sampled by the pre-pass for estimating the term frequencies")
+        self.add_passthru_arg(
+            "--bytes-per-reducer", type=int, default=256,
+            help="Amount of input data per reducer used for sizing the number of reducers, in MB")
+        self.add_passthru_arg(
+            "--max-reducers", type=int, default=64,
+            help="Maximum number of reducers chosen by the sampling pre-pass")
+
+    def internal_protocol(self):
+        """
+        Get the protocol used for the intermediate keys and values.
+        :return: An instance of the protocol chosen with --internal-protocol.
+        """
+        if self.options.internal_protocol == "json":
+            return JSONProtocol()
+        return CompactProtocol()
+
+    def mapper_init(self):
+        """
+        Initialize the mapper.
+        Create the review parser.
+        :return: Nothing.
+        """
+        self.parse_review = get_review_parser(self.options.review_parser)
+
+    def emit(self, buffer_key, count=1):
+        """
+        Emit a record, or add it to the buffer if in-mapper combining is enabled.
+        :param buffer_key: The record to emit.
+        Converted to key and value by buffered_records().
+        :param count: The count of the record.
+        :return: Yields the key and value of the record (or of all buffered records when the buffer is flushed).
+        """
+        if not self.options.in_mapper_combining:
+            yield from self.buffered_records(buffer_key, count)
+            return
+
+        if self.buffer is None:
+            self.buffer = defaultdict(int)
+
+        self.records_buffered += 1
+        if buffer_key not in self.buffer:
+            self.buffer_memory += sys.getsizeof(buffer_key) + BUFFER_ENTRY_OVERHEAD
+        self.buffer[buffer_key] += count
+
+        if (len(self.buffer) >= self.options.combining_buffer_entries or
+                self.buffer_memory >= self.options.combining_buffer_memory * 1024 * 1024):
+            yield from self.flush()
+
+    def flush(self):
+        """
+        Emit all buffered records and clear the buffer.
+        :return: Yields the key and value of each buffered record.
+        """
+        if not self.buffer:
+            return
+
+        # counters are updated once per flush, as every update is written to stderr
+        self.increment_counter(IN_MAPPER_COMBINING_COUNTER_GROUP, "flushes")
+        self.increment_counter(IN_MAPPER_COMBINING_COUNTER_GROUP, "records buffered", self.records_buffered)
+        self.increment_counter(IN_MAPPER_COMBINING_COUNTER_GROUP, "records emitted", len(self.buffer))
+        for buffer_key, count in self.buffer.items():
+            yield from self.buffered_records(buffer_key, count)
+
+        self.buffer = defaultdict(int)
+        self.buffer_memory = 0
+        self.records_buffered = 0
+
+    def buffered_records(self, buffer_key, count):
+        """
+        Convert a (buffered) record to the key and value emitted by the mapper.
+        By default, the record is the key and the count is the value.
+        :param buffer_key: The record.
+        :param count: The count of the record.
+        :return: Yields the key and value.
+        """
+        yield buffer_key, count
+
+    def mapper_final(self):
+        """
+        Flush the records buffered by in-mapper combining.
+        :return: Yields the key and value of each buffered record.
+        """
+        yield from self.flush()
+
+
+def log_in_mapper_combining_stats(runner):
+    """
+    Log the emit reduction achieved by in-mapper combining for each step of a finished job.
+    :param runner: The runner of the job.
+    :return: Nothing.
+    """
+    for step_num, counters in enumerate(runner.counters()):
+        stats = counters.get(IN_MAPPER_COMBINING_COUNTER_GROUP)
+        if not stats or not stats.get("records emitted"):
+            continue
+        buffered = stats.get("records buffered", 0)
+        emitted = stats["records emitted"]
+        logger.info(
+            "In-mapper combining (step %d): %d records reduced to %d emitted records (reduction ratio %.2f, %d flushes)"
+            % (step_num + 1, buffered, emitted, buffered / emitted, stats.get("flushes", 0)))
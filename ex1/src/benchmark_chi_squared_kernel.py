@@ -0,0 +1,90 @@
+"""
+Benchmark of the NumPy chi-squared kernel (chi_squared_kernel.py) against the term-by-term Python computation.
+
+The category count vectors of all terms of the given file are computed up front, then the chi-squared values of all
+terms and categories are calculated with calculate_chi_squared() and with ChiSquaredBatch for several batch sizes.
+The kernel is checked to produce the same values (up to floating point rounding).
+"""
+import argparse
+import math
+import time
+from collections import defaultdict
+
+from chi_squared import calculate_chi_squared
+from chi_squared_kernel import chi_squared_batches
+from review_parser import get_review_parser
+from tokenizer import load_stopwords, unique_terms
+
+
+def count_terms(lines, stopwords):
+    """
+    Count the reviews containing each term for each category.
+    :param lines: A list of lines.
+    :param stopwords: A (frozen) set of stopwords.
+    :return: A tuple of the form (list of tuples (term, category count vector), category counts, number of reviews).
+    """
+    parse_review = get_review_parser()
+    category_counts_by_name = defaultdict(int)
+    term_category_counts = defaultdict(lambda: defaultdict(int))
+    for line in lines:
+        category, text = parse_review(line)
+        category_counts_by_name[category] += 1
+        for term in unique_terms(text, stopwords):
+            term_category_counts[term][category] += 1
+
+    categories = sorted(category_counts_by_name)
+    category_counts = [category_counts_by_name[category] for category in categories]
+    vectors = [(term, [counts[category] for category in categories]) for term, counts in term_category_counts.items()]
+    return vectors, category_counts, len(lines)
+
+
+def chi_squared_python(vectors, category_counts, n):
+    """
+    Calculate the chi-squared values term by term and category by category (as the reducers do by default).
+    :param vectors: List of tuples of the form (term, category count vector).
+    :param category_counts: The number of reviews of each category.
+    :param n: The number of reviews.
+    :return: A list of tuples of the form (term, category id, chi-squared).
+    """
+    results = []
+    for term, counts in vectors:
+        term_count = sum(counts)
+        for category, count in enumerate(counts):
+            if count:
+                results.append((term, category, calculate_chi_squared(n, category_counts[category], term_count, count)))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the NumPy chi-squared kernel.")
+    parser.add_argument("-i", "--input", type=str, help="Path to the reviews file.", default="../data/reviews_devset.json")
+    parser.add_argument("-s", "--stopwords", type=str, help="Path to the stopwords file.", default="stopwords.txt")
+    parser.add_argument("-b", "--batch-sizes", type=int, nargs="+", help="Batch sizes of the kernel.",
+                        default=[1, 64, 1024, 4096])
+    args = parser.parse_args()
+
+    with open(args.input, "r") as f:
+        lines = f.read().splitlines()
+    print(f"Loaded {len(lines)} lines from '{args.input}'")
+
+    vectors, category_counts, n = count_terms(lines, load_stopwords(args.stopwords))
+    # terms contained in every review have a degenerate contingency table (and no chi-squared value in Python)
+    vectors = [(term, counts) for term, counts in vectors if sum(counts) < n]
+    print(f"{len(vectors)} terms, {len(category_counts)} categories")
+
+    start_time = time.perf_counter()
+    expected = chi_squared_python(vectors, category_counts, n)
+    python_time = time.perf_counter() - start_time
+    print(f"python: {python_time:.3f} seconds")
+
+    for batch_size in args.batch_sizes:
+        start_time = time.perf_counter()
+        results = list(chi_squared_batches(vectors, category_counts, n, batch_size))
+        kernel_time = time.perf_counter() - start_time
+
+        if len(results) != len(expected) or not all(
+                term == expected_term and category == expected_category and math.isclose(value, expected_value)
+                for (term, category, value), (expected_term, expected_category, expected_value)
+                in zip(results, expected)):
+            raise ValueError(f"Kernel with batch size {batch_size} does not compute the same values")
+        print(f"numpy, batch size {batch_size}: {kernel_time:.3f} seconds (speedup {python_time / kernel_time:.2f}x)")
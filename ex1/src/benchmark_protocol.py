@@ -0,0 +1,87 @@
+"""
+Benchmark of the compact internal protocol (compact_protocol.py) against mrjob's JSON protocol.
+
+For each protocol, the benchmark
+- runs the whole pipeline (runner.py) with the protocol and reports the wall-clock time, and
+- serializes the mapper output of CategoryCounter and AmazonReviewsChiSquared for the given file (i.e. the data
+  that is shuffled if no combiner runs) and reports its size and the time needed to write and read it back.
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+from category_counter import CategoryCounter
+from chi_squared import AmazonReviewsChiSquared
+
+
+def measure_shuffle(job_class, lines, protocol_name):
+    """
+    Serialize the mapper output of a job with a protocol.
+    :param job_class: The job class.
+    :param lines: The input lines.
+    :param protocol_name: The name of the protocol (option --internal-protocol).
+    :return: A tuple of the form (number of records, bytes, time to write in seconds, time to read in seconds).
+    """
+    job = job_class(args=["--internal-protocol", protocol_name])
+    protocol = job.internal_protocol()
+
+    job.mapper_init()
+    records = [record for line in lines for record in job.mapper(None, line)]
+    records.extend(job.mapper_final())
+
+    start_time = time.perf_counter()
+    encoded = [protocol.write(key, value) for key, value in records]
+    write_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for line in encoded:
+        protocol.read(line)
+    read_time = time.perf_counter() - start_time
+
+    # each record is followed by a newline
+    num_bytes = sum(len(line) + 1 for line in encoded)
+    return len(records), num_bytes, write_time, read_time
+
+
+def measure_pipeline(input_path, protocol_name, runner):
+    """
+    Run the whole pipeline with a protocol.
+    :param input_path: The path of the input file.
+    :param protocol_name: The name of the protocol (option --internal-protocol).
+    :param runner: The mrjob runner to use.
+    :return: The wall-clock time in seconds.
+    """
+    start_time = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "runner.py", "-r", runner, "--internal-protocol", protocol_name, input_path],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the compact internal protocol against the JSON protocol.")
+    parser.add_argument("-i", "--input", type=str, help="Path to the reviews file.", default="../data/reviews_devset.json")
+    parser.add_argument("-r", "--runner", type=str, help="mrjob runner used for the pipeline runs.", default="inline")
+    args = parser.parse_args()
+
+    with open(args.input, "r") as f:
+        lines = f.read().splitlines()
+    print(f"Loaded {len(lines)} lines from '{args.input}'")
+
+    # the pipeline runs also write the category counts needed by the chi-squared mapper
+    pipeline_times = {}
+    for protocol_name in ["json", "compact"]:
+        pipeline_times[protocol_name] = measure_pipeline(args.input, protocol_name, args.runner)
+        print(f"Pipeline ({args.runner} runner), {protocol_name}: {pipeline_times[protocol_name]:.2f} seconds")
+    print(f"Speedup: {pipeline_times['json'] / pipeline_times['compact']:.2f}x")
+
+    for job_class in [CategoryCounter, AmazonReviewsChiSquared]:
+        results = {}
+        for protocol_name in ["json", "compact"]:
+            results[protocol_name] = measure_shuffle(job_class, lines, protocol_name)
+            num_records, num_bytes, write_time, read_time = results[protocol_name]
+            print(f"{job_class.__name__}, {protocol_name}: {num_records} records, {num_bytes} bytes, "
+                  f"write {write_time:.3f} seconds, read {read_time:.3f} seconds")
+        print(f"{job_class.__name__}: compact protocol shuffles "
+              f"{1 - results['compact'][1] / results['json'][1]:.1%} fewer bytes")
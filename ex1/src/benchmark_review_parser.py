@@ -0,0 +1,55 @@
+"""
+Throughput benchmark of the review parsers (review_parser.py) in lines per second.
+
+Every available parser is run on the lines of the given file and checked to extract the same category and review
+text as the stdlib json parser.
+"""
+import argparse
+import time
+
+from review_parser import REVIEW_PARSERS, get_review_parser, parse_review_json
+
+
+def time_parsing(parse_review, lines, repeat):
+    """
+    Measure the time it takes to parse all lines.
+    :param parse_review: The parser function.
+    :param lines: A list of lines.
+    :param repeat: The number of repetitions.
+    :return: The best time in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for line in lines:
+            parse_review(line)
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the throughput of the review parsers.")
+    parser.add_argument("-i", "--input", type=str, help="Path to the reviews file.", default="../data/reviews_devset.json")
+    parser.add_argument("-r", "--repeat", type=int, help="Number of repetitions (best time is reported).", default=3)
+    args = parser.parse_args()
+
+    with open(args.input, "r") as f:
+        lines = f.read().splitlines()
+    print(f"Loaded {len(lines)} lines from '{args.input}'")
+
+    expected = [parse_review_json(line) for line in lines]
+
+    for name in REVIEW_PARSERS:
+        if name == "auto":
+            continue
+        try:
+            parse_review = get_review_parser(name)
+        except ImportError as e:
+            print(f"{name}: skipped ({e})")
+            continue
+
+        if [parse_review(line) for line in lines] != expected:
+            raise ValueError(f"Parser '{name}' does not extract the same fields as the json parser")
+
+        parsing_time = time_parsing(parse_review, lines, args.repeat)
+        print(f"{name}: {parsing_time:.3f} seconds ({len(lines) / parsing_time:.0f} lines/second)")
@@ -0,0 +1,72 @@
+"""
+Micro-benchmark of the shared tokenizer (tokenizer.py) against the original tokenization of the chi-squared mapper.
+
+Both implementations are run on the review texts of the given file. The benchmark also checks that they produce
+exactly the same set of terms for every review, i.e. that the jobs emit the same records and hence produce output
+identical to ../output.txt.
+"""
+import argparse
+import json
+import re
+import time
+
+from tokenizer import load_stopwords, unique_terms
+
+
+def reference_unique_terms(text, stopwords):
+    """
+    The original tokenization of AmazonReviewsChiSquared.mapper.
+    :param text: The text to extract the terms from.
+    :param stopwords: A set of stopwords.
+    :return: A set of terms.
+    """
+    pattern = re.compile(r"[^a-zA-Z<>^|]+")
+    seen_terms = set()
+    for term in (term.lower() for term in pattern.split(text) if
+                 len(term) >= 2 and term.lower() not in stopwords):
+        if term not in seen_terms:
+            seen_terms.add(term)
+    return seen_terms
+
+
+def time_tokenization(fn, texts, stopwords, repeat):
+    """
+    Measure the time it takes to extract the terms of all texts.
+    :param fn: The tokenization function.
+    :param texts: A list of texts.
+    :param stopwords: A set of stopwords.
+    :param repeat: The number of repetitions.
+    :return: The best time in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for text in texts:
+            fn(text, stopwords)
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the shared tokenizer against the original implementation.")
+    parser.add_argument("-i", "--input", type=str, help="Path to the reviews file.", default="../data/reviews_devset.json")
+    parser.add_argument("-s", "--stopwords", type=str, help="Path to the stopwords file.", default="stopwords.txt")
+    parser.add_argument("-r", "--repeat", type=int, help="Number of repetitions (best time is reported).", default=3)
+    args = parser.parse_args()
+
+    with open(args.input, "r") as f:
+        texts = [json.loads(line)["reviewText"] for line in f]
+    stopwords = load_stopwords(args.stopwords)
+    print(f"Loaded {len(texts)} reviews from '{args.input}'")
+
+    # check that both implementations produce the same terms for every review
+    mismatches = sum(1 for text in texts if unique_terms(text, stopwords) != reference_unique_terms(text, stopwords))
+    if mismatches:
+        raise ValueError(f"Tokenizer output differs from the original implementation for {mismatches} reviews")
+    print("Tokenizer output is identical to the original implementation for all reviews")
+
+    reference_time = time_tokenization(reference_unique_terms, texts, stopwords, args.repeat)
+    shared_time = time_tokenization(unique_terms, texts, stopwords, args.repeat)
+    print(f"Original implementation: {reference_time:.3f} seconds ({len(texts) / reference_time:.0f} reviews/second)")
+    print(f"Shared tokenizer: {shared_time:.3f} seconds ({len(texts) / shared_time:.0f} reviews/second)")
+    print(f"Speedup: {reference_time / shared_time:.2f}x")
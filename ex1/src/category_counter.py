@@ -1,12 +1,11 @@
-import json
 import logging
 
-from mrjob.job import MRJob
+from amazon_reviews_job import AmazonReviewsJob
 
 logger = logging.getLogger(__name__)
 
 
-class CategoryCounter(MRJob):
+class CategoryCounter(AmazonReviewsJob):
     """
     This job counts the number of reviews in each category.
     """
@@ -31,14 +30,11 @@ class CategoryCounter(MRJob):
         Represents a single review.
         :return: Yields the category and a count of 1.
         """
-        # load json data from line
-        review = json.loads(line)
-
-        # extract the product category
-        category = review["category"]
+        # extract the product category from the json data of the line
+        category, _ = self.parse_review(line)
 
         # emit the category and the document count
-        yield category, 1
+        yield from self.emit(category)
 
     def combiner(self, key, values):
         """
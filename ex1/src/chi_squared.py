@@ -1,16 +1,44 @@
+import heapq
 import json
 import logging
-import re
 from collections import defaultdict
 
-from mrjob.job import MRJob
+from mrjob.step import MRStep
+
+from amazon_reviews_job import AmazonReviewsJob
+from tokenizer import load_stopwords, unique_terms
+
+try:
+    from chi_squared_kernel import ChiSquaredBatch
+except ImportError:
+    ChiSquaredBatch = None
 
 logger = logging.getLogger(__name__)
 
+# tag of the keys under which the job outputs the counts of the terms with --term-counts-store or
+# --term-counts-matrix
+TERM_COUNTS_KEY = "term counts"
 
-class AmazonReviewsChiSquared(MRJob):
+
+class AmazonReviewsChiSquared(AmazonReviewsJob):
     """
-    This job calculates the chi-squared statistic for each pair of category and term in the dataset.
+    This job calculates the chi-squared statistic for each pair of category and term in the dataset
+    and selects the terms with the highest chi-squared values for each category.
+
+    The first step calculates the chi-squared values, and each reducer keeps only its top K terms per category.
+    The second step merges these partial top K lists by category, so only the final top K terms of each category
+    are sent to the driver.
+
+    Categories are encoded as dense integer ids (their index in the alphabetically sorted list of categories
+    in category_counts.json) throughout the job, the driver decodes them for the final output.
+
+    With --chi-squared-batch-size, the reducers collect the category count vectors of many terms and calculate
+    their chi-squared values with the NumPy kernel (see chi_squared_kernel.py) one batch at a time.
+
+    With --term-counts-store or --term-counts-matrix, the job additionally outputs the category counts of every term
+    (keyed by a tuple of the form (TERM_COUNTS_KEY, term)),
+    which the runner writes to the store of term and category counts (see term_count_store.py)
+    or to a sparse term x category matrix (see term_count_matrix.py).
     """
 
     def __init__(self, *args, **kwargs):
@@ -25,8 +53,30 @@ class AmazonReviewsChiSquared(MRJob):
         self.n = None
         # set of stopwords
         self.stopwords = None
-        # dictionary of category counts
+        # alphabetically sorted list of categories, the index of a category is its id
+        self.categories = None
+        # dictionary mapping categories to their ids
+        self.category_ids = None
+        # list of category counts, indexed by category id
         self.category_counts = None
+        # batch of terms whose chi-squared values are calculated with the NumPy kernel
+        self.chi_squared_batch = None
+        # dictionary of heaps of the form (chi-squared, term) with the top K terms of the reducer for each category
+        self.top_terms_for_category = defaultdict(list)
+
+    def steps(self):
+        """
+        Define the steps of the job.
+        :return: A list of steps: computing the chi-squared values (with partial top K per reducer)
+        and merging the top K terms of each category.
+        """
+        return [
+            MRStep(mapper_init=self.mapper_init, mapper=self.mapper, mapper_final=self.mapper_final,
+                   combiner=self.combiner,
+                   reducer_init=self.reducer_init, reducer=self.reducer_partial_top_k,
+                   reducer_final=self.reducer_final_partial_top_k),
+            MRStep(reducer=self.reducer_top_k),
+        ]
 
     def jobconf(self):
         """
@@ -42,12 +92,24 @@ class AmazonReviewsChiSquared(MRJob):
     def mapper_init(self):
         """
         Initialize the mapper.
-        Load the stopwords from file.
+        Create the review parser and load the stopwords from file.
         :return: Nothing.
         """
-        # load stopwords from file into a set
-        with open("stopwords.txt", "r") as f:
-            self.stopwords = set(f.read().splitlines())
+        super().mapper_init()
+
+        # load stopwords from file into a frozen set
+        self.stopwords = load_stopwords("stopwords.txt")
+
+        # load the categories for encoding them as ids
+        self.category_ids = self.load_category_ids()
+
+    def load_category_ids(self):
+        """
+        Load the categories from the category counts file and assign them ids.
+        :return: A dictionary mapping categories to their ids.
+        """
+        categories, _, _ = load_category_counts("category_counts.json")
+        return {category: category_id for category_id, category in enumerate(categories)}
 
     def mapper(self, _, line):
         """
@@ -57,37 +119,33 @@ class AmazonReviewsChiSquared(MRJob):
         Unused.
         :param line: A single line of the input file.
         Represents a single review.
-        :return: Yields the term and a tuple of the form (category, 1).
+        :return: Yields the term and a tuple of the form (category id, 1).
         """
-        # load json data from line
-        review = json.loads(line)
-
-        # extract the review text and the product category
-        text = review["reviewText"]
-        category = review["category"]
+        # extract the product category and the review text from the json data of the line
+        category, text = self.parse_review(line)
+        category = self.category_ids[category]
 
-        # compile the regular expression pattern for splitting text into tokens
-        pattern = re.compile(r"[^a-zA-Z<>^|]+")
+        # iterate over the unique terms (without stopwords) and emit them with the category
+        for term in unique_terms(text, self.stopwords):
+            # emit the category and the term
+            yield from self.emit((term, category))
 
-        # set to keep track of seen terms
-        seen_terms = set()
-
-        # iterate over filtered terms and emit unique ones with the category
-        for term in (term.lower() for term in pattern.split(text) if
-                     len(term) >= 2 and term.lower() not in self.stopwords):
-            if term not in seen_terms:
-                # mark term as seen
-                seen_terms.add(term)
-
-                # emit the category and the term
-                yield term, (category, 1)
+    def buffered_records(self, buffer_key, count):
+        """
+        Convert a (buffered) pair of term and category to the key and value emitted by the mapper.
+        :param buffer_key: A tuple of the form (term, category id).
+        :param count: The number of reviews of the category containing the term.
+        :return: Yields the term and a tuple of the form (category id, count).
+        """
+        term, category = buffer_key
+        yield term, (category, count)
 
     def combiner(self, key, values):
         """
         Combine the values for each term.
         :param key: A term.
-        :param values: List of tuples of the form (category, 1).
-        :return: Yields the term and a tuple of the form (category, count).
+        :param values: List of tuples of the form (category id, 1).
+        :return: Yields the term and a tuple of the form (category id, count).
         """
         combined_values = defaultdict(int)
         for category, count in values:
@@ -101,31 +159,150 @@ class AmazonReviewsChiSquared(MRJob):
         Load the category counts from the file.
         :return: Nothing.
         """
-        with open('category_counts.json', "r") as f:
-            self.category_counts = json.load(f)
-        self.n = self.category_counts.pop('number_of_reviews')
+        self.categories, self.category_counts, self.n = load_category_counts('category_counts.json')
 
     def reducer(self, key, values):
         """
         Calculate the chi-squared statistic for each term and category.
         :param key: A term.
-        :param values: List of tuples of the form (category, count).
-        :return: Yields None and a tuple of the form (category, chi-squared, term).
+        :param values: List of tuples of the form (category id, count).
+        :return: Yields None and a tuple of the form (category id, chi-squared, term).
+        With --chi-squared-batch-size, the values are yielded once the batch is full (see flush_chi_squared_batch()).
+        With --term-counts-store or --term-counts-matrix, also yields a tuple of the form (TERM_COUNTS_KEY, term)
+        and the list of counts of the term (indexed by category id).
         """
-        # count the number of occurrences of each category for the term
-        category_counts_for_term = defaultdict(int)
-        aggregate_count = 0
+        # count the number of occurrences of each category for the term (indexed by category id)
+        category_counts_for_term = [0] * len(self.categories)
         for category, count in values:
             category_counts_for_term[category] += count
-            aggregate_count += count
-
-        for category, count in category_counts_for_term.items():
-            a = count
-            b = aggregate_count - count
-            c = self.category_counts[category] - count
-            d = self.n - a - b - c
-            chi_squared = self.n * ((a * d - b * c) ** 2) / ((a + b) * (a + c) * (b + d) * (c + d))
-            yield None, (category, chi_squared, key)
+
+        if self.options.term_counts_store or self.options.term_counts_matrix:
+            yield (TERM_COUNTS_KEY, key), category_counts_for_term
+
+        if self.options.chi_squared_batch_size:
+            if self.chi_squared_batch is None:
+                if ChiSquaredBatch is None:
+                    raise ImportError("--chi-squared-batch-size requires NumPy")
+                self.chi_squared_batch = ChiSquaredBatch(self.category_counts, self.n,
+                                                         self.options.chi_squared_batch_size)
+            if self.chi_squared_batch.add(key, category_counts_for_term):
+                yield from self.flush_chi_squared_batch()
+            return
+
+        aggregate_count = sum(category_counts_for_term)
+        for category, count in enumerate(category_counts_for_term):
+            if count:
+                chi_squared = calculate_chi_squared(self.n, self.category_counts[category], aggregate_count, count)
+                yield None, (category, chi_squared, key)
+
+    def flush_chi_squared_batch(self):
+        """
+        Calculate the chi-squared values of the terms collected for the NumPy kernel.
+        :return: Yields None and a tuple of the form (category id, chi-squared, term).
+        """
+        if self.chi_squared_batch is None:
+            return
+        for term, category, chi_squared in self.chi_squared_batch.flush():
+            yield None, (category, chi_squared, term)
+
+    def reducer_partial_top_k(self, key, values):
+        """
+        Calculate the chi-squared statistic for each term and category
+        and keep the top K terms of the reducer for each category.
+        :param key: A term.
+        :param values: List of tuples of the form (category id, count).
+        :return: Nothing, the top K terms are emitted in reducer_final_partial_top_k().
+        With --term-counts-store or --term-counts-matrix, yields a tuple of the form (TERM_COUNTS_KEY, term)
+        and the list of counts of the term (indexed by category id).
+        """
+        for output_key, value in self.reducer(key, values):
+            if output_key is not None:
+                # counts of the term for the store, passed on to the output
+                yield output_key, value
+                continue
+            category, chi_squared, term = value
+            self.keep_top_k(category, chi_squared, term)
+
+    def keep_top_k(self, category, chi_squared, term):
+        """
+        Add a term to the top K terms of the reducer for a category if its chi-squared value is high enough.
+        :param category: A category id.
+        :param chi_squared: The chi-squared value of the term and the category.
+        :param term: A term.
+        :return: Nothing.
+        """
+        heap = self.top_terms_for_category[category]
+        # if the heap of terms for the category is full, replace the term with the lowest chi-squared value
+        if len(heap) >= self.options.top_k:
+            heapq.heappushpop(heap, (chi_squared, term))
+        else:
+            heapq.heappush(heap, (chi_squared, term))
+
+    def reducer_final_partial_top_k(self):
+        """
+        Emit the top K terms of the reducer for each category.
+        Calculates the chi-squared values of the terms still collected for the NumPy kernel first.
+        :return: Yields the category id and a tuple of the form (chi-squared, term) for each of its top K terms.
+        """
+        for _, (category, chi_squared, term) in self.flush_chi_squared_batch():
+            self.keep_top_k(category, chi_squared, term)
+
+        for category, heap in self.top_terms_for_category.items():
+            for chi_squared, term in heap:
+                yield category, (chi_squared, term)
+
+    def reducer_top_k(self, key, values):
+        """
+        Merge the top K terms of all reducers for a category.
+        :param key: A category id.
+        With --term-counts-store or --term-counts-matrix, also a tuple of the form (TERM_COUNTS_KEY, term).
+        :param values: List of tuples of the form (chi-squared, term).
+        For a term, the list of its counts.
+        :return: Yields None and a tuple of the form (category id, chi-squared, term) for each of the top K terms.
+        For a term, yields the key and the list of its counts.
+        """
+        if isinstance(key, (list, tuple)) and key[0] == TERM_COUNTS_KEY:
+            # counts of a term for the store
+            for value in values:
+                yield key, value
+            return
+
+        for chi_squared, term in heapq.nlargest(self.options.top_k, (tuple(value) for value in values)):
+            yield None, (key, chi_squared, term)
+
+
+def load_category_counts(path="category_counts.json"):
+    """
+    Load the category counts written by the runner and encode the categories as ids.
+    :param path: The path of the category counts file.
+    :return: A tuple of the form (alphabetically sorted list of categories, list of category counts, number of reviews).
+    The index of a category in the lists is its id.
+    """
+    with open(path, "r") as f:
+        category_counts = json.load(f)
+    n = category_counts.pop('number_of_reviews')
+    categories = sorted(category_counts)
+    return categories, [category_counts[category] for category in categories], n
+
+
+def calculate_chi_squared(n, category_count, term_count, term_category_count):
+    """
+    Calculate the chi-squared statistic of the 2x2 contingency table of a term and a category.
+    :param n: The total number of reviews.
+    :param category_count: The number of reviews in the category.
+    :param term_count: The number of reviews containing the term.
+    :param term_category_count: The number of reviews in the category containing the term.
+    :return: The chi-squared value.
+    """
+    # number of documents in c which contain t
+    a = term_category_count
+    # number of documents not in c which contain t
+    b = term_count - a
+    # number of documents in c without t
+    c = category_count - a
+    # number of documents not in c without t
+    d = n - a - b - c
+    return n * ((a * d - b * c) ** 2) / ((a + b) * (a + c) * (b + d) * (c + d))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,131 @@
+"""
+Vectorized computation of the chi-squared statistic, shared by the MapReduce jobs (ex1) and the Spark pipelines (ex2).
+
+Instead of computing the 2x2 contingency table of a term and a category one category at a time in Python,
+chi_squared() takes the count vector of a term over all categories (or a matrix with the count vectors of many terms)
+and computes the chi-squared values of all categories with a few NumPy operations.
+ChiSquaredBatch collects the count vectors of many terms, so that reducers and Spark's mapPartitions() pay
+the interpreter overhead once per batch instead of once per term and category.
+
+The values are computed with 64-bit floats, so they may differ from the exact (integer) computation of
+calculate_chi_squared() in chi_squared.py in the last digits.
+"""
+import numpy as np
+
+# default number of terms per batch
+DEFAULT_BATCH_SIZE = 4096
+
+
+def chi_squared(term_category_counts, category_counts, n):
+    """
+    Calculate the chi-squared statistic of a term (or of many terms) for every category.
+    Degenerate contingency tables (e.g. a term contained in every review) have a chi-squared value of 0.
+    :param term_category_counts: The number of reviews containing the term for each category (indexed by category id),
+    or a matrix with one such row for each term.
+    :param category_counts: The number of reviews of each category (indexed by category id).
+    :param n: The total number of reviews.
+    :return: An array of the same shape as term_category_counts with the chi-squared values.
+    """
+    # number of documents in c which contain t
+    a = np.asarray(term_category_counts, dtype=np.float64)
+    # number of documents not in c which contain t
+    b = a.sum(axis=-1, keepdims=True) - a
+    # number of documents in c without t
+    c = np.asarray(category_counts, dtype=np.float64) - a
+    return chi_squared_contingency(a, b, c, n)
+
+
+def chi_squared_contingency(a, b, c, n):
+    """
+    Calculate the chi-squared statistic from the cells of 2x2 contingency tables (element-wise).
+    :param a: The number of reviews of the category containing the term (float array).
+    :param b: The number of reviews of other categories containing the term (float array).
+    :param c: The number of reviews of the category without the term (float array).
+    :param n: The total number of reviews.
+    :return: An array with the chi-squared values.
+    """
+    # number of documents not in c without t
+    d = n - a - b - c
+
+    numerator = n * (a * d - b * c) ** 2
+    denominator = (a + b) * (a + c) * (b + d) * (c + d)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, numerator / denominator, 0.0)
+
+
+class ChiSquaredBatch:
+    """
+    Collects the category count vectors of terms and calculates their chi-squared values batch by batch.
+    """
+
+    def __init__(self, category_counts, n, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Initialize the batch.
+        :param category_counts: The number of reviews of each category (indexed by category id).
+        :param n: The total number of reviews.
+        :param batch_size: The maximum number of terms per batch.
+        """
+        self.category_counts = np.asarray(category_counts, dtype=np.int64)
+        self.n = n
+        self.batch_size = batch_size
+        # terms of the batch
+        self.terms = []
+        # count vectors of the terms of the batch, one row per term
+        self.counts = np.zeros((batch_size, len(self.category_counts)), dtype=np.int64)
+
+    def __len__(self):
+        """
+        Get the number of terms in the batch.
+        :return: The number of terms.
+        """
+        return len(self.terms)
+
+    def add(self, term, term_category_counts):
+        """
+        Add a term to the batch.
+        :param term: The term.
+        :param term_category_counts: The number of reviews containing the term for each category
+        (indexed by category id).
+        :return: True if the batch is full and has to be flushed.
+        """
+        self.counts[len(self.terms)] = term_category_counts
+        self.terms.append(term)
+        return len(self.terms) >= self.batch_size
+
+    def flush(self):
+        """
+        Calculate the chi-squared values of all terms of the batch and clear the batch.
+        :return: Yields a tuple of the form (term, category id, chi-squared) for each term and each category
+        with reviews containing the term, ordered by term (in the order they were added) and category id.
+        """
+        if not self.terms:
+            return
+
+        counts = self.counts[:len(self.terms)]
+        chi_squared_values = chi_squared(counts, self.category_counts, self.n)
+        rows, categories = np.nonzero(counts)
+        # convert to Python objects once for the whole batch
+        terms = self.terms
+        for row, category, chi_squared_value in zip(rows.tolist(), categories.tolist(),
+                                                    chi_squared_values[rows, categories].tolist()):
+            yield terms[row], category, chi_squared_value
+
+        self.terms = []
+        self.counts[:] = 0
+
+
+def chi_squared_batches(term_category_counts, category_counts, n, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Calculate the chi-squared values of a stream of terms batch by batch, e.g. for a partition of a Spark RDD.
+    :param term_category_counts: Iterable of tuples of the form (term, category count vector of the term).
+    :param category_counts: The number of reviews of each category (indexed by category id).
+    :param n: The total number of reviews.
+    :param batch_size: The maximum number of terms per batch.
+    :return: Yields a tuple of the form (term, category id, chi-squared) for each term and each category
+    with reviews containing the term.
+    """
+    batch = ChiSquaredBatch(category_counts, n, batch_size)
+    for term, counts in term_category_counts:
+        if batch.add(term, counts):
+            yield from batch.flush()
+    yield from batch.flush()
@@ -0,0 +1,149 @@
+import logging
+import os
+import time
+from collections import defaultdict
+from itertools import groupby
+
+from mrjob.compat import jobconf_from_env
+
+from chi_squared import AmazonReviewsChiSquared
+from term_partitioner import TERM_PARTITIONS_FILE, TermPartitioner
+
+logger = logging.getLogger(__name__)
+
+# counter group used for reporting the time each reducer took
+REDUCER_COMPLETION_TIMES_COUNTER_GROUP = "reducer completion times (ms)"
+
+
+class AmazonReviewsChiSquaredPartitioned(AmazonReviewsChiSquared):
+    """
+    This job calculates the chi-squared statistic for each pair of category and term in the dataset,
+    controlling which reducer processes which term.
+
+    Instead of the term, the mappers emit the routing key of the term's partition (see term_partitioner.py),
+    with the term as part of the value. Values are sorted (secondary sort), so the records of each term
+    arrive at the reducer consecutively. With --balance-partitions, the partitioning written by the sampling pre-pass
+    spreads the most frequent terms evenly across the reducers and sets the number of reducers; all other terms
+    are hashed.
+
+    Each reducer reports the time it took as a counter, to verify that the partitioning is balanced.
+    """
+
+    # sort the values of each key so that the records of each term are consecutive
+    SORT_VALUES = True
+
+    def __init__(self, *args, **kwargs):
+        """
+        Initialize the job.
+        :param args: Positional arguments.
+        :param kwargs: Keyword arguments.
+        """
+        super().__init__(*args, **kwargs)
+
+        # partitioner assigning terms to reducers
+        self.term_partitioner = None
+        # time at which the reducer started
+        self.reducer_start_time = None
+
+    def jobconf(self):
+        """
+        Set the number of reducers.
+        Uses the number of reducers of the partitioning written by the sampling pre-pass, if there is one.
+        :return: A dictionary of job configuration options.
+        """
+        jobconf = super().jobconf()
+        if self.options.balance_partitions and os.path.exists(TERM_PARTITIONS_FILE):
+            jobconf['mapreduce.job.reduces'] = TermPartitioner.load(TERM_PARTITIONS_FILE).num_partitions
+        return jobconf
+
+    def mapper_init(self):
+        """
+        Initialize the mapper.
+        Create the review parser, load the stopwords and the partitioning of the terms.
+        :return: Nothing.
+        """
+        super().mapper_init()
+        self.term_partitioner = self.load_term_partitioner()
+
+    def load_term_partitioner(self):
+        """
+        Load the partitioning written by the sampling pre-pass, or hash all terms if there is none.
+        :return: A TermPartitioner.
+        """
+        if self.options.balance_partitions:
+            return TermPartitioner.load(TERM_PARTITIONS_FILE)
+        num_reducers = int(jobconf_from_env("mapreduce.job.reduces", self.jobconf()["mapreduce.job.reduces"]))
+        return TermPartitioner(num_reducers)
+
+    def buffered_records(self, buffer_key, count):
+        """
+        Convert a (buffered) pair of term and category to the key and value emitted by the mapper.
+        :param buffer_key: A tuple of the form (term, category id).
+        :param count: The number of reviews of the category containing the term.
+        :return: Yields the routing key of the term and a tuple of the form (term, category id, count).
+        """
+        term, category = buffer_key
+        yield self.term_partitioner.routing_key(term), (term, category, count)
+
+    def combiner(self, key, values):
+        """
+        Combine the values for each term and category of a partition.
+        :param key: A routing key.
+        :param values: List of tuples of the form (term, category id, count).
+        :return: Yields the routing key and a tuple of the form (term, category id, count).
+        """
+        combined_values = defaultdict(int)
+        for term, category, count in values:
+            combined_values[(term, category)] += count
+        for (term, category), count in combined_values.items():
+            yield key, (term, category, count)
+
+    def reducer_init(self):
+        """
+        Initialize the reducer.
+        Load the category counts from the file and start measuring the time the reducer takes.
+        :return: Nothing.
+        """
+        super().reducer_init()
+        self.reducer_start_time = time.time()
+
+    def reducer(self, key, values):
+        """
+        Calculate the chi-squared statistic for each term and category of a partition.
+        :param key: A routing key.
+        :param values: List of tuples of the form (term, category id, count), sorted by term.
+        :return: Yields None and a tuple of the form (category id, chi-squared, term).
+        """
+        for term, term_values in groupby(values, key=lambda value: value[0]):
+            yield from super().reducer(term, ((category, count) for _, category, count in term_values))
+
+    def reducer_final_partial_top_k(self):
+        """
+        Report the time the reducer took and emit the top K terms of the reducer for each category.
+        :return: Yields the category and a tuple of the form (chi-squared, term) for each of its top K terms.
+        """
+        elapsed_ms = int((time.time() - self.reducer_start_time) * 1000)
+        self.increment_counter(REDUCER_COMPLETION_TIMES_COUNTER_GROUP,
+                               "reducer %s" % jobconf_from_env("mapreduce.task.partition", "?"), elapsed_ms)
+        yield from super().reducer_final_partial_top_k()
+
+
+def log_reducer_completion_times(runner):
+    """
+    Log the time each reducer of a finished job took and the imbalance between the slowest and the average reducer.
+    :param runner: The runner of the job.
+    :return: Nothing.
+    """
+    for step_num, counters in enumerate(runner.counters()):
+        completion_times = counters.get(REDUCER_COMPLETION_TIMES_COUNTER_GROUP)
+        if not completion_times:
+            continue
+        for reducer, elapsed_ms in sorted(completion_times.items()):
+            logger.info("Step %d, %s: %d ms" % (step_num + 1, reducer, elapsed_ms))
+        mean_ms = sum(completion_times.values()) / len(completion_times)
+        logger.info("Step %d: slowest reducer took %.2f times the average of %.0f ms"
+                    % (step_num + 1, max(completion_times.values()) / max(mean_ms, 1), mean_ms))
+
+
+if __name__ == '__main__':
+    AmazonReviewsChiSquaredPartitioned.run()
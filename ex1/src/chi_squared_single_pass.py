@@ -0,0 +1,147 @@
+import logging
+import time
+from collections import defaultdict
+from itertools import chain
+
+from chi_squared import TERM_COUNTS_KEY
+from chi_squared_partitioned import AmazonReviewsChiSquaredPartitioned
+from tokenizer import unique_terms
+
+logger = logging.getLogger(__name__)
+
+# reserved "term" under which the mappers emit the per-category document counts
+# (the empty string sorts before every real term, so reducers receive the counts first)
+CATEGORY_COUNTS_TERM = ""
+
+
+class AmazonReviewsChiSquaredSinglePass(AmazonReviewsChiSquaredPartitioned):
+    """
+    This job calculates the chi-squared statistic for each pair of category and term in the dataset
+    in a single pass over the input, i.e. without running the CategoryCounter job first.
+
+    The mappers count the documents per category alongside the terms and emit these counts under a reserved term
+    to every partition. As the values of each partition are sorted (secondary sort), each reducer receives
+    the category counts before any of the terms of its partition (order inversion).
+
+    As the categories are not known up front, the mappers emit category names. The reducers encode them as ids
+    once they have received the category counts and decode them again for their partial top K terms.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Initialize the job.
+        :param args: Positional arguments.
+        :param kwargs: Keyword arguments.
+        """
+        super().__init__(*args, **kwargs)
+
+        # dictionary of category counts seen by the mapper
+        self.mapper_category_counts = None
+
+    def mapper_init(self):
+        """
+        Initialize the mapper.
+        Create the review parser, load the stopwords and the partitioning of the terms.
+        :return: Nothing.
+        """
+        super().mapper_init()
+        self.mapper_category_counts = defaultdict(int)
+
+    def load_category_ids(self):
+        """
+        The categories are not known up front, so the mappers emit category names.
+        :return: None.
+        """
+        return None
+
+    def mapper(self, _, line):
+        """
+        Map each review to a set of unique terms and count the review for its category.
+        :param _: A key.
+        Unused.
+        :param line: A single line of the input file.
+        Represents a single review.
+        :return: Yields the routing key of the term and a tuple of the form (term, category, 1).
+        """
+        # extract the product category and the review text from the json data of the line
+        category, text = self.parse_review(line)
+
+        # count the document for its category, emitted in mapper_final
+        self.mapper_category_counts[category] += 1
+
+        # iterate over the unique terms (without stopwords) and emit them with the category
+        for term in unique_terms(text, self.stopwords):
+            # emit the routing key, the term and the category
+            yield from self.emit((term, category))
+
+    def mapper_final(self):
+        """
+        Flush the records buffered by in-mapper combining and emit the category counts of the mapper to every partition.
+        :return: Yields the routing key and a tuple of the form (term, category, count).
+        """
+        yield from super().mapper_final()
+
+        for routing_key in self.term_partitioner.routing_keys:
+            for category, count in self.mapper_category_counts.items():
+                yield routing_key, (CATEGORY_COUNTS_TERM, category, count)
+
+    def reducer_init(self):
+        """
+        Initialize the reducer.
+        The category counts are not read from file but received from the mappers.
+        :return: Nothing.
+        """
+        self.reducer_start_time = time.time()
+
+    def reducer(self, key, values):
+        """
+        Calculate the chi-squared statistic for each term and category of a partition.
+        :param key: A routing key.
+        :param values: List of tuples of the form (term, category, count), sorted by term.
+        The category counts (reserved term) come first.
+        :return: Yields None and a tuple of the form (category id, chi-squared, term).
+        With --term-counts-store or --term-counts-matrix, also yields a tuple of the form
+        (TERM_COUNTS_KEY, CATEGORY_COUNTS_TERM, category) and the number of reviews of each category, which the runner
+        needs for writing the counts (the counts of the terms are indexed like the sorted categories).
+        """
+        # sum up the category counts of all mappers
+        category_counts = defaultdict(int)
+        values = iter(values)
+        for value in values:
+            term, category, count = value
+            if term != CATEGORY_COUNTS_TERM:
+                break
+            category_counts[category] += count
+        else:
+            # the partition does not contain any terms
+            return
+
+        if not category_counts:
+            raise ValueError("Category counts for partition %s were not received before the terms" % key)
+
+        # encode the categories as ids
+        self.categories = sorted(category_counts)
+        self.category_ids = {category: category_id for category_id, category in enumerate(self.categories)}
+        self.category_counts = [category_counts[category] for category in self.categories]
+        self.n = sum(self.category_counts)
+
+        if self.options.term_counts_store or self.options.term_counts_matrix:
+            # every partition receives the counts of all mappers, so every reducer sends the same totals
+            for category, count in zip(self.categories, self.category_counts):
+                yield (TERM_COUNTS_KEY, CATEGORY_COUNTS_TERM, category), count
+
+        # put back the first value of the terms
+        encoded_values = ((term, self.category_ids[category], count) for term, category, count in chain([value], values))
+        yield from super().reducer(key, encoded_values)
+
+    def reducer_final_partial_top_k(self):
+        """
+        Report the time the reducer took and emit the top K terms of the reducer for each category.
+        :return: Yields the category and a tuple of the form (chi-squared, term) for each of its top K terms.
+        """
+        for category, value in super().reducer_final_partial_top_k():
+            yield self.categories[category], value
+
+
+if __name__ == '__main__':
+    AmazonReviewsChiSquaredSinglePass.run()
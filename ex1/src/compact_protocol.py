@@ -0,0 +1,126 @@
+"""
+Compact internal protocol for the intermediate data of the review jobs.
+
+mrjob's default JSON protocol writes every (category, 1) tuple as text such as ["Health_and_Personal_Care", 1].
+CompactProtocol writes flat, tagged fields instead and encodes the category names of the dataset as small integers:
+
+- int: the decimal number (identical to JSON, so the routing keys of term_partitioner.py work unchanged)
+- category: "c" followed by its index in CATEGORIES
+- other strings: "s" followed by the string
+- float: "f" followed by repr() of the float
+- None: "n"
+
+The fields of a tuple are joined by FIELD_SEPARATOR. A tuple with a single field gets a trailing separator, so that it
+is not decoded as a scalar, and the empty tuple is encoded as the empty string. Hadoop streaming splits records at
+newlines and tabs, so the protocol stays line based (a length-prefixed binary encoding would need the typed bytes format, which mrjob does
+not support). Strings must therefore not contain tabs, newlines or FIELD_SEPARATOR, which holds for the terms
+(see tokenizer.py) and the category names. The separator sorts before all printable characters, so sorting
+encoded values keeps the order needed for secondary sort (the reserved empty term still comes first).
+"""
+
+# separator of the fields of a tuple
+FIELD_SEPARATOR = "\x1f"
+
+# the categories of the reviews dataset, encoded by their index
+# (the values exactly as in the "category" field of the reviews, which truncates some names, e.g. "Book")
+CATEGORIES = [
+    "Apps_for_Android", "Automotive", "Baby", "Beauty", "Book", "CDs_and_Vinyl", "Cell_Phones_and_Accessorie",
+    "Clothing_Shoes_and_Jewelry", "Digital_Music", "Electronic", "Grocery_and_Gourmet_Food",
+    "Health_and_Personal_Care", "Home_and_Kitche", "Kindle_Store", "Movies_and_TV", "Musical_Instrument",
+    "Office_Product", "Patio_Lawn_and_Garde", "Pet_Supplie", "Sports_and_Outdoor", "Tools_and_Home_Improvement",
+    "Toys_and_Game",
+]
+CATEGORY_IDS = {category: category_id for category_id, category in enumerate(CATEGORIES)}
+
+
+def encode_field(field):
+    """
+    Encode a single field.
+    :param field: An int, float, string or None.
+    :return: The encoded field.
+    """
+    if isinstance(field, str):
+        category_id = CATEGORY_IDS.get(field)
+        if category_id is not None:
+            return "c%d" % category_id
+        return "s" + field
+    if field is None:
+        return "n"
+    if isinstance(field, float):
+        return "f" + repr(field)
+    if isinstance(field, int):
+        return str(field)
+    raise TypeError("CompactProtocol cannot encode %r" % (field,))
+
+
+def decode_field(field):
+    """
+    Decode a single field.
+    :param field: The encoded field.
+    :return: The decoded int, float, string or None.
+    """
+    tag = field[:1]
+    if tag == "s":
+        return field[1:]
+    if tag == "c":
+        return CATEGORIES[int(field[1:])]
+    if tag == "f":
+        return float(field[1:])
+    if tag == "n":
+        return None
+    return int(field)
+
+
+def encode(data):
+    """
+    Encode a key or value.
+    :param data: A single field or a tuple/list of fields.
+    :return: The encoded data.
+    """
+    if isinstance(data, (tuple, list)):
+        if len(data) == 1:
+            return encode_field(data[0]) + FIELD_SEPARATOR
+        return FIELD_SEPARATOR.join(encode_field(field) for field in data)
+    return encode_field(data)
+
+
+def decode(data):
+    """
+    Decode a key or value.
+    :param data: The encoded data.
+    :return: A single field or a tuple of fields.
+    """
+    if not data:
+        return ()
+    if FIELD_SEPARATOR in data:
+        fields = data.split(FIELD_SEPARATOR)
+        # the trailing separator of a tuple with a single field
+        # (an encoded field is never empty, so the last field can only be empty in this case)
+        if fields[-1] == "":
+            fields.pop()
+        return tuple(decode_field(field) for field in fields)
+    return decode_field(data)
+
+
+class CompactProtocol(object):
+    """
+    mrjob protocol writing keys and values with the compact encoding.
+    """
+
+    def read(self, line):
+        """
+        Decode a line into a key and a value.
+        :param line: A line (bytes) of the form key<tab>value.
+        :return: A tuple of the form (key, value).
+        """
+        key, value = line.decode("utf-8").split("\t", 1)
+        return decode(key), decode(value)
+
+    def write(self, key, value):
+        """
+        Encode a key and a value into a line.
+        :param key: The key.
+        :param value: The value.
+        :return: A line (bytes) of the form key<tab>value.
+        """
+        return ("%s\t%s" % (encode(key), encode(value))).encode("utf-8")
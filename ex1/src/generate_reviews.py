@@ -0,0 +1,332 @@
+"""
+Generator of synthetic review corpora in the format of the Amazon reviews dataset (JSON lines), for scale testing.
+
+The generator learns from a sample of a real reviews file (the first --sample-lines lines)
+- the prior probability of each category,
+- the distribution of the review lengths (in tokens),
+- the fraction and the distribution of the tokens the jobs discard (stopwords and tokens shorter than two characters),
+- for each category, the ranking of its terms by frequency and the exponent of a Zipf distribution fitted to the
+  frequencies (a term of rank r is drawn with a probability proportional to r ** -exponent),
+- for each category, the exponent of Heaps' law fitted to the growth of its vocabulary over the sample (a text of n
+  terms has about K * n ** exponent distinct terms),
+
+and writes any number of reviews drawn from these distributions with a fixed seed, e.g. 10 or 100 times the size of
+the devset (--scale). The same seed, sample and size always yield the same file.
+
+A larger corpus has more distinct terms than the sample, which grows the shuffled data and the state of the reducers.
+The vocabulary of each category therefore grows with the number of terms generated for it, following its Heaps' law
+(anchored at the vocabulary size of the sample): once more terms have been generated than the sample had, the Zipf
+distribution is extended by new, synthetic terms (see synthetic_terms()) beyond the ranks of the sampled terms. The
+new terms are shared by the categories, like the rare terms of real reviews.
+"""
+import argparse
+import json
+from collections import Counter, defaultdict
+from itertools import islice
+
+import numpy as np
+
+from review_parser import get_review_parser
+from tokenizer import MIN_TERM_LENGTH, load_stopwords, tokenize
+
+# Zipf exponent used if there are too few frequencies to fit it
+DEFAULT_ZIPF_EXPONENT = 1.0
+
+# Heaps' law exponent used if the vocabulary growth of a category cannot be fitted (a typical value for English text)
+DEFAULT_HEAPS_EXPONENT = 0.5
+
+# letters of the synthetic terms
+SYNTHETIC_TERM_LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+
+def fit_zipf_exponent(frequencies):
+    """
+    Fit the exponent of a Zipf distribution to term frequencies with a least squares fit in log-log space.
+    Terms seen only once are not used for the fit, as their frequencies are dominated by sampling noise.
+    :param frequencies: The term frequencies, sorted in descending order.
+    :return: The exponent.
+    """
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    frequencies = frequencies[frequencies > 1]
+    if len(frequencies) < 2:
+        return DEFAULT_ZIPF_EXPONENT
+    slope, _ = np.polyfit(np.log(np.arange(1, len(frequencies) + 1)), np.log(frequencies), 1)
+    return -slope
+
+
+def fit_heaps_exponent(term_counts, vocabulary_sizes):
+    """
+    Fit the exponent of Heaps' law to the growth of a vocabulary with a least squares fit in log-log space.
+    :param term_counts: The number of terms seen at several points of a text, ascending.
+    :param vocabulary_sizes: The number of distinct terms seen at these points.
+    :return: The exponent (between 0 and 1).
+    """
+    term_counts = np.asarray(term_counts, dtype=np.float64)
+    vocabulary_sizes = np.asarray(vocabulary_sizes, dtype=np.float64)
+    # the first terms are almost all new, which says nothing about the growth
+    fitted = (term_counts >= 100) & (vocabulary_sizes > 0)
+    if fitted.sum() < 2 or len(np.unique(term_counts[fitted])) < 2:
+        return DEFAULT_HEAPS_EXPONENT
+    slope, _ = np.polyfit(np.log(term_counts[fitted]), np.log(vocabulary_sizes[fitted]), 1)
+    return float(np.clip(slope, 0.0, 1.0))
+
+
+def synthetic_terms(excluded):
+    """
+    Generate the new terms of a growing vocabulary: strings of at least MIN_TERM_LENGTH lowercase letters, which the
+    tokenizer keeps as they are.
+    :param excluded: A set of terms which must not be generated (the terms of the sample and the stopwords).
+    :return: Yields the terms in a fixed order.
+    """
+    base = len(SYNTHETIC_TERM_LETTERS)
+    index = 0
+    while True:
+        # bijective base 26 numeral of the index, padded to the minimum length
+        letters = []
+        number = index + 1
+        while number:
+            number, remainder = divmod(number - 1, base)
+            letters.append(SYNTHETIC_TERM_LETTERS[remainder])
+        term = "".join(reversed(letters)).rjust(MIN_TERM_LENGTH, SYNTHETIC_TERM_LETTERS[0])
+        index += 1
+        if term not in excluded:
+            yield term
+
+
+class ReviewModel:
+    """
+    Distributions of categories, review lengths and terms learned from a sample of reviews.
+    """
+
+    def __init__(self, categories, category_priors, review_lengths, discarded_rate, discarded_tokens,
+                 discarded_probabilities, category_terms, category_exponents, category_num_terms=None,
+                 heaps_exponents=None):
+        """
+        Initialize the model.
+        :param categories: The list of categories.
+        :param category_priors: The probability of each category.
+        :param review_lengths: The lengths (in tokens) of the sampled reviews.
+        :param discarded_rate: The fraction of tokens that are stopwords or too short.
+        :param discarded_tokens: The stopwords and short tokens seen in the sample.
+        :param discarded_probabilities: The probability of each of the discarded tokens.
+        :param category_terms: For each category, the list of its terms ordered by frequency.
+        :param category_exponents: For each category, the exponent of the Zipf distribution of its terms.
+        :param category_num_terms: For each category, the number of terms (excluding stopwords and short tokens) of its
+        sampled reviews (default: the vocabulary does not grow).
+        :param heaps_exponents: For each category, the exponent of Heaps' law of its vocabulary.
+        """
+        self.categories = categories
+        self.category_priors = np.asarray(category_priors)
+        self.review_lengths = np.asarray(review_lengths)
+        self.discarded_rate = discarded_rate
+        self.discarded_tokens = np.asarray(discarded_tokens, dtype=object)
+        self.discarded_probabilities = np.asarray(discarded_probabilities)
+        self.category_terms = [np.asarray(terms, dtype=object) for terms in category_terms]
+        self.category_exponents = category_exponents
+        self.category_num_terms = category_num_terms
+        self.heaps_exponents = heaps_exponents
+        # cumulative Zipf weights of the ranks of each category, extended as its vocabulary grows
+        self.category_cumulative_weights = [np.cumsum(np.arange(1, len(terms) + 1, dtype=np.float64) ** -exponent)
+                                            for terms, exponent in zip(category_terms, category_exponents)]
+        # the new terms drawn beyond the sampled terms, and the generator extending them
+        self.new_terms = np.empty(0, dtype=object)
+        self.new_term_generator = synthetic_terms(
+            {term for terms in category_terms for term in terms} | set(discarded_tokens))
+        # number of terms generated for each category so far (reset by generate())
+        self.generated_num_terms = [0] * len(categories)
+
+    @classmethod
+    def learn(cls, lines, parse_review, stopwords):
+        """
+        Learn the distributions from a sample of reviews.
+        :param lines: The sampled lines of a reviews file.
+        :param parse_review: A function parsing a line into a tuple of the form (category, review text).
+        :param stopwords: A (frozen) set of stopwords.
+        :return: A ReviewModel.
+        """
+        category_counts = Counter()
+        review_lengths = []
+        discarded_counts = Counter()
+        term_counts = defaultdict(Counter)
+        # number of terms and distinct terms of each category after each review, for fitting Heaps' law
+        growth = defaultdict(list)
+        num_tokens = 0
+        for line in lines:
+            category, text = parse_review(line)
+            category_counts[category] += 1
+            tokens = [token for token in tokenize(text) if token]
+            review_lengths.append(len(tokens))
+            num_tokens += len(tokens)
+            for token in tokens:
+                if token in stopwords or len(token) < MIN_TERM_LENGTH:
+                    discarded_counts[token] += 1
+                else:
+                    term_counts[category][token] += 1
+            category_growth = growth[category]
+            num_terms = category_growth[-1][0] if category_growth else 0
+            num_terms += sum(1 for token in tokens if token not in stopwords and len(token) >= MIN_TERM_LENGTH)
+            category_growth.append((num_terms, len(term_counts[category])))
+
+        categories = sorted(category_counts)
+        num_reviews = sum(category_counts.values())
+        # sort by frequency and term, so that the model does not depend on the order of the sample
+        discarded = sorted(discarded_counts.items(), key=lambda item: (-item[1], item[0]))
+        num_discarded = sum(discarded_counts.values())
+        category_terms = []
+        category_exponents = []
+        for category in categories:
+            ranked = sorted(term_counts[category].items(), key=lambda item: (-item[1], item[0]))
+            category_terms.append([term for term, _ in ranked])
+            category_exponents.append(fit_zipf_exponent([count for _, count in ranked]))
+
+        return cls(categories, [category_counts[category] / num_reviews for category in categories], review_lengths,
+                   num_discarded / max(num_tokens, 1), [token for token, _ in discarded],
+                   [count / max(num_discarded, 1) for _, count in discarded], category_terms, category_exponents,
+                   [growth[category][-1][0] for category in categories],
+                   [fit_heaps_exponent(*zip(*growth[category])) for category in categories])
+
+    def vocabulary_size(self, category_id, num_terms):
+        """
+        Get the size of the vocabulary of a category after generating a number of its terms (Heaps' law).
+        :param category_id: The category id.
+        :param num_terms: The number of terms generated for the category.
+        :return: The number of ranks of the Zipf distribution of the category.
+        """
+        num_sampled = len(self.category_terms[category_id])
+        if self.category_num_terms is None or not self.category_num_terms[category_id]:
+            return num_sampled
+        growth = (num_terms / self.category_num_terms[category_id]) ** self.heaps_exponents[category_id]
+        return max(num_sampled, int(round(num_sampled * growth)))
+
+    def draw_terms(self, category_id, num_positions, rng):
+        """
+        Draw the terms of a category, growing its vocabulary by the number of drawn terms.
+        :param category_id: The category id.
+        :param num_positions: The number of terms to draw.
+        :param rng: A numpy random Generator.
+        :return: An array of terms.
+        """
+        self.generated_num_terms[category_id] += num_positions
+        vocabulary_size = self.vocabulary_size(category_id, self.generated_num_terms[category_id])
+
+        cumulative_weights = self.category_cumulative_weights[category_id]
+        if vocabulary_size > len(cumulative_weights):
+            ranks = np.arange(len(cumulative_weights) + 1, vocabulary_size + 1, dtype=np.float64)
+            new_weights = ranks ** -self.category_exponents[category_id]
+            cumulative_weights = np.concatenate((cumulative_weights, cumulative_weights[-1:] + np.cumsum(new_weights)))
+            self.category_cumulative_weights[category_id] = cumulative_weights
+
+        # draw the ranks by inverting the cumulative distribution
+        ranks = np.searchsorted(cumulative_weights, rng.random(num_positions) * cumulative_weights[-1], side="right")
+        ranks = np.minimum(ranks, len(cumulative_weights) - 1)
+
+        terms = self.category_terms[category_id]
+        drawn = np.empty(num_positions, dtype=object)
+        sampled = ranks < len(terms)
+        drawn[sampled] = terms[ranks[sampled]]
+        if not sampled.all():
+            new_ranks = ranks[~sampled] - len(terms)
+            num_new_terms = new_ranks.max() + 1
+            if num_new_terms > len(self.new_terms):
+                extension = list(islice(self.new_term_generator, num_new_terms - len(self.new_terms)))
+                self.new_terms = np.concatenate((self.new_terms, np.asarray(extension, dtype=object)))
+            drawn[~sampled] = self.new_terms[new_ranks]
+        return drawn
+
+    def generate_texts(self, categories, rng):
+        """
+        Generate the review texts of a batch of reviews.
+        :param categories: An array with the category id of each review.
+        :param rng: A numpy random Generator.
+        :return: A list of review texts.
+        """
+        lengths = rng.choice(self.review_lengths, size=len(categories))
+        # category of each token position
+        token_categories = np.repeat(categories, lengths)
+        tokens = np.empty(len(token_categories), dtype=object)
+
+        # positions of stopwords and short tokens
+        discarded = rng.random(len(tokens)) < self.discarded_rate
+        num_discarded = discarded.sum()
+        if num_discarded:
+            tokens[discarded] = self.discarded_tokens[
+                rng.choice(len(self.discarded_tokens), size=num_discarded, p=self.discarded_probabilities)]
+
+        for category_id, terms in enumerate(self.category_terms):
+            positions = ~discarded & (token_categories == category_id)
+            num_positions = positions.sum()
+            if not num_positions:
+                continue
+            if len(terms):
+                tokens[positions] = self.draw_terms(category_id, num_positions, rng)
+            else:
+                # no terms of the category in the sample
+                tokens[positions] = ""
+
+        return [" ".join(review_tokens) for review_tokens in np.split(tokens, np.cumsum(lengths)[:-1])]
+
+    def generate(self, num_reviews, seed=42, batch_size=10000):
+        """
+        Generate reviews.
+        :param num_reviews: The number of reviews.
+        :param seed: The seed of the random number generator.
+        :param batch_size: The number of reviews generated at once.
+        :return: Yields the reviews as JSON lines (without newline), in the field order of the reviews dataset.
+        """
+        rng = np.random.default_rng(seed)
+        self.generated_num_terms = [0] * len(self.categories)
+        for batch_start in range(0, num_reviews, batch_size):
+            batch_categories = rng.choice(len(self.categories), size=min(batch_size, num_reviews - batch_start),
+                                          p=self.category_priors)
+            texts = self.generate_texts(batch_categories, rng)
+            ratings = rng.integers(1, 6, size=len(texts))
+            for offset, (category_id, text, rating) in enumerate(zip(batch_categories.tolist(), texts,
+                                                                     ratings.tolist())):
+                index = batch_start + offset
+                yield json.dumps({
+                    "reviewerID": "SYN%011d" % index,
+                    "asin": "S%09d" % (index % 1000000),
+                    "reviewerName": "synthetic",
+                    "helpful": [0, 0],
+                    "reviewText": text,
+                    "overall": float(rating),
+                    "summary": " ".join(text.split(" ", 3)[:3]),
+                    "unixReviewTime": 1388534400,
+                    "reviewTime": "01 1, 2014",
+                    "category": self.categories[category_id],
+                })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic reviews file learned from a real one.")
+    parser.add_argument("-i", "--input", type=str, help="Path to the reviews file to learn from.",
+                        default="../data/reviews_devset.json")
+    parser.add_argument("-s", "--stopwords", type=str, help="Path to the stopwords file.", default="stopwords.txt")
+    parser.add_argument("-o", "--output", type=str, help="Path of the generated reviews file.",
+                        default="../data/reviews_synthetic.json")
+    parser.add_argument("--sample-lines", type=int, default=100000,
+                        help="Number of lines of the input file to learn from.")
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument("-n", "--num-reviews", type=int, help="Number of reviews to generate.")
+    size.add_argument("--scale", type=float, default=1.0,
+                      help="Number of reviews to generate, as a multiple of the number of reviews in the input file.")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the random number generator.")
+    args = parser.parse_args()
+
+    with open(args.input, "r") as f:
+        model = ReviewModel.learn(islice(f, args.sample_lines), get_review_parser(), load_stopwords(args.stopwords))
+
+    num_reviews = args.num_reviews
+    if num_reviews is None:
+        with open(args.input, "rb") as f:
+            num_reviews = round(sum(1 for _ in f) * args.scale)
+
+    print(f"Learned {len(model.categories)} categories, "
+          f"{sum(len(terms) for terms in model.category_terms)} terms "
+          f"(Zipf exponents {min(model.category_exponents):.2f} to {max(model.category_exponents):.2f}, "
+          f"Heaps exponents {min(model.heaps_exponents):.2f} to {max(model.heaps_exponents):.2f}), "
+          f"{model.discarded_rate:.1%} stopwords and short tokens")
+    with open(args.output, "w") as f:
+        for line in model.generate(num_reviews, args.seed):
+            f.write(line + "\n")
+    print(f"Wrote {num_reviews} reviews ({len(model.new_terms)} new terms beyond the sample) to '{args.output}'")
@@ -0,0 +1,371 @@
+"""
+Local multiprocess execution engine for the review jobs.
+
+mrjob's inline runner executes every task of a job one after the other in a single process. MultiprocessRunner runs
+the steps of a job the way Hadoop streaming does, but on the cores of the local machine:
+
+- the input files are split into byte ranges (a line belongs to the split it starts in, as with Hadoop's
+  LineRecordReader) and the map tasks run in a process pool
+- each map task partitions its output with the hash function of Hadoop's partitioner (HashPartitioner, or
+  KeyFieldBasedPartitioner for jobs with secondary sort), sorts each partition, runs the combiner on it and writes it
+  to a file in a temporary directory (spill)
+- the reduce tasks run in the process pool, each merging the sorted files of its partition while reading them, and
+  write their output to files, which are the input of the next step (or the output of the job)
+
+The records of a step are thus never held in the parent process: it only passes the paths of the files to the tasks.
+A map task holds the output of its split in memory for sorting it (the splits are at most MAX_SPLIT_BYTES), a reduce
+task only the records of the current key. The temporary directory (in the directory of the tempfile module, i.e.
+TMPDIR) needs space for the map output of a step and the output of the job, and is removed when the runner is closed.
+
+The records are encoded with the protocols of the job between the tasks, so reducers see exactly the keys and
+values (and their order) they see on Hadoop, and the output is identical to that of the Hadoop runner.
+The tasks run in the current working directory, so the files of the job (see AmazonReviewsJob.FILES) have to be there.
+
+The runner offers the part of the interface of mrjob's runners used by runner.py (run(), cat_output(), counters()
+and fs) and is selected with --processes (see make_runner()).
+"""
+import logging
+import math
+import heapq
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+from io import BytesIO
+
+from mrjob.fs.local import LocalFilesystem
+from mrjob.parse import parse_mr_job_stderr
+
+logger = logging.getLogger(__name__)
+
+# maximum size of an input split in bytes
+MAX_SPLIT_BYTES = 64 * 1024 * 1024
+
+# counter with the number of bytes shuffled to the reducers (named as on Hadoop)
+SHUFFLE_COUNTER_GROUP = "Map-Reduce Framework"
+SHUFFLE_COUNTER = "Map output materialized bytes"
+
+
+def java_hash_partition(key, num_reducers, initial_hash):
+    """
+    Get the reducer a key is assigned to by Hadoop's hash partitioners.
+    :param key: The key as written by the job (bytes).
+    :param num_reducers: The number of reducers.
+    :param initial_hash: 1 for HashPartitioner (Text.hashCode()), 0 for KeyFieldBasedPartitioner.
+    :return: The reducer number.
+    """
+    current_hash = initial_hash
+    for byte in key:
+        # signed bytes and 32-bit integer overflow as in Java
+        if byte > 127:
+            byte -= 256
+        current_hash = (31 * current_hash + byte) & 0xFFFFFFFF
+    return (current_hash & 0x7FFFFFFF) % num_reducers
+
+
+def split_input(paths, num_splits):
+    """
+    Split the input files into byte ranges.
+    :param paths: The paths of the input files.
+    :param num_splits: The desired number of splits (of the whole input).
+    :return: A list of tuples of the form (path, start, end).
+    """
+    sizes = [os.path.getsize(path) for path in paths]
+    split_bytes = min(MAX_SPLIT_BYTES, max(1, math.ceil(sum(sizes) / max(num_splits, 1))))
+    return [(path, start, min(start + split_bytes, size))
+            for path, size in zip(paths, sizes) for start in range(0, size, split_bytes)]
+
+
+def read_split(path, start, end):
+    """
+    Read the lines of a byte range of a file.
+    A split that does not start at the beginning of the file skips its first line, which is read by the previous split
+    (a split reads the line starting at its end), so every line is read exactly once.
+    :param path: The path of the file.
+    :param start: The first byte of the split.
+    :param end: The end of the split (exclusive).
+    :return: Yields the lines (bytes, without line ending).
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        if start:
+            f.readline()
+        position = f.tell()
+        while position <= end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line.rstrip(b"\r\n")
+
+
+def _create_job(job_class, job_args, num_reducers, task_partition):
+    """
+    Create a fresh job instance for a task, with the task's job configuration in the environment.
+    :param job_class: The class of the job.
+    :param job_args: The command line arguments of the job.
+    :param num_reducers: The number of reducers of the step.
+    :param task_partition: The number of the task.
+    :return: The job (sandboxed, so that counters are written to job.stderr).
+    """
+    os.environ["mapreduce_job_reduces"] = str(num_reducers)
+    os.environ["mapreduce_task_partition"] = str(task_partition)
+    job = job_class(args=job_args)
+    job.sandbox(stderr=BytesIO())
+    return job
+
+
+def _write_records(write, pairs):
+    """
+    Encode records with a protocol.
+    :param write: The write function of the protocol.
+    :param pairs: Iterable of tuples of the form (key, value).
+    :return: A list of lines (bytes).
+    """
+    return [write(key, value) for key, value in pairs]
+
+
+def _write_lines(path, lines):
+    """
+    Write lines to a file.
+    :param path: The path of the file.
+    :param lines: Iterable of lines (bytes, without line ending).
+    :return: Nothing.
+    """
+    with open(path, "wb") as f:
+        for line in lines:
+            f.write(line + b"\n")
+
+
+def _read_lines(path):
+    """
+    Read the lines written by _write_lines().
+    :param path: The path of the file.
+    :return: Yields the lines (bytes, without line ending).
+    """
+    with open(path, "rb") as f:
+        for line in f:
+            yield line[:-1]
+
+
+def _read_records(read, lines):
+    """
+    Decode records with a protocol.
+    :param read: The read function of the protocol.
+    :param lines: Iterable of lines (bytes).
+    :return: Yields tuples of the form (key, value).
+    """
+    for line in lines:
+        yield read(line)
+
+
+def _run_map_task(job_class, job_args, step_num, task_num, split, num_reducers, sort_values, output_dir):
+    """
+    Run a map task: the mapper (if the step has one) on a split, then partition, sort and combine its output and write
+    each partition to a file.
+    :param job_class: The class of the job.
+    :param job_args: The command line arguments of the job.
+    :param step_num: The number of the step.
+    :param task_num: The number of the task.
+    :param split: A tuple of the form (path, start, end) for the input files,
+    or a list of the paths of output files of the previous step.
+    :param num_reducers: The number of reducers.
+    :param sort_values: Whether the job uses secondary sort (and KeyFieldBasedPartitioner).
+    :param output_dir: The directory to write the partitions to.
+    :return: A tuple of the form (list with the path of each partition, stderr of the task).
+    """
+    job = _create_job(job_class, job_args, num_reducers, task_num)
+    step = job.steps()[step_num]
+
+    if isinstance(split, tuple):
+        lines = read_split(*split)
+    else:
+        lines = (line for path in split for line in _read_lines(path))
+    if step.has_explicit_mapper:
+        read, write = job.pick_protocols(step_num, "mapper")
+        lines = _write_records(write, job.map_pairs(_read_records(read, lines), step_num))
+
+    # partition on the key, i.e. everything before the first tab
+    partitions = [[] for _ in range(num_reducers)]
+    initial_hash = 0 if sort_values else 1
+    for line in lines:
+        key = line.split(b"\t", 1)[0]
+        partitions[java_hash_partition(key, num_reducers, initial_hash)].append(line)
+
+    paths = []
+    for partition_num, partition in enumerate(partitions):
+        partition.sort()
+        if step.has_explicit_combiner and partition:
+            read, write = job.pick_protocols(step_num, "combiner")
+            # sort the combined lines again, as the reduce tasks merge the sorted files of the map tasks
+            partition = sorted(_write_records(write, job.combine_pairs(_read_records(read, partition), step_num)))
+        path = os.path.join(output_dir, "map-%05d-part-%05d" % (task_num, partition_num))
+        _write_lines(path, partition)
+        paths.append(path)
+
+    return paths, job.stderr.getvalue()
+
+
+def _run_reduce_task(job_class, job_args, step_num, task_num, paths, num_reducers, output_dir):
+    """
+    Run a reduce task on its partition, merging the sorted files of the map tasks.
+    :param job_class: The class of the job.
+    :param job_args: The command line arguments of the job.
+    :param step_num: The number of the step.
+    :param task_num: The number of the task (the partition).
+    :param paths: The paths of the sorted files of the partition.
+    :param num_reducers: The number of reducers.
+    :param output_dir: The directory to write the output to.
+    :return: A tuple of the form (path of the output file, stderr of the task).
+    """
+    job = _create_job(job_class, job_args, num_reducers, task_num)
+    read, write = job.pick_protocols(step_num, "reducer")
+    lines = heapq.merge(*(_read_lines(path) for path in paths))
+    output_path = os.path.join(output_dir, "part-%05d" % task_num)
+    pairs = job.reduce_pairs(_read_records(read, lines), step_num)
+    _write_lines(output_path, (write(key, value) for key, value in pairs))
+    return output_path, job.stderr.getvalue()
+
+
+def format_counters(counters):
+    """
+    Format the counters of a step like mrjob's runners log them.
+    :param counters: A dictionary of the form {group: {counter: amount}}.
+    :return: The formatted counters.
+    """
+    lines = ["Counters: %d" % sum(len(group_counters) for group_counters in counters.values())]
+    for group, group_counters in sorted(counters.items()):
+        lines.append("\t%s" % group)
+        for counter, amount in sorted(group_counters.items()):
+            lines.append("\t\t%s=%s" % (counter, amount))
+    return "\n".join(lines)
+
+
+class MultiprocessRunner:
+    """
+    Runs a job on the local machine with a pool of processes.
+    """
+
+    def __init__(self, job, job_args, num_processes=None):
+        """
+        Initialize the runner.
+        :param job: The job to run.
+        :param job_args: The command line arguments the job was created with (used for creating the job in the tasks).
+        :param num_processes: The number of processes (default: the number of cores).
+        """
+        self.job = job
+        self.job_args = list(job_args)
+        self.num_processes = num_processes or os.cpu_count()
+        self.fs = LocalFilesystem()
+        # temporary directory with the files of the steps
+        self.tmp_dir = None
+        # paths of the files with the final output of the job
+        self.output_paths = None
+        # counters of each step
+        self.step_counters = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
+
+    def cleanup(self):
+        """
+        Remove the temporary directory with the files of the steps and the output of the job.
+        :return: Nothing.
+        """
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        self.tmp_dir = None
+        self.output_paths = None
+
+    def num_reducers(self):
+        """
+        Get the number of reducers from the job configuration (command line --jobconf options take precedence).
+        :return: The number of reducers.
+        """
+        jobconf = dict(self.job.jobconf())
+        jobconf.update(self.job.options.jobconf or {})
+        return int(jobconf.get("mapreduce.job.reduces", 1))
+
+    def run(self):
+        """
+        Run all steps of the job.
+        :return: Nothing.
+        """
+        job_class = type(self.job)
+        num_reducers = self.num_reducers()
+        sort_values = bool(self.job.sort_values())
+
+        self.cleanup()
+        self.tmp_dir = tempfile.mkdtemp(prefix="multiprocess_runner-")
+        self.step_counters = []
+        with multiprocessing.Pool(self.num_processes) as pool:
+            splits = split_input(self.job.options.args, self.num_processes)
+            for step_num, step in enumerate(self.job.steps()):
+                logger.info("Running step %d of %d (%d map tasks, %d reduce tasks, %d processes)..."
+                            % (step_num + 1, len(self.job.steps()), len(splits), num_reducers, self.num_processes))
+                counters = {}
+                step_dir = os.path.join(self.tmp_dir, "step-%d" % step_num)
+                os.mkdir(step_dir)
+
+                map_results = pool.starmap(
+                    _run_map_task,
+                    [(job_class, self.job_args, step_num, task_num, split, num_reducers, sort_values, step_dir)
+                     for task_num, split in enumerate(splits)])
+                for _, stderr in map_results:
+                    parse_mr_job_stderr(stderr, counters)
+
+                if not step.has_explicit_reducer:
+                    # map-only step: the (combined) map output is the output of the step
+                    splits = [paths for paths, _ in map_results]
+                else:
+                    # shuffle: each reduce task merges its partition of the output of all map tasks
+                    partition_paths = [[paths[partition_num] for paths, _ in map_results]
+                                       for partition_num in range(num_reducers)]
+                    counters.setdefault(SHUFFLE_COUNTER_GROUP, {})[SHUFFLE_COUNTER] = sum(
+                        os.path.getsize(path) for paths in partition_paths for path in paths)
+                    reduce_results = pool.starmap(
+                        _run_reduce_task,
+                        [(job_class, self.job_args, step_num, task_num, paths, num_reducers, step_dir)
+                         for task_num, paths in enumerate(partition_paths)])
+                    for _, stderr in reduce_results:
+                        parse_mr_job_stderr(stderr, counters)
+                    splits = [[output_path] for output_path, _ in reduce_results]
+
+                self.step_counters.append(counters)
+                logger.info(format_counters(counters))
+
+        # the output of the job consists of the output of each task, in the order of the tasks
+        self.output_paths = [path for split in splits for path in split]
+
+    def cat_output(self):
+        """
+        Get the output of the job.
+        :return: Yields the output lines (bytes).
+        """
+        for path in self.output_paths:
+            for line in _read_lines(path):
+                yield line + b"\n"
+
+    def counters(self):
+        """
+        Get the counters of the job.
+        :return: A list with a dictionary of the form {group: {counter: amount}} for each step.
+        """
+        return self.step_counters
+
+
+def make_runner(job, job_args=None):
+    """
+    Create the runner for a job: MultiprocessRunner with --processes, otherwise the mrjob runner chosen with -r.
+    :param job: The job.
+    :param job_args: The command line arguments the job was created with (default: the arguments of the script, which
+    a job created without args parses).
+    :return: A runner (to be used as a context manager).
+    """
+    if job.options.processes:
+        return MultiprocessRunner(job, sys.argv[1:] if job_args is None else job_args, job.options.processes)
+    return job.make_runner()
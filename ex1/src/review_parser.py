@@ -0,0 +1,124 @@
+"""
+Parsers extracting the category and the review text from a line of the reviews dataset.
+
+The mappers only need these two fields, so there is no need to materialize a dict with all fields of a review.
+The following parsers are available (see get_review_parser()):
+
+- json: stdlib json.loads() of the whole review (the original implementation)
+- scan: locates the two fields in the raw line and decodes only their string values with the (C-accelerated)
+  string scanner of the stdlib json module. Falls back to json.loads() if a field is not found where expected.
+- orjson: orjson.loads() of the whole review (requires orjson)
+- simdjson: lazy parsing with pysimdjson, only the two fields are converted to Python objects (requires pysimdjson)
+- auto: simdjson if installed, else scan
+"""
+import json
+from json.decoder import scanstring
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+CATEGORY_FIELD = "category"
+TEXT_FIELD = "reviewText"
+
+# prefixes of the string values of the fields as written by json.dumps() (the format of the reviews dataset)
+CATEGORY_VALUE_PREFIX = '"%s": "' % CATEGORY_FIELD
+TEXT_VALUE_PREFIX = '"%s": "' % TEXT_FIELD
+
+
+def parse_review_json(line):
+    """
+    Parse a review by decoding the whole JSON object with the stdlib json module.
+    :param line: A single line of the input file.
+    :return: A tuple of the form (category, review text).
+    """
+    review = json.loads(line)
+    return review[CATEGORY_FIELD], review[TEXT_FIELD]
+
+
+def _scan_field(line, prefix):
+    """
+    Decode the string value of a field of a review without decoding the rest of the line.
+    :param line: A single line of the input file.
+    :param prefix: The key of the field followed by the opening quote of its value.
+    :return: The value of the field, or None if the prefix was not found.
+    """
+    start = line.find(prefix)
+    if start == -1:
+        return None
+    # an unescaped quote can only occur in a key or at the boundaries of a string value,
+    # so the prefix cannot match inside the value of another field
+    value, _ = scanstring(line, start + len(prefix))
+    return value
+
+
+def parse_review_scan(line):
+    """
+    Parse a review by decoding only the values of the category and review text fields.
+    :param line: A single line of the input file.
+    :return: A tuple of the form (category, review text).
+    """
+    category = _scan_field(line, CATEGORY_VALUE_PREFIX)
+    text = _scan_field(line, TEXT_VALUE_PREFIX)
+    if category is None or text is None:
+        # unexpected formatting (e.g. no space after the colon), decode the whole object instead
+        return parse_review_json(line)
+    return category, text
+
+
+def parse_review_orjson(line):
+    """
+    Parse a review by decoding the whole JSON object with orjson.
+    :param line: A single line of the input file.
+    :return: A tuple of the form (category, review text).
+    """
+    review = orjson.loads(line)
+    return review[CATEGORY_FIELD], review[TEXT_FIELD]
+
+
+def make_simdjson_parser():
+    """
+    Create a parser function backed by pysimdjson.
+    The simdjson parser is reused for all lines (each call invalidates the document parsed before).
+    :return: A function parsing a line into a tuple of the form (category, review text).
+    """
+    parser = simdjson.Parser()
+
+    def parse_review_simdjson(line):
+        review = parser.parse(line)
+        return review[CATEGORY_FIELD], review[TEXT_FIELD]
+
+    return parse_review_simdjson
+
+
+REVIEW_PARSERS = ["auto", "json", "scan", "orjson", "simdjson"]
+
+
+def get_review_parser(name="auto"):
+    """
+    Get a review parser by name.
+    :param name: The name of the parser (one of REVIEW_PARSERS).
+    :return: A function parsing a line into a tuple of the form (category, review text).
+    """
+    if name == "auto":
+        name = "simdjson" if simdjson is not None else "scan"
+
+    if name == "json":
+        return parse_review_json
+    if name == "scan":
+        return parse_review_scan
+    if name == "orjson":
+        if orjson is None:
+            raise ImportError("The orjson review parser requires the orjson package")
+        return parse_review_orjson
+    if name == "simdjson":
+        if simdjson is None:
+            raise ImportError("The simdjson review parser requires the pysimdjson package")
+        return make_simdjson_parser()
+    raise ValueError("Unknown review parser '%s', options are %s" % (name, REVIEW_PARSERS))
@@ -2,41 +2,127 @@ import heapq
 import json
 import logging
 from collections import defaultdict
+from itertools import chain, islice
 
+from mrjob.util import to_lines
+
+from amazon_reviews_job import AmazonReviewsJob, log_in_mapper_combining_stats
 from category_counter import CategoryCounter
-from chi_squared import AmazonReviewsChiSquared
+from chi_squared import AmazonReviewsChiSquared, load_category_counts
+from chi_squared_partitioned import AmazonReviewsChiSquaredPartitioned, log_reducer_completion_times
+from multiprocess_runner import make_runner
+from review_parser import get_review_parser
+from term_count_matrix import write_term_count_matrix
+from term_count_store import TermCountStore
+from term_partitioner import TERM_PARTITIONS_FILE, sample_term_partitions
+from tokenizer import load_stopwords
 
 # configure logging
 logging.basicConfig(level=logging.INFO, format="%(message)s")
 logger = logging.getLogger(__name__)
 
 
-def parse_chi_squared_job_output(job, runner):
+def write_term_partitions(job, runner):
+    """
+    Sampling pre-pass: estimate the term frequencies from the first lines of the input
+    and write a balanced partitioning of the terms to the reducers.
+    :param job: The chi squared computation job to partition the terms for.
+    :param runner: A runner providing access to the filesystem of the input.
+    :return: Nothing.
+    """
+    input_paths = job.options.args
+    input_bytes = sum(runner.fs.du(path) for path in input_paths)
+    lines = islice(
+        (line.decode("utf-8") for line in chain.from_iterable(to_lines(runner.fs.cat(path)) for path in input_paths)),
+        job.options.sample_lines)
+
+    partitioner = sample_term_partitions(
+        lines, get_review_parser(job.options.review_parser), load_stopwords("stopwords.txt"), input_bytes,
+        bytes_per_reducer=job.options.bytes_per_reducer * 1024 * 1024, max_reducers=job.options.max_reducers)
+    partitioner.save(TERM_PARTITIONS_FILE)
+    logger.info("Partitioned the terms to %d reducers (%d terms assigned explicitly)"
+                % (partitioner.num_partitions, len(partitioner.assigned_terms)))
+
+
+def parse_chi_squared_job_output(job, runner, top_k=75, categories=None, term_counts=None, category_counts=None):
     """
     Parse the output of the job computing chi squared values.
     :param job: The chi squared computation job to parse the output of.
     :param runner: The runner to use to parse the output.
+    :param top_k: The number of terms to print for each category.
+    :param categories: The list of categories for decoding category ids.
+    If None, the output contains category names.
+    :param term_counts: Dictionary the counts of the terms (output with --term-counts-store or --term-counts-matrix)
+    are added to.
+    :param category_counts: Dictionary the number of reviews of each category is added to (output of the single-pass
+    job with --term-counts-store or --term-counts-matrix, which does not read the category counts from file).
     :return: Nothing.
     """
-    # dictionary to store the 75 terms with the highest chi-squared value for each category
+    # dictionary to store the top K terms with the highest chi-squared value for each category
     # use a default dictionary to avoid having to check if a category is already in the dictionary
     terms_for_category = defaultdict(lambda: [])
 
-    # datastructure to store unique terms
-    unique_terms = set()
-
     # loop through the output of the job in the format category, chi-squared value, term
-    # and extract the 75 terms with the highest chi-squared value for each category
+    # and extract the top K terms with the highest chi-squared value for each category
     # and store them in a dictionary with the category as key and the list of terms as value using a heapq
-    for _, (category, chi_squared_value, term) in job.parse_output(runner.cat_output()):
-        # if the heap of terms for the category has more than 75 elements,
+    for key, value in job.parse_output(runner.cat_output()):
+        if key is not None:
+            # counts of a term (key of the form (TERM_COUNTS_KEY, term)) for the store of term and category counts
+            if len(key) == 3:
+                # number of reviews of a category (key of the form (TERM_COUNTS_KEY, CATEGORY_COUNTS_TERM, category)),
+                # sent by every reducer of the single-pass job
+                if category_counts is not None:
+                    category_counts[key[2]] = value
+            elif term_counts is not None:
+                term_counts[key[1]] = list(value)
+            continue
+        category, chi_squared_value, term = value
+
+        # decode the category id
+        if categories is not None:
+            category = categories[category]
+
+        # if the heap of terms for the category has more than K elements,
         # remove the term with the lowest chi-squared value
-        if len(terms_for_category[category]) >= 75:
+        if len(terms_for_category[category]) >= top_k:
             heapq.heappushpop(terms_for_category[category], (chi_squared_value, term))
         else:
             # add the term to the heap of terms for the category
             heapq.heappush(terms_for_category[category], (chi_squared_value, term))
 
+    print_top_terms(terms_for_category)
+
+
+def write_term_counts(options, categories, category_counts, term_counts):
+    """
+    Write the counts of the chi-squared job to the store (--term-counts-store) and/or the matrix (--term-counts-matrix).
+    :param options: The options of the job.
+    :param categories: The alphabetically sorted list of categories.
+    :param category_counts: The number of reviews of each category (indexed by category id).
+    :param term_counts: Dictionary mapping terms to lists of counts (indexed by category id).
+    :return: Nothing.
+    """
+    if options.term_counts_store:
+        # replace the contents of the store with the counts of the whole input
+        # (runner_incremental.py appends the counts of new input files)
+        segment_path = TermCountStore(options.term_counts_store).replace(
+            options.args, categories, category_counts, sorted(term_counts.items()))
+        logger.info("Wrote the counts of %d terms to %s" % (len(term_counts), segment_path))
+
+    if options.term_counts_matrix:
+        write_term_count_matrix(options.term_counts_matrix, categories, category_counts, sorted(term_counts.items()))
+        logger.info("Wrote the counts of %d terms to the matrix %s" % (len(term_counts), options.term_counts_matrix))
+
+
+def print_top_terms(terms_for_category):
+    """
+    Print the top K terms of each category and the list of all top K terms.
+    :param terms_for_category: Dictionary mapping category names to lists of tuples of the form (chi-squared, term).
+    :return: Nothing.
+    """
+    # datastructure to store unique terms
+    unique_terms = set()
+
     # Sort the dictionary based on the key, i.e. the category names alphabetically
     terms_for_category = dict(sorted(terms_for_category.items()))
 
@@ -59,14 +145,21 @@ if __name__ == "__main__":
     # create the job instances
     job1 = CategoryCounter()
     job2 = AmazonReviewsChiSquared()
+    if job2.options.balance_partitions:
+        # use the job controlling which reducer processes which term
+        job2 = AmazonReviewsChiSquaredPartitioned()
 
     # load the stopwords file, and the category counts file as input files for the jobs
-    job2.FILES = ["./stopwords.txt", "./category_counts.json"]
+    # (in addition to the modules the jobs depend on)
+    job2.FILES = AmazonReviewsJob.FILES + ["./stopwords.txt", "./category_counts.json"]
+    if job2.options.balance_partitions:
+        job2.FILES = job2.FILES + ["./chi_squared.py", "./term_partitioner.py", "./" + TERM_PARTITIONS_FILE]
 
     # run the job using the specified runner
-    with job1.make_runner() as runner1:
+    with make_runner(job1) as runner1:
         # run the job
         runner1.run()
+        log_in_mapper_combining_stats(runner1)
 
         # save the output of the job to a dictionary
         category_counts = defaultdict(int)
@@ -80,9 +173,19 @@ if __name__ == "__main__":
         with open("category_counts.json", "w") as f:
             f.write(json.dumps(category_counts))
 
-    with job2.make_runner() as runner2:
+        if job2.options.balance_partitions:
+            write_term_partitions(job2, runner1)
+
+    with make_runner(job2) as runner2:
         # run the job
         runner2.run()
+        log_in_mapper_combining_stats(runner2)
+        log_reducer_completion_times(runner2)
 
         # parse the output of the job and print the results
-        parse_chi_squared_job_output(job2, runner2)
+        categories, category_count_list, _ = load_category_counts("category_counts.json")
+        term_counts = {} if job2.options.term_counts_store or job2.options.term_counts_matrix else None
+        parse_chi_squared_job_output(job2, runner2, job2.options.top_k, categories, term_counts)
+
+    if term_counts is not None:
+        write_term_counts(job2.options, categories, category_count_list, term_counts)
@@ -0,0 +1,88 @@
+import heapq
+import json
+import logging
+import sys
+from collections import defaultdict
+
+from amazon_reviews_job import AmazonReviewsJob, log_in_mapper_combining_stats
+from chi_squared_kernel import chi_squared_batches
+from multiprocess_runner import make_runner
+from runner import print_top_terms
+from term_count_matrix import write_term_count_matrix
+from term_count_store import TermCountStore
+from term_counter import TermCounter, parse_term_counter_output
+
+# configure logging
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+
+def top_terms_for_categories(categories, category_counts, term_counts, top_k=75):
+    """
+    Calculate the chi-squared values of all terms from the merged counts and select the top K terms of each category.
+    :param categories: The alphabetically sorted list of categories.
+    :param category_counts: The number of reviews of each category (indexed by category id).
+    :param term_counts: Dictionary mapping terms to lists of counts (indexed by category id).
+    :param top_k: The number of terms to select for each category.
+    :return: A dictionary mapping categories to lists of tuples of the form (chi-squared, term).
+    """
+    terms_for_category = defaultdict(list)
+    for term, category, chi_squared_value in chi_squared_batches(
+            term_counts.items(), category_counts, sum(category_counts)):
+        heap = terms_for_category[categories[category]]
+        # if the heap of terms for the category is full, replace the term with the lowest chi-squared value
+        if len(heap) >= top_k:
+            heapq.heappushpop(heap, (chi_squared_value, term))
+        else:
+            heapq.heappush(heap, (chi_squared_value, term))
+    return terms_for_category
+
+
+if __name__ == "__main__":
+    # create the job instance (only for parsing the command line)
+    job = TermCounter()
+    if not job.options.term_counts_store:
+        raise ValueError("The incremental runner requires --term-counts-store")
+    store = TermCountStore(job.options.term_counts_store)
+
+    # only process the input files whose counts are not in the store yet
+    processed_inputs = store.processed_inputs()
+    new_inputs = [path for path in job.options.args if path not in processed_inputs]
+    logger.info("%d of %d input files are new" % (len(new_inputs), len(job.options.args)))
+
+    if new_inputs:
+        # count the terms and categories of the new input files and append them to the store
+        job_args = [arg for arg in sys.argv[1:] if arg not in processed_inputs]
+        job = TermCounter(args=job_args)
+        job.FILES = AmazonReviewsJob.FILES + ["./stopwords.txt", "./chi_squared.py"]
+        with make_runner(job, job_args) as runner:
+            runner.run()
+            log_in_mapper_combining_stats(runner)
+            new_category_counts, new_term_counts = parse_term_counter_output(job, runner)
+
+        new_categories = sorted(new_category_counts)
+        segment_path = store.append(
+            new_inputs, new_categories, [new_category_counts[category] for category in new_categories],
+            ((term, [counts.get(category, 0) for category in new_categories])
+             for term, counts in sorted(new_term_counts.items())))
+        logger.info("Appended the counts of %d terms to %s" % (len(new_term_counts), segment_path))
+
+    if job.options.compact_store:
+        store.compact()
+
+    # merge the counts of all input files
+    categories, category_counts, term_counts = store.load()
+
+    # update the category counts file with the merged counts
+    merged_category_counts = dict(zip(categories, category_counts))
+    merged_category_counts["number_of_reviews"] = sum(category_counts)
+    with open("category_counts.json", "w") as f:
+        f.write(json.dumps(merged_category_counts))
+
+    if job.options.term_counts_matrix:
+        # export the merged counts for offline computations (see term_count_matrix.py)
+        write_term_count_matrix(job.options.term_counts_matrix, categories, category_counts,
+                                sorted(term_counts.items()))
+
+    # re-derive the top K terms of each category from the merged counts and print the results
+    print_top_terms(top_terms_for_categories(categories, category_counts, term_counts, job.options.top_k))
@@ -0,0 +1,46 @@
+import logging
+
+from amazon_reviews_job import AmazonReviewsJob, log_in_mapper_combining_stats
+from chi_squared_partitioned import log_reducer_completion_times
+from chi_squared_single_pass import AmazonReviewsChiSquaredSinglePass
+from multiprocess_runner import make_runner
+from runner import parse_chi_squared_job_output, write_term_counts, write_term_partitions
+from term_partitioner import TERM_PARTITIONS_FILE
+
+# configure logging
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+if __name__ == "__main__":
+    # create the job instance
+    # the category counts are computed within the same job, so there is no need to run the CategoryCounter job first
+    job = AmazonReviewsChiSquaredSinglePass()
+
+    # load the stopwords file and the modules with the base jobs as input files for the job
+    # (in addition to the modules the jobs depend on)
+    job.FILES = AmazonReviewsJob.FILES + [
+        "./stopwords.txt", "./chi_squared.py", "./chi_squared_partitioned.py", "./term_partitioner.py"]
+
+    if job.options.balance_partitions:
+        # run the sampling pre-pass before creating the runner, as it determines the number of reducers
+        with make_runner(job) as sampling_runner:
+            write_term_partitions(job, sampling_runner)
+        job.FILES = job.FILES + ["./" + TERM_PARTITIONS_FILE]
+
+    with make_runner(job) as runner:
+        # run the job
+        runner.run()
+        log_in_mapper_combining_stats(runner)
+        log_reducer_completion_times(runner)
+
+        # parse the output of the job and print the results
+        # (with the counts for --term-counts-store or --term-counts-matrix, including the category counts of the job)
+        term_counts = {} if job.options.term_counts_store or job.options.term_counts_matrix else None
+        category_counts = {}
+        parse_chi_squared_job_output(job, runner, job.options.top_k, term_counts=term_counts,
+                                     category_counts=category_counts)
+
+    if term_counts is not None:
+        # the reducers index the counts of a term like the alphabetically sorted categories
+        categories = sorted(category_counts)
+        write_term_counts(job.options, categories, [category_counts[category] for category in categories], term_counts)
@@ -0,0 +1,223 @@
+"""
+Sparse term x category matrix of the number of reviews containing each term, for offline chi-squared computations.
+
+The pipelines (runner.py and runner_incremental.py with --term-counts-matrix, the RDD pipeline of ex2) can write the
+raw counts they compute the chi-squared values from. The top K terms for any K or subset of categories are then
+computed locally from the matrix in seconds, instead of rerunning the pipeline on the cluster.
+
+The matrix is a directory with the counts in compressed sparse row (CSR) format, one row per term:
+
+- vocabulary.txt: the terms, one per line, sorted alphabetically (the row of a term is its line number)
+- categories.json: the alphabetically sorted categories (the column of a category is its index) and the number of
+  reviews of each category
+- indptr.npy: the entries of row i are at the positions indptr[i] to indptr[i + 1] of indices and data
+- indices.npy: the category id of each non-zero count
+- data.npy: the non-zero counts
+
+TermCountMatrix loads the arrays and the vocabulary memory-mapped, so only the pages needed are read from disk (the
+vocabulary is indexed by the offsets of its lines, 8 bytes per term, and terms are only decoded when they are looked
+up). The chi-squared values are only calculated for the entries of the requested categories.
+Run this module to print the top K terms of a matrix (in the output format of runner.py), or to convert a store of
+term and category counts (see term_count_store.py) into a matrix.
+"""
+import argparse
+import json
+import os
+from array import array
+
+import numpy as np
+
+from chi_squared_kernel import chi_squared_contingency
+from term_count_store import TermCountStore
+
+VOCABULARY_FILE = "vocabulary.txt"
+CATEGORIES_FILE = "categories.json"
+INDPTR_FILE = "indptr.npy"
+INDICES_FILE = "indices.npy"
+DATA_FILE = "data.npy"
+
+
+def _save_array(path, values, dtype):
+    """
+    Save an array to a .npy file, writing a temporary file first so readers never see a partial file.
+    :param path: The path of the file.
+    :param values: The values (e.g. an array.array).
+    :param dtype: The dtype of the saved array.
+    :return: Nothing.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.frombuffer(values, dtype=values.typecode).astype(dtype, copy=False))
+    os.replace(tmp_path, path)
+
+
+def write_term_count_matrix(path, categories, category_counts, term_counts):
+    """
+    Write term and category counts as a sparse matrix.
+    :param path: The directory of the matrix (created if it does not exist).
+    :param categories: The alphabetically sorted list of categories.
+    :param category_counts: The number of reviews of each category (indexed by category id).
+    :param term_counts: Iterable of tuples of the form (term, list of counts indexed by category id), sorted by term.
+    It is consumed once, so it can be a stream, e.g. an RDD's toLocalIterator().
+    :return: The number of terms.
+    """
+    os.makedirs(path, exist_ok=True)
+    # the arrays are built in compact typed buffers (4 or 8 bytes per value instead of a Python int object)
+    indptr = array("q", [0])
+    indices = array("i")
+    data = array("i")
+
+    vocabulary_tmp_path = os.path.join(path, VOCABULARY_FILE + ".tmp")
+    previous_term = None
+    with open(vocabulary_tmp_path, "w") as f:
+        for term, counts in term_counts:
+            if previous_term is not None and term <= previous_term:
+                raise ValueError("The terms are not sorted: '%s' follows '%s'" % (term, previous_term))
+            previous_term = term
+            f.write(term + "\n")
+            for category, count in enumerate(counts):
+                if count:
+                    indices.append(category)
+                    data.append(count)
+            indptr.append(len(data))
+
+    _save_array(os.path.join(path, INDPTR_FILE), indptr, np.int64)
+    _save_array(os.path.join(path, INDICES_FILE), indices, np.int32)
+    _save_array(os.path.join(path, DATA_FILE), data, np.int32)
+    os.replace(vocabulary_tmp_path, os.path.join(path, VOCABULARY_FILE))
+    with open(os.path.join(path, CATEGORIES_FILE), "w") as f:
+        f.write(json.dumps({"categories": list(categories), "category_counts": list(category_counts)}))
+    return len(indptr) - 1
+
+
+class Vocabulary:
+    """
+    Memory-mapped vocabulary file, indexed by the offsets of its lines.
+    """
+
+    def __init__(self, path):
+        """
+        Open a vocabulary file.
+        :param path: The path of the file (one term per line).
+        """
+        if os.path.getsize(path) == 0:
+            # an empty file cannot be memory-mapped
+            self.data = np.zeros(0, dtype=np.uint8)
+        else:
+            self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        # the line of term i is data[starts[i]:starts[i + 1] - 1] (without the newline)
+        self.starts = np.concatenate(([0], np.flatnonzero(self.data == ord("\n")) + 1))
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def __getitem__(self, row):
+        """
+        Look up a term.
+        :param row: The row of the term.
+        :return: The term.
+        """
+        if not 0 <= row < len(self):
+            raise IndexError("Row %d is out of range" % row)
+        return self.data[self.starts[row]:self.starts[row + 1] - 1].tobytes().decode("utf-8")
+
+
+class TermCountMatrix:
+    """
+    Memory-mapped sparse term x category matrix of review counts.
+    """
+
+    def __init__(self, path):
+        """
+        Load a matrix.
+        :param path: The directory of the matrix.
+        """
+        with open(os.path.join(path, CATEGORIES_FILE), "r") as f:
+            header = json.loads(f.read())
+        self.categories = header["categories"]
+        self.category_counts = np.asarray(header["category_counts"], dtype=np.int64)
+        self.n = int(self.category_counts.sum())
+        self.vocabulary = Vocabulary(os.path.join(path, VOCABULARY_FILE))
+        self.indptr = np.load(os.path.join(path, INDPTR_FILE), mmap_mode="r")
+        self.indices = np.load(os.path.join(path, INDICES_FILE), mmap_mode="r")
+        self.data = np.load(os.path.join(path, DATA_FILE), mmap_mode="r")
+
+    def term_counts(self):
+        """
+        Count the reviews containing each term (over all categories).
+        :return: An array with the number of reviews of each row.
+        """
+        # sum up the entries of the non-empty rows (reduceat sums up to the start of the next non-empty row)
+        non_empty = np.diff(self.indptr) > 0
+        counts = np.zeros(len(self.indptr) - 1, dtype=np.int64)
+        counts[non_empty] = np.add.reduceat(self.data, self.indptr[:-1][non_empty], dtype=np.int64)
+        return counts
+
+    def chi_squared(self, category_id, term_counts=None):
+        """
+        Calculate the chi-squared values of the non-zero entries of a category.
+        :param category_id: The column of the category.
+        :param term_counts: The result of term_counts(), if already computed.
+        :return: A tuple of the form (row of each entry, chi-squared value of each entry).
+        """
+        if term_counts is None:
+            term_counts = self.term_counts()
+        entries = np.flatnonzero(self.indices == category_id)
+        rows = np.searchsorted(self.indptr, entries, side="right") - 1
+        # number of documents in c which contain t
+        a = np.asarray(self.data[entries], dtype=np.float64)
+        # number of documents not in c which contain t
+        b = term_counts[rows] - a
+        # number of documents in c without t
+        c = float(self.category_counts[category_id]) - a
+        return rows, chi_squared_contingency(a, b, c, self.n)
+
+    def top_terms(self, top_k=75, categories=None):
+        """
+        Select the top K terms of categories.
+        :param top_k: The number of terms to select for each category.
+        :param categories: The categories to select the terms for (default: all categories).
+        :return: A dictionary mapping categories to lists of tuples of the form (chi-squared, term), sorted by
+        descending chi-squared value (and term, like the heaps of runner.py).
+        """
+        category_ids = {category: category_id for category_id, category in enumerate(self.categories)}
+        if categories is None:
+            categories = self.categories
+        unknown = [category for category in categories if category not in category_ids]
+        if unknown:
+            raise ValueError("Unknown categories %s, options are %s" % (unknown, self.categories))
+
+        term_counts = self.term_counts()
+        terms_for_category = {}
+        for category in categories:
+            rows, values = self.chi_squared(category_ids[category], term_counts)
+            if len(values) > top_k:
+                # only sort the entries reaching the K-th largest value (including all ties)
+                threshold = np.partition(values, len(values) - top_k)[len(values) - top_k]
+                rows, values = rows[values >= threshold], values[values >= threshold]
+            # sort by chi-squared value and row (the vocabulary is sorted, so the row orders the terms)
+            top = np.lexsort((rows, values))[::-1][:top_k]
+            terms_for_category[category] = [(value, self.vocabulary[row])
+                                            for value, row in zip(values[top].tolist(), rows[top].tolist())]
+        return terms_for_category
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute the top K chi-squared terms of each category from a term "
+                                                 "count matrix, or convert a term count store into a matrix.")
+    parser.add_argument("matrix", type=str, help="Directory of the term count matrix.")
+    parser.add_argument("-k", "--top-k", type=int, default=75, help="Number of terms to select for each category.")
+    parser.add_argument("-c", "--category", action="append", dest="categories",
+                        help="Category to select the terms for (repeatable, default: all categories).")
+    parser.add_argument("--from-store", type=str,
+                        help="Directory of a term count store (see term_count_store.py) to write the matrix from.")
+    args = parser.parse_args()
+
+    if args.from_store:
+        store_categories, store_category_counts, store_term_counts = TermCountStore(args.from_store).load()
+        write_term_count_matrix(args.matrix, store_categories, store_category_counts, sorted(store_term_counts.items()))
+
+    # imported here, as the Spark pipelines import this module without the MapReduce dependencies of runner.py
+    from runner import print_top_terms
+
+    print_top_terms(TermCountMatrix(args.matrix).top_terms(args.top_k, args.categories))
@@ -0,0 +1,162 @@
+"""
+Persistent, append-only store of the number of reviews containing each term for each category.
+
+The store is a directory of segments. Each segment holds the counts of a set of input files and is never modified
+once written:
+
+- the first line is a JSON object with the input files, the categories and the number of reviews of each category
+  (and the names of the segments it replaces, see replace())
+- every other line is a JSON array of the form [term, [count of category 0, count of category 1, ...]]
+
+The counts of the whole corpus are the sums over all segments, so new review files are added by appending a segment
+with only their counts (see runner_incremental.py) and the chi-squared values are re-derived from the merged counts
+without rescanning the historical data. compact() merges all segments into one, and replace() swaps the contents of
+the store for the counts of a full run. Both write the new segment before deleting the old ones. As the new segment
+lists the segments it replaces, these are ignored as soon as it exists, so a run failing in between neither loses
+nor double counts reviews.
+"""
+import json
+import os
+from collections import defaultdict
+
+# file name prefix and suffix of the segments, which are numbered in the order they were written
+SEGMENT_FILE_PREFIX = "segment-"
+SEGMENT_FILE_SUFFIX = ".jsonl"
+
+
+class TermCountStore:
+    """
+    Append-only store of term and category counts.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize the store.
+        :param path: The directory of the store (created when the first segment is written).
+        """
+        self.path = path
+
+    def _segment_files(self):
+        """
+        Get the paths of all segment files of the store, including replaced segments that were not deleted yet.
+        :return: A list of paths in the order the segments were written.
+        """
+        if not os.path.isdir(self.path):
+            return []
+        return [os.path.join(self.path, name) for name in sorted(os.listdir(self.path))
+                if name.startswith(SEGMENT_FILE_PREFIX) and name.endswith(SEGMENT_FILE_SUFFIX)]
+
+    def segment_paths(self):
+        """
+        Get the paths of the segments of the store.
+        :return: A list of paths in the order the segments were written, without the segments replaced by a later one.
+        """
+        segment_files = self._segment_files()
+        replaced = set()
+        # the segments replaced by a segment that is itself replaced do not matter (they were replaced before)
+        for segment_path in reversed(segment_files):
+            if os.path.basename(segment_path) not in replaced:
+                replaced.update(self.read_segment_header(segment_path).get("replaces", []))
+        return [segment_path for segment_path in segment_files if os.path.basename(segment_path) not in replaced]
+
+    def read_segment_header(self, segment_path):
+        """
+        Read the header of a segment.
+        :param segment_path: The path of the segment.
+        :return: A dictionary with the input files, the categories and the category counts of the segment.
+        """
+        with open(segment_path, "r") as f:
+            return json.loads(f.readline())
+
+    def processed_inputs(self):
+        """
+        Get the input files whose counts are in the store.
+        :return: A set of input paths.
+        """
+        return {path for segment_path in self.segment_paths()
+                for path in self.read_segment_header(segment_path)["inputs"]}
+
+    def append(self, inputs, categories, category_counts, term_counts, replaces=()):
+        """
+        Write the counts of new input files as a new segment.
+        The segment is written to a temporary file first, so a failed run does not leave a partial segment.
+        :param inputs: The input files the counts were computed from.
+        :param categories: The list of categories.
+        :param category_counts: The number of reviews of each category (indexed like categories).
+        :param term_counts: Iterable of tuples of the form (term, list of counts indexed like categories).
+        :param replaces: The paths of the segments whose counts the new segment replaces.
+        :return: The path of the new segment.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        segment_files = self._segment_files()
+        next_segment = 0
+        if segment_files:
+            last_segment_name = os.path.basename(segment_files[-1])
+            next_segment = int(last_segment_name[len(SEGMENT_FILE_PREFIX):-len(SEGMENT_FILE_SUFFIX)]) + 1
+        segment_path = os.path.join(self.path, "%s%05d%s" % (SEGMENT_FILE_PREFIX, next_segment, SEGMENT_FILE_SUFFIX))
+
+        tmp_path = segment_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps({"inputs": list(inputs), "categories": list(categories),
+                                "category_counts": list(category_counts),
+                                "replaces": [os.path.basename(path) for path in replaces]}) + "\n")
+            for term, counts in term_counts:
+                f.write(json.dumps([term, list(counts)]) + "\n")
+        os.replace(tmp_path, segment_path)
+        return segment_path
+
+    def replace(self, inputs, categories, category_counts, term_counts):
+        """
+        Replace the contents of the store with a single new segment, e.g. with the counts of a full run.
+        The old segments are only deleted once the new segment has been written.
+        :param inputs: The input files the counts were computed from.
+        :param categories: The list of categories.
+        :param category_counts: The number of reviews of each category (indexed like categories).
+        :param term_counts: Iterable of tuples of the form (term, list of counts indexed like categories).
+        :return: The path of the new segment.
+        """
+        old_segment_files = self._segment_files()
+        segment_path = self.append(inputs, categories, category_counts, term_counts, replaces=old_segment_files)
+        for old_segment_path in old_segment_files:
+            os.remove(old_segment_path)
+        return segment_path
+
+    def load(self):
+        """
+        Merge the counts of all segments.
+        :return: A tuple of the form (alphabetically sorted list of categories, list of category counts,
+        dictionary mapping terms to lists of counts). The lists are indexed by category id.
+        """
+        segment_paths = self.segment_paths()
+        categories = sorted({category for segment_path in segment_paths
+                             for category in self.read_segment_header(segment_path)["categories"]})
+        category_ids = {category: category_id for category_id, category in enumerate(categories)}
+
+        category_counts = [0] * len(categories)
+        term_counts = defaultdict(lambda: [0] * len(categories))
+        for segment_path in segment_paths:
+            with open(segment_path, "r") as f:
+                header = json.loads(f.readline())
+                # map the category ids of the segment to the merged category ids
+                segment_category_ids = [category_ids[category] for category in header["categories"]]
+                for category_id, count in zip(segment_category_ids, header["category_counts"]):
+                    category_counts[category_id] += count
+                for line in f:
+                    term, counts = json.loads(line)
+                    merged_counts = term_counts[term]
+                    for category_id, count in zip(segment_category_ids, counts):
+                        merged_counts[category_id] += count
+
+        return categories, category_counts, dict(term_counts)
+
+    def compact(self):
+        """
+        Merge all segments into a single segment.
+        :return: Nothing.
+        """
+        segment_paths = self.segment_paths()
+        if len(segment_paths) < 2:
+            return
+        inputs = sorted(self.processed_inputs())
+        categories, category_counts, term_counts = self.load()
+        self.replace(inputs, categories, category_counts, sorted(term_counts.items()))
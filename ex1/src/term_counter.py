@@ -0,0 +1,124 @@
+import logging
+from collections import defaultdict
+from itertools import chain
+
+from mrjob.step import MRStep
+
+from chi_squared import AmazonReviewsChiSquared
+from tokenizer import unique_terms
+
+logger = logging.getLogger(__name__)
+
+# reserved "term" under which the job outputs the number of reviews of each category
+CATEGORY_COUNTS_TERM = ""
+
+
+class TermCounter(AmazonReviewsChiSquared):
+    """
+    This job counts the number of reviews containing each term for each category, and the number of reviews
+    of each category, in a single pass.
+
+    It is used for adding new input files to the store of term and category counts (see runner_incremental.py).
+    As the categories of new input files are not known up front, the job works with category names.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Initialize the job.
+        :param args: Positional arguments.
+        :param kwargs: Keyword arguments.
+        """
+        super().__init__(*args, **kwargs)
+
+        # dictionary of category counts seen by the mapper
+        self.mapper_category_counts = None
+
+    def steps(self):
+        """
+        Define the steps of the job.
+        :return: A list with the single step counting the terms and categories.
+        """
+        return [
+            MRStep(mapper_init=self.mapper_init, mapper=self.mapper, mapper_final=self.mapper_final,
+                   combiner=self.combiner, reducer=self.reducer),
+        ]
+
+    def mapper_init(self):
+        """
+        Initialize the mapper.
+        Create the review parser and load the stopwords from file.
+        :return: Nothing.
+        """
+        super().mapper_init()
+        self.mapper_category_counts = defaultdict(int)
+
+    def load_category_ids(self):
+        """
+        The categories are not known up front, so the mappers emit category names.
+        :return: None.
+        """
+        return None
+
+    def mapper(self, _, line):
+        """
+        Map each review to a set of unique terms and count the review for its category.
+        :param _: A key.
+        Unused.
+        :param line: A single line of the input file.
+        Represents a single review.
+        :return: Yields the term and a tuple of the form (category, 1).
+        """
+        # extract the product category and the review text from the json data of the line
+        category, text = self.parse_review(line)
+
+        # count the document for its category, emitted in mapper_final
+        self.mapper_category_counts[category] += 1
+
+        # iterate over the unique terms (without stopwords) and emit them with the category
+        for term in unique_terms(text, self.stopwords):
+            yield from self.emit((term, category))
+
+    def mapper_final(self):
+        """
+        Flush the records buffered by in-mapper combining and emit the category counts of the mapper.
+        :return: Yields the term and a tuple of the form (category, count).
+        """
+        yield from super().mapper_final()
+
+        for category, count in self.mapper_category_counts.items():
+            yield CATEGORY_COUNTS_TERM, (category, count)
+
+    def reducer(self, key, values):
+        """
+        Sum up the counts of a term for each category.
+        :param key: A term, or the reserved term for the category counts.
+        :param values: List of tuples of the form (category, count).
+        :return: Yields the term and a flat tuple of the form (category 1, count 1, category 2, count 2, ...).
+        """
+        counts = defaultdict(int)
+        for category, count in values:
+            counts[category] += count
+        yield key, tuple(chain.from_iterable(sorted(counts.items())))
+
+
+def parse_term_counter_output(job, runner):
+    """
+    Parse the output of the TermCounter job.
+    :param job: The TermCounter job.
+    :param runner: The runner of the job.
+    :return: A tuple of the form (dictionary of category counts, dictionary mapping terms to dictionaries of
+    category counts).
+    """
+    category_counts = {}
+    term_counts = {}
+    for term, value in job.parse_output(runner.cat_output()):
+        counts = dict(zip(value[::2], value[1::2]))
+        if term == CATEGORY_COUNTS_TERM:
+            category_counts = counts
+        else:
+            term_counts[term] = counts
+    return category_counts, term_counts
+
+
+if __name__ == "__main__":
+    TermCounter.run()
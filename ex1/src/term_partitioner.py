@@ -0,0 +1,173 @@
+"""
+Skew-aware partitioning of terms to reducers.
+
+Term frequencies are Zipfian, so with plain hash partitioning the reducers that receive the most frequent terms
+finish long after the others. The sampling pre-pass (sample_term_partitions()) estimates the document frequencies
+of the terms from a prefix of the input, sizes the number of reducers from the input size and assigns the most
+frequent terms to the least loaded reducers (longest processing time first). All remaining terms are hashed.
+
+Hadoop streaming cannot run a partitioner written in Python, so the jobs emit a routing key instead of the term.
+Routing keys are chosen such that Hadoop's KeyFieldBasedPartitioner (used by mrjob for secondary sort) sends the
+records of partition i to reducer i.
+"""
+import json
+import math
+import zlib
+from collections import Counter
+
+from tokenizer import unique_terms
+
+# name of the file with the partitioning computed by the sampling pre-pass
+TERM_PARTITIONS_FILE = "term_partitions.json"
+
+
+def key_field_partition(key, num_reducers):
+    """
+    Get the reducer Hadoop's KeyFieldBasedPartitioner assigns a key to (when partitioning on the whole key).
+    :param key: The key as written by the job (i.e. JSON encoded).
+    :param num_reducers: The number of reducers.
+    :return: The reducer number.
+    """
+    current_hash = 0
+    for byte in key.encode("utf-8"):
+        # signed bytes and 32-bit integer overflow as in Java
+        if byte > 127:
+            byte -= 256
+        current_hash = (31 * current_hash + byte) & 0xFFFFFFFF
+    return (current_hash & 0x7FFFFFFF) % num_reducers
+
+
+def find_routing_keys(num_reducers):
+    """
+    Find one (integer) key for each reducer that KeyFieldBasedPartitioner assigns to that reducer.
+    :param num_reducers: The number of reducers.
+    :return: A list of keys, the key at index i is assigned to reducer i.
+    """
+    routing_keys = [None] * num_reducers
+    missing = num_reducers
+    key = 0
+    while missing:
+        reducer = key_field_partition(json.dumps(key), num_reducers)
+        if routing_keys[reducer] is None:
+            routing_keys[reducer] = key
+            missing -= 1
+        key += 1
+    return routing_keys
+
+
+class TermPartitioner:
+    """
+    Assigns terms to partitions (reducers).
+    Terms in the assignment of the sampling pre-pass are sent to their assigned partition, all other terms are hashed.
+    """
+
+    def __init__(self, num_partitions, assigned_terms=None):
+        """
+        Initialize the partitioner.
+        :param num_partitions: The number of partitions (reducers).
+        :param assigned_terms: A dictionary mapping terms to partitions.
+        """
+        self.num_partitions = num_partitions
+        self.assigned_terms = assigned_terms or {}
+        self.routing_keys = find_routing_keys(num_partitions)
+
+    @classmethod
+    def load(cls, path=TERM_PARTITIONS_FILE):
+        """
+        Load a partitioner written by the sampling pre-pass.
+        :param path: The path of the file.
+        :return: A TermPartitioner.
+        """
+        with open(path, "r") as f:
+            partitions = json.load(f)
+        return cls(partitions["num_partitions"], partitions["assigned_terms"])
+
+    def save(self, path=TERM_PARTITIONS_FILE):
+        """
+        Write the partitioner to a file.
+        :param path: The path of the file.
+        :return: Nothing.
+        """
+        with open(path, "w") as f:
+            json.dump({"num_partitions": self.num_partitions, "assigned_terms": self.assigned_terms}, f)
+
+    def partition(self, term):
+        """
+        Get the partition of a term.
+        Uses a stable hash for unassigned terms so that all mappers agree on the partition.
+        :param term: A term.
+        :return: The partition number.
+        """
+        partition = self.assigned_terms.get(term)
+        if partition is None:
+            partition = zlib.crc32(term.encode("utf-8")) % self.num_partitions
+        return partition
+
+    def routing_key(self, term):
+        """
+        Get the key under which the records of a term have to be emitted to reach the reducer of its partition.
+        :param term: A term.
+        :return: The routing key.
+        """
+        return self.routing_keys[self.partition(term)]
+
+
+def estimate_num_partitions(input_bytes, bytes_per_reducer, max_reducers):
+    """
+    Size the number of reducers from the input size.
+    :param input_bytes: The size of the input in bytes.
+    :param bytes_per_reducer: The amount of input data per reducer.
+    :param max_reducers: The maximum number of reducers.
+    :return: The number of reducers.
+    """
+    return max(1, min(max_reducers, math.ceil(input_bytes / bytes_per_reducer)))
+
+
+def balance_term_partitions(term_frequencies, num_partitions, num_assigned_terms):
+    """
+    Assign the most frequent terms to partitions such that the estimated load of the partitions is balanced.
+    :param term_frequencies: A Counter of (sampled) document frequencies of the terms.
+    :param num_partitions: The number of partitions.
+    :param num_assigned_terms: The number of most frequent terms to assign explicitly.
+    :return: A TermPartitioner.
+    """
+    hashed = TermPartitioner(num_partitions)
+    most_common = term_frequencies.most_common(num_assigned_terms)
+    assigned = {term for term, _ in most_common}
+
+    # the load of the terms that remain hashed
+    loads = [0] * num_partitions
+    for term, frequency in term_frequencies.items():
+        if term not in assigned:
+            loads[hashed.partition(term)] += frequency
+
+    # longest processing time first: assign the next most frequent term to the least loaded partition
+    assigned_terms = {}
+    for term, frequency in most_common:
+        partition = min(range(num_partitions), key=lambda p: loads[p])
+        assigned_terms[term] = partition
+        loads[partition] += frequency
+
+    return TermPartitioner(num_partitions, assigned_terms)
+
+
+def sample_term_partitions(lines, parse_review, stopwords, input_bytes, bytes_per_reducer=256 * 1024 * 1024,
+                           max_reducers=64, num_assigned_terms=1000):
+    """
+    Sampling pre-pass: estimate the term frequencies from a sample of the input and compute a balanced partitioning.
+    :param lines: The sampled lines of the input.
+    :param parse_review: A function parsing a line into a tuple of the form (category, review text).
+    :param stopwords: A (frozen) set of stopwords.
+    :param input_bytes: The size of the (whole) input in bytes.
+    :param bytes_per_reducer: The amount of input data per reducer.
+    :param max_reducers: The maximum number of reducers.
+    :param num_assigned_terms: The number of most frequent terms to assign explicitly.
+    :return: A TermPartitioner.
+    """
+    term_frequencies = Counter()
+    for line in lines:
+        _, text = parse_review(line)
+        term_frequencies.update(unique_terms(text, stopwords))
+
+    num_partitions = estimate_num_partitions(input_bytes, bytes_per_reducer, max_reducers)
+    return balance_term_partitions(term_frequencies, num_partitions, num_assigned_terms)
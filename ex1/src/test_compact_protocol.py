@@ -0,0 +1,51 @@
+"""
+Round-trip tests of the compact internal protocol (compact_protocol.py).
+"""
+from compact_protocol import CATEGORIES, FIELD_SEPARATOR, CompactProtocol, decode, encode
+
+
+# the values of the "category" field of the reviews dataset (some of them truncated), with their number of reviews
+DATASET_CATEGORY_COUNTS = {
+    "Patio_Lawn_and_Garde": 994, "Apps_for_Android": 2638, "Book": 22507, "Toys_and_Game": 2253,
+    "Office_Product": 1243, "Digital_Music": 836, "Sports_and_Outdoor": 3269, "Automotive": 1374, "Beauty": 2023,
+    "Musical_Instrument": 500, "CDs_and_Vinyl": 3749, "Kindle_Store": 3205, "Clothing_Shoes_and_Jewelry": 5749,
+    "Electronic": 7825, "Home_and_Kitche": 4254, "Cell_Phones_and_Accessorie": 3447, "Pet_Supplie": 1235,
+    "Movies_and_TV": 4607, "Baby": 916, "Tools_and_Home_Improvement": 1926, "Grocery_and_Gourmet_Food": 1297,
+    "Health_and_Personal_Care": 2982,
+}
+
+
+def test_categories_of_the_dataset_are_encoded_as_ids():
+    assert sorted(DATASET_CATEGORY_COUNTS) == CATEGORIES
+    for category in DATASET_CATEGORY_COUNTS:
+        assert encode(category) == "c%d" % CATEGORIES.index(category)
+        assert decode(encode(category)) == category
+
+
+def test_round_trip():
+    values = [
+        0, 42, -1, 1.5, None, "term", "", CATEGORIES[0],
+        (), (7,), ["Book"], ("Book", 1), ("", "term", 3), [1, 2, 3], (0.25, None, "Toys_and_Game"),
+    ]
+    for value in values:
+        expected = tuple(value) if isinstance(value, (tuple, list)) else value
+        assert decode(encode(value)) == expected
+
+
+def test_single_field_tuple_is_not_a_scalar():
+    assert encode((7,)) == "7" + FIELD_SEPARATOR
+    assert decode(encode([7])) == (7,)
+    assert decode(encode(7)) == 7
+
+
+def test_empty_data():
+    assert encode(()) == ""
+    assert decode("") == ()
+
+
+def test_protocol_lines():
+    protocol = CompactProtocol()
+    for key, value in [(None, ("Book", 3.5, "term")), (("", "Book"), 1), ("term", [0, 2, 1]), ("term", [4])]:
+        decoded_key, decoded_value = protocol.read(protocol.write(key, value))
+        assert decoded_key == (tuple(key) if isinstance(key, (tuple, list)) else key)
+        assert decoded_value == (tuple(value) if isinstance(value, (tuple, list)) else value)
@@ -0,0 +1,52 @@
+"""
+Tokenization of review texts shared by the MapReduce jobs (ex1) and the Spark pipelines (ex2).
+
+The pattern is compiled once at import time, texts are lowercased once and stopwords are removed from the set of
+unique tokens of a document with a single set difference instead of a membership test per token.
+"""
+import re
+
+# pattern for splitting texts into tokens
+TOKEN_PATTERN = re.compile(r"[^a-zA-Z<>^|]+")
+
+# equivalent pattern for texts that have already been lowercased
+LOWERCASE_TOKEN_PATTERN = re.compile(r"[^a-z<>^|]+")
+
+# minimum length of a term
+MIN_TERM_LENGTH = 2
+
+
+def load_stopwords(path="stopwords.txt"):
+    """
+    Load the stopwords from file.
+    :param path: The path of the stopwords file (one stopword per line, may contain duplicates).
+    :return: A frozenset of stopwords.
+    """
+    with open(path, "r") as f:
+        return frozenset(f.read().splitlines())
+
+
+def tokenize(text):
+    """
+    Split a text into lowercased tokens.
+    :param text: The text to tokenize.
+    :return: A list of tokens (may contain empty strings and duplicates).
+    """
+    if text.isascii():
+        # lowercase the whole text at once
+        return LOWERCASE_TOKEN_PATTERN.split(text.lower())
+    # lowercasing some non-ASCII characters yields ASCII letters (e.g. the Kelvin sign),
+    # so split before lowercasing to get the same tokens as the original implementation
+    return [token.lower() for token in TOKEN_PATTERN.split(text)]
+
+
+def unique_terms(text, stopwords):
+    """
+    Get the unique terms of a text, i.e. its tokens without stopwords and tokens shorter than two characters.
+    :param text: The text to extract the terms from.
+    :param stopwords: A (frozen) set of stopwords.
+    :return: A set of terms.
+    """
+    terms = set(tokenize(text))
+    terms.difference_update(stopwords)
+    return {term for term in terms if len(term) >= MIN_TERM_LENGTH}
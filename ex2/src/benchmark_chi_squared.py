@@ -0,0 +1,450 @@
+"""
+Benchmark suite comparing the implementations of the chi-squared top K terms computation:
+
+- mr: the MapReduce jobs (ex1/src/runner.py), with the runner options given with --mr-args
+- rdd: the RDD notebook (1_RDDs.ipynb)
+- df: the DataFrame pipeline with ChiSqSelector (part 2 of 2_and_3_dataframes.ipynb, part 3 is not run)
+
+Each implementation runs on each dataset given with --dataset (e.g. tiny, reduced and devset), optionally on
+a scaled dataset (the first dataset replicated --scale times) and on synthetic datasets generated from the first
+dataset by ex1/src/generate_reviews.py (--synthetic, e.g. 1 10 100 times its size), and the suite records
+
+- the wall-clock time
+- the peak memory: the largest resident set size of any process of the run (for Spark, executors on other nodes
+  are not included)
+- the shuffle bytes: Hadoop's "Map output materialized bytes" counters (logged by the hadoop runner and by
+  the multiprocess runner, i.e. --mr-args "--processes N"), or the shuffle write bytes of all stages reported by
+  Spark's REST API
+
+and checks that the outputs agree: the outputs for the dataset given with --reference-dataset are compared with
+the committed devset outputs (ex2/output_rdd.txt for mr and rdd, which compute the same top K terms, and
+ex2/output_ds.txt for df), and the top K terms of mr and rdd are compared with each other for every dataset.
+Top K lists agree if they have the same chi-squared values (within FLOAT_TOLERANCE, as the outputs are rounded) and
+the same terms, except for terms tied at the same value, which may be ordered (or cut off at the K-th value)
+differently. If any of the compared top K terms differ, the suite fails (after writing results.json) instead of
+reporting the timings of wrong results.
+
+The notebooks are run with "jupyter nbconvert --execute" on a copy with the input path (and output path) replaced,
+so jupyter and pyspark have to be installed for rdd and df.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import re
+import resource
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+MR_SRC_DIR = os.path.join(SRC_DIR, "..", "..", "ex1", "src")
+
+IMPLEMENTATIONS = ["mr", "rdd", "df"]
+
+# committed outputs of each implementation computed on the devset
+# (ex1/output.txt is the output of the full dataset, so mr is compared with the devset output of rdd)
+REFERENCE_OUTPUTS = {
+    "mr": os.path.join(SRC_DIR, "..", "output_rdd.txt"),
+    "rdd": os.path.join(SRC_DIR, "..", "output_rdd.txt"),
+    "df": os.path.join(SRC_DIR, "..", "output_ds.txt"),
+}
+
+NOTEBOOKS = {
+    "rdd": "1_RDDs.ipynb",
+    "df": "2_and_3_dataframes.ipynb",
+}
+
+# output files written by the notebooks
+NOTEBOOK_OUTPUT_FILES = {
+    "rdd": "output_rdd.txt",
+    "df": "output_ds.txt",
+}
+
+# first cell of the DataFrame notebook that is not part of the chi-squared feature selection
+DF_NOTEBOOK_END_MARKER = "# Part 3"
+
+# tolerance of the comparison of chi-squared values (the outputs print them with 6 decimals)
+FLOAT_TOLERANCE = 1e-5
+
+SHUFFLE_BYTES_PATTERN = re.compile(r"Map output materialized bytes=(\d+)")
+
+# cell appended to the notebooks for reading the shuffle write bytes of all stages from Spark's REST API
+SPARK_METRICS_CELL = """import json as _json
+import urllib.request as _request
+
+_stages = _json.load(_request.urlopen("%%s/api/v1/applications/%%s/stages" %% (sc.uiWebUrl, sc.applicationId)))
+with open(%r, "w") as _f:
+    _json.dump({"shuffle_bytes": sum(_stage.get("shuffleWriteBytes", 0) for _stage in _stages)}, _f)"""
+
+
+def _run_child(cmd, cwd, stdout_path, stderr_path, queue):
+    """
+    Run a command and report its exit code and the peak memory of its processes.
+    Runs in a separate process, so that the resource usage of its children only covers this command.
+    :param cmd: The command.
+    :param cwd: The working directory.
+    :param stdout_path: The file the standard output is written to.
+    :param stderr_path: The file the standard error is written to.
+    :param queue: The queue the tuple (exit code, peak resident set size in KB) is put into.
+    :return: Nothing.
+    """
+    with open(stdout_path, "wb") as stdout, open(stderr_path, "wb") as stderr:
+        returncode = subprocess.run(cmd, cwd=cwd, stdout=stdout, stderr=stderr).returncode
+    queue.put((returncode, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss))
+
+
+def run_measured(cmd, cwd, stdout_path, stderr_path):
+    """
+    Run a command and measure its wall-clock time and peak memory.
+    :param cmd: The command.
+    :param cwd: The working directory.
+    :param stdout_path: The file the standard output is written to.
+    :param stderr_path: The file the standard error is written to.
+    :return: A tuple of the form (wall-clock time in seconds, peak resident set size in MB).
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_child, args=(cmd, cwd, stdout_path, stderr_path, queue))
+    start_time = time.perf_counter()
+    process.start()
+    returncode, max_rss_kb = queue.get()
+    process.join()
+    wall_time = time.perf_counter() - start_time
+    if returncode != 0:
+        raise RuntimeError("%s failed with exit code %d, see %s" % (" ".join(cmd), returncode, stderr_path))
+    return wall_time, max_rss_kb / 1024
+
+
+def is_local_path(path):
+    """
+    Check whether a path refers to the local filesystem.
+    :param path: A path or URI.
+    :return: True for local paths.
+    """
+    return "://" not in path
+
+
+def spark_path(path):
+    """
+    Convert a local path to a URI Spark resolves on the local filesystem (Spark defaults to HDFS on the cluster).
+    :param path: A path or URI.
+    :return: The URI.
+    """
+    return "file://" + os.path.abspath(path) if is_local_path(path) else path
+
+
+def run_mr(input_path, output_path, work_dir, mr_args):
+    """
+    Run the MapReduce implementation.
+    :param input_path: The input file.
+    :param output_path: The file the output is written to.
+    :param work_dir: The directory for log files.
+    :param mr_args: Additional arguments of runner.py (e.g. the runner).
+    :return: A dictionary with the wall-clock time, the peak memory and the shuffle bytes.
+    """
+    stderr_path = os.path.join(work_dir, "mr.log")
+    input_path = os.path.abspath(input_path) if is_local_path(input_path) else input_path
+    wall_time, peak_memory = run_measured(
+        [sys.executable, "runner.py"] + mr_args + [input_path], MR_SRC_DIR, output_path, stderr_path)
+
+    with open(stderr_path, "r") as f:
+        shuffle_bytes = [int(match) for match in SHUFFLE_BYTES_PATTERN.findall(f.read())]
+    return {"wall_time": wall_time, "peak_memory_mb": peak_memory,
+            "shuffle_bytes": sum(shuffle_bytes) if shuffle_bytes else None}
+
+
+def prepare_notebook(implementation, input_path, output_path, metrics_path):
+    """
+    Create a copy of a notebook that reads the given input, writes its output to the given file and reports
+    the shuffle bytes.
+    :param implementation: The implementation (rdd or df).
+    :param input_path: The input file.
+    :param output_path: The file the output is written to.
+    :param metrics_path: The file the shuffle bytes are written to.
+    :return: The notebook (as a dictionary).
+    """
+    with open(os.path.join(SRC_DIR, NOTEBOOKS[implementation]), "r") as f:
+        notebook = json.load(f)
+
+    cells = []
+    for cell in notebook["cells"]:
+        source = "".join(cell["source"])
+        if implementation == "df" and cell["cell_type"] == "markdown" and source.startswith(DF_NOTEBOOK_END_MARKER):
+            break
+        if cell["cell_type"] == "code":
+            if "sc.stop()" in source or "spark.stop()" in source:
+                continue
+            # replace the (uncommented) assignment of the input path and the output file
+            source = re.sub(r'^review_path = .*$', "review_path = %r" % spark_path(input_path), source,
+                            flags=re.MULTILINE)
+            source = re.sub(r'open\(f?"%s"' % re.escape(NOTEBOOK_OUTPUT_FILES[implementation]),
+                            "open(%r" % output_path, source)
+            cell = dict(cell, source=source, outputs=[], execution_count=None)
+        cells.append(cell)
+
+    for source in [SPARK_METRICS_CELL % metrics_path, "spark.stop()"]:
+        cells.append({"cell_type": "code", "execution_count": None, "metadata": {}, "outputs": [], "source": source})
+    return dict(notebook, cells=cells)
+
+
+def run_notebook(implementation, input_path, output_path, work_dir):
+    """
+    Run a notebook implementation.
+    :param implementation: The implementation (rdd or df).
+    :param input_path: The input file.
+    :param output_path: The file the output is written to.
+    :param work_dir: The directory for the notebook copy and log files.
+    :return: A dictionary with the wall-clock time, the peak memory and the shuffle bytes.
+    """
+    metrics_path = os.path.join(work_dir, "%s_metrics.json" % implementation)
+    # the copy is placed next to the original, as the notebooks load files relative to their directory
+    notebook_path = os.path.join(SRC_DIR, ".benchmark_%s" % NOTEBOOKS[implementation])
+    with open(notebook_path, "w") as f:
+        json.dump(prepare_notebook(implementation, input_path, output_path, metrics_path), f)
+
+    try:
+        wall_time, peak_memory = run_measured(
+            ["jupyter", "nbconvert", "--to", "notebook", "--execute", "--ExecutePreprocessor.timeout=-1",
+             "--output", os.path.join(work_dir, "%s_executed.ipynb" % implementation), notebook_path],
+            SRC_DIR, os.devnull, os.path.join(work_dir, "%s.log" % implementation))
+    finally:
+        os.remove(notebook_path)
+
+    with open(metrics_path, "r") as f:
+        shuffle_bytes = json.load(f)["shuffle_bytes"]
+    return {"wall_time": wall_time, "peak_memory_mb": peak_memory, "shuffle_bytes": shuffle_bytes}
+
+
+def parse_top_terms(path):
+    """
+    Parse an output with the top K terms of each category, in the format
+    "<category> term1:chi_squared1 term2:chi_squared2 ..." followed by a line with all terms.
+    :param path: The path of the output.
+    :return: A dictionary mapping categories to the list of their top terms as tuples of the form (term, chi-squared),
+    ordered by chi-squared.
+    """
+    top_terms = {}
+    with open(path, "r") as f:
+        for line in f:
+            if line.startswith("<"):
+                category, *terms = line.split()
+                top_terms[category.strip("<>")] = [
+                    (term, float(value)) for term, value in (term.rsplit(":", 1) for term in terms)]
+    return top_terms
+
+
+def top_terms_agree(top_terms, expected_top_terms):
+    """
+    Check whether two top K lists of a category agree: the chi-squared values are the same (within FLOAT_TOLERANCE),
+    and the terms are the same except for terms tied at the K-th value.
+    :param top_terms: A list of tuples of the form (term, chi-squared), ordered by chi-squared.
+    :param expected_top_terms: The list to compare with.
+    :return: True if the lists agree.
+    """
+    if len(top_terms) != len(expected_top_terms):
+        return False
+
+    def is_close(value, other_value):
+        return math.isclose(value, other_value, rel_tol=FLOAT_TOLERANCE, abs_tol=FLOAT_TOLERANCE)
+
+    if not all(is_close(value, expected_value)
+               for (_, value), (_, expected_value) in zip(top_terms, expected_top_terms)):
+        return False
+    values = dict(top_terms)
+    expected_values = dict(expected_top_terms)
+    if not all(is_close(value, expected_values[term]) for term, value in top_terms if term in expected_values):
+        return False
+    # a term may only be missing from the other list if it is tied at the K-th value (cut off differently)
+    missing = [value for term, value in top_terms if term not in expected_values] + \
+        [value for term, value in expected_top_terms if term not in values]
+    return all(is_close(value, top_terms[-1][1]) for value in missing)
+
+
+def parse_selected_terms(path):
+    """
+    Parse an output with a space separated list of terms (the terms selected by ChiSqSelector).
+    :param path: The path of the output.
+    :return: A set of terms.
+    """
+    with open(path, "r") as f:
+        return set(f.read().split())
+
+
+def compare_top_terms(top_terms, expected_top_terms):
+    """
+    Compare the top K terms of each category of two outputs.
+    :param top_terms: A dictionary mapping categories to the list of their top terms (see parse_top_terms()).
+    :param expected_top_terms: The dictionary to compare with.
+    :return: A dictionary with the fraction of top K lists that agree (see top_terms_agree()) and the mean overlap of
+    the top K terms.
+    """
+    categories = set(top_terms) | set(expected_top_terms)
+    agreeing = sum(top_terms_agree(top_terms.get(category, []), expected_top_terms.get(category, []))
+                   for category in categories)
+    overlaps = [len({term for term, _ in top_terms.get(category, [])}
+                    & {term for term, _ in expected_top_terms.get(category, [])})
+                / max(len(expected_top_terms.get(category, [])), 1) for category in categories]
+    return {"agreeing_categories": agreeing / max(len(categories), 1),
+            "mean_overlap": sum(overlaps) / max(len(overlaps), 1)}
+
+
+def compare_selected_terms(terms, expected_terms):
+    """
+    Compare two sets of selected terms.
+    :param terms: A set of terms.
+    :param expected_terms: The set to compare with.
+    :return: A dictionary with the Jaccard similarity of the sets.
+    """
+    return {"jaccard": len(terms & expected_terms) / max(len(terms | expected_terms), 1)}
+
+
+def compare_outputs(implementation, output_path, expected_path):
+    """
+    Compare the output of an implementation with another output of the same format.
+    :param implementation: The implementation.
+    :param output_path: The path of the output.
+    :param expected_path: The path of the output to compare with.
+    :return: A dictionary of agreement metrics.
+    """
+    if implementation == "df":
+        return compare_selected_terms(parse_selected_terms(output_path), parse_selected_terms(expected_path))
+    return compare_top_terms(parse_top_terms(output_path), parse_top_terms(expected_path))
+
+
+def find_disagreements(results):
+    """
+    Find the compared top K outputs that differ.
+    :param results: The list of results (with the agreement metrics of each dataset and implementation).
+    :return: A list of descriptions of the outputs that differ.
+    """
+    disagreements = []
+    for result in results:
+        for compared_with, agreement in sorted(result["agreement"].items()):
+            if agreement.get("agreeing_categories", 1.0) < 1.0:
+                disagreements.append("%s on %s differs from %s (%s)" % (
+                    result["implementation"], result["dataset"], compared_with, json.dumps(agreement)))
+    return disagreements
+
+
+def write_scaled_dataset(input_path, scale, output_path):
+    """
+    Write a synthetic dataset consisting of an input file replicated a number of times.
+    :param input_path: The input file (local).
+    :param scale: The number of copies.
+    :param output_path: The path of the scaled dataset.
+    :return: Nothing.
+    """
+    with open(input_path, "rb") as f:
+        data = f.read()
+    if data and not data.endswith(b"\n"):
+        data += b"\n"
+    with open(output_path, "wb") as f:
+        for _ in range(scale):
+            f.write(data)
+
+
+def write_synthetic_dataset(input_path, scale, output_path, seed=42):
+    """
+    Generate a synthetic dataset learned from an input file (see ex1/src/generate_reviews.py).
+    :param input_path: The input file (local).
+    :param scale: The size of the synthetic dataset, as a multiple of the size of the input file.
+    :param output_path: The path of the synthetic dataset.
+    :param seed: The seed of the generator.
+    :return: Nothing.
+    """
+    subprocess.run([sys.executable, "generate_reviews.py", "-i", os.path.abspath(input_path), "--scale", str(scale),
+                    "--seed", str(seed), "-o", os.path.abspath(output_path)], cwd=MR_SRC_DIR, check=True)
+
+
+def format_bytes(num_bytes):
+    """
+    Format a number of bytes for the results table.
+    :param num_bytes: The number of bytes, or None if unknown.
+    :return: The number of MB, or "n/a".
+    """
+    return "n/a" if num_bytes is None else "%.1f" % (num_bytes / 1024 / 1024)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the MapReduce, RDD and DataFrame chi-squared implementations.")
+    parser.add_argument("-d", "--dataset", action="append", metavar="NAME=PATH",
+                        help="A dataset to run on (repeatable), e.g. tiny=hdfs:///user/.../tiny_devset.json. "
+                             "Default: devset=../../ex1/data/reviews_devset.json")
+    parser.add_argument("-s", "--scale", type=int, default=0,
+                        help="Also run on the first (local) dataset replicated this many times.")
+    parser.add_argument("--synthetic", type=float, nargs="+", default=[],
+                        help="Also run on synthetic datasets learned from the first (local) dataset, "
+                             "with these multiples of its size.")
+    parser.add_argument("-i", "--implementations", nargs="+", choices=IMPLEMENTATIONS, default=IMPLEMENTATIONS,
+                        help="The implementations to run.")
+    parser.add_argument("--mr-args", type=str, default="",
+                        help="Additional arguments of runner.py, e.g. \"--processes 8\" or \"-r hadoop ...\".")
+    parser.add_argument("--reference-dataset", type=str, default="devset",
+                        help="The dataset whose outputs are compared with the committed outputs.")
+    parser.add_argument("-o", "--output-dir", type=str, default=None,
+                        help="Directory for the outputs, logs and results.json (default: a temporary directory).")
+    args = parser.parse_args()
+
+    datasets = [dataset.split("=", 1) for dataset in args.dataset or
+                ["devset=" + os.path.join(MR_SRC_DIR, "..", "data", "reviews_devset.json")]]
+    output_dir = args.output_dir or tempfile.mkdtemp(prefix="benchmark_chi_squared_")
+    os.makedirs(output_dir, exist_ok=True)
+
+    if args.scale:
+        name, path = datasets[0]
+        if not is_local_path(path):
+            raise ValueError("--scale requires a local first dataset")
+        scaled_path = os.path.join(output_dir, "%s_x%d.json" % (name, args.scale))
+        write_scaled_dataset(path, args.scale, scaled_path)
+        datasets.append(("%s_x%d" % (name, args.scale), scaled_path))
+
+    for scale in args.synthetic:
+        name, path = datasets[0]
+        if not is_local_path(path):
+            raise ValueError("--synthetic requires a local first dataset")
+        synthetic_name = "synthetic_x%g" % scale
+        synthetic_path = os.path.join(output_dir, synthetic_name + ".json")
+        write_synthetic_dataset(path, scale, synthetic_path)
+        datasets.append((synthetic_name, synthetic_path))
+
+    results = []
+    for name, path in datasets:
+        work_dir = os.path.join(output_dir, name)
+        os.makedirs(work_dir, exist_ok=True)
+        output_paths = {}
+        dataset_results = {}
+        for implementation in args.implementations:
+            output_paths[implementation] = os.path.join(work_dir, "output_%s.txt" % implementation)
+            print("Running %s on %s..." % (implementation, name), file=sys.stderr)
+            if implementation == "mr":
+                metrics = run_mr(path, output_paths[implementation], work_dir, shlex.split(args.mr_args))
+            else:
+                metrics = run_notebook(implementation, path, output_paths[implementation], work_dir)
+            metrics.update(dataset=name, implementation=implementation, agreement={})
+            if name == args.reference_dataset:
+                metrics["agreement"]["reference"] = compare_outputs(
+                    implementation, output_paths[implementation], REFERENCE_OUTPUTS[implementation])
+            dataset_results[implementation] = metrics
+            results.append(metrics)
+
+        # the MapReduce and RDD implementations compute the same top K terms
+        if "mr" in output_paths and "rdd" in output_paths:
+            dataset_results["rdd"]["agreement"]["mr"] = compare_outputs("rdd", output_paths["rdd"], output_paths["mr"])
+
+    with open(os.path.join(output_dir, "results.json"), "w") as f:
+        json.dump(results, f, indent=2)
+
+    disagreements = find_disagreements(results)
+    if disagreements:
+        raise RuntimeError("The top K terms differ, see %s:\n%s" % (output_dir, "\n".join(disagreements)))
+
+    print("%-12s %-6s %10s %12s %12s  %s" % ("dataset", "impl", "time (s)", "memory (MB)", "shuffle (MB)", "agreement"))
+    for result in results:
+        print("%-12s %-6s %10.2f %12.1f %12s  %s" % (
+            result["dataset"], result["implementation"], result["wall_time"], result["peak_memory_mb"],
+            format_bytes(result["shuffle_bytes"]), json.dumps(result["agreement"])))
+    print("Outputs, logs and results.json are in %s" % output_dir)
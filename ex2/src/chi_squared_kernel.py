@@ -0,0 +1 @@
+../../ex1/src/chi_squared_kernel.py
\ No newline at end of file
@@ -0,0 +1,310 @@
+"""
+Chi-squared top K terms of each category on RDDs.
+
+The pipeline of 1_RDDs.ipynb as reusable functions. The input is parsed only once: parse_reviews() prunes each review
+to its category and text and persists the result, and count_categories() counts the reviews of each category in the
+pass that materializes it. Every shuffle aggregates on the map side (reduceByKey, aggregateByKey), so no key ever
+has to materialize all of its values in memory at once (as with groupByKey):
+
+- term_category_counts() counts the reviews containing each term in a list indexed by category id, i.e. the
+  shuffle carries one count vector per term and partition instead of one record per (term, category) pair.
+  A whole partition is tokenized and counted by a single Python call (mapPartitions), so only the pre-aggregated
+  counts are pickled for the JVM. Alternatively, term_category_counts_arrow() does the same with a pandas function
+  (mapInPandas) that receives the reviews as Arrow record batches instead of pickled tuples. Its reviews are read
+  and their categories encoded in the JVM (read_reviews()), so the pandas function is the only Python stage before
+  the shuffle, and the counts are grouped by term in the JVM.
+- chi_squared_values() computes the chi-squared values of all terms of a partition in batches with the NumPy kernel
+- top_terms_by_category() keeps a heap of at most K terms per category in each partition and merges these heaps,
+  i.e. the memory per category is bounded by K however many terms there are
+
+The memory per executor thus only depends on the number of unique terms (the vocabulary) and K, not on the number
+of reviews.
+
+export_term_counts() writes the term and category counts as a sparse matrix (see term_count_matrix.py), from which the
+top K terms can be recomputed locally for any K or subset of categories.
+
+The stopwords and the category counts are broadcast variables: they are sent to each executor once (and kept there
+for all tasks) instead of being pickled into the closure of every task. pickled_size() measures what a task ships.
+"""
+import heapq
+from collections import Counter
+
+from pyspark import StorageLevel
+from pyspark.serializers import CloudPickleSerializer
+from pyspark.sql import functions as F
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+from chi_squared_kernel import DEFAULT_BATCH_SIZE, chi_squared_batches
+from review_parser import CATEGORY_FIELD, TEXT_FIELD, get_review_parser
+from term_count_matrix import write_term_count_matrix
+from tokenizer import unique_terms
+
+TOKENIZATION_MODES = ["partitions", "arrow"]
+
+# columns of the reviews dataset read by read_reviews() (reading with a schema skips the schema inference pass)
+REVIEW_SCHEMA = "%s string, %s string" % (CATEGORY_FIELD, TEXT_FIELD)
+
+# schema of the pre-aggregated counts of the pandas function (one row per term and category of a partition)
+TERM_COUNTS_SCHEMA = "term string, category int, count int"
+
+
+def read_reviews(spark, path):
+    """
+    Read the category and the text of the reviews into a DataFrame, i.e. in the JVM.
+    :param spark: The SparkSession.
+    :param path: The path of the reviews file.
+    :return: DataFrame with the columns category and reviewText.
+    """
+    return spark.read.schema(REVIEW_SCHEMA).json(path)
+
+
+def parse_reviews(input_rdd, review_parser="auto", storage_level=StorageLevel.MEMORY_AND_DISK):
+    """
+    Parse the reviews into their category and text, dropping all other fields, and persist the result.
+    :param input_rdd: RDD of the lines of the reviews file.
+    :param review_parser: The name of the review parser (see review_parser.REVIEW_PARSERS).
+    :param storage_level: The storage level of the parsed reviews. With MEMORY_AND_DISK, the partitions that do not fit
+    into memory are spilled to disk instead of being parsed again.
+    :return: RDD of tuples of the form (category, review text).
+    """
+
+    def parse_partition(lines):
+        # create the parser on the executor, as parsers may hold state that cannot be pickled (e.g. simdjson's)
+        parse_review = get_review_parser(review_parser)
+        for line in lines:
+            yield parse_review(line)
+
+    return input_rdd.mapPartitions(parse_partition).persist(storage_level)
+
+
+def count_categories(category_review_rdd):
+    """
+    Count the reviews of each category.
+    Each partition counts its reviews in a dictionary, so only one dictionary per partition is sent to the driver.
+    If the reviews are persisted, this also materializes them.
+    :param category_review_rdd: RDD of tuples of the form (category, review text).
+    :return: A dictionary mapping categories to the number of reviews.
+    """
+
+    def count_partition(pairs):
+        yield Counter(category for category, _ in pairs)
+
+    return dict(category_review_rdd.mapPartitions(count_partition).reduce(lambda x, y: x + y))
+
+
+def encode_categories(category_review_rdd, category_ids):
+    """
+    Replace the category names by their ids.
+    :param category_review_rdd: RDD of tuples of the form (category, review text).
+    :param category_ids: A dictionary mapping categories to their ids.
+    :return: RDD of tuples of the form (category id, review text).
+    """
+    return category_review_rdd.map(lambda pair: (category_ids[pair[0]], pair[1]))
+
+
+def count_terms(category_reviews, stopwords, num_categories, counts=None):
+    """
+    Count the number of reviews containing each term for each category.
+    :param category_reviews: Iterable of tuples of the form (category id, review text).
+    :param stopwords: A (frozen) set of stopwords.
+    :param num_categories: The number of categories.
+    :param counts: A dictionary of counts to add the reviews to (default: a new dictionary).
+    :return: A dictionary mapping terms to lists of counts indexed by category id.
+    """
+    if counts is None:
+        counts = {}
+    for category, review_text in category_reviews:
+        # unique(!) terms of the review: each review is counted once per term
+        for term in unique_terms(review_text, stopwords):
+            term_counts = counts.get(term)
+            if term_counts is None:
+                term_counts = counts[term] = [0] * num_categories
+            term_counts[category] += 1
+    return counts
+
+
+def _merge_counts(counts, other_counts):
+    """
+    Add the counts of a term to other counts of the term (in place).
+    :param counts: A list of counts indexed by category id.
+    :param other_counts: Another list of counts indexed by category id.
+    :return: The summed counts.
+    """
+    for category, count in enumerate(other_counts):
+        counts[category] += count
+    return counts
+
+
+def term_category_counts(category_review_rdd, stopwords_broadcast, num_categories):
+    """
+    Count the number of reviews containing each term for each category.
+    Each partition is counted in a dictionary before the shuffle, so the memory of a task is bounded by the number of
+    unique terms of its partition.
+    :param category_review_rdd: RDD of tuples of the form (category id, review text).
+    :param stopwords_broadcast: Broadcast variable of a (frozen) set of stopwords.
+    :param num_categories: The number of categories.
+    :return: RDD of tuples of the form (term, list of counts indexed by category id).
+    """
+
+    def count_partition(pairs):
+        return count_terms(pairs, stopwords_broadcast.value, num_categories).items()
+
+    return category_review_rdd \
+        .mapPartitions(count_partition) \
+        .reduceByKey(_merge_counts)
+
+
+def term_category_counts_arrow(reviews, category_ids, stopwords_broadcast, num_categories):
+    """
+    Count the number of reviews containing each term for each category with a pandas function.
+    The categories are encoded by a column expression, and the reviews are sent from the JVM to the Python workers
+    as Arrow record batches (they are never pickled). The counts of all batches of a partition are returned as a
+    single pandas DataFrame with a row for each term and category, and grouped by term in the JVM.
+    :param reviews: DataFrame with the columns category and reviewText (see read_reviews()).
+    :param category_ids: A dictionary mapping categories to their ids.
+    :param stopwords_broadcast: Broadcast variable of a (frozen) set of stopwords.
+    :param num_categories: The number of categories.
+    :return: RDD of tuples of the form (term, list of counts indexed by category id).
+    """
+    if pd is None:
+        raise ImportError("The arrow tokenization mode requires the pandas package")
+
+    def count_batches(batches):
+        stopwords = stopwords_broadcast.value
+        counts = {}
+        for batch in batches:
+            count_terms(zip(batch["category"].tolist(), batch["text"].tolist()), stopwords, num_categories, counts)
+        rows = [(term, category, count)
+                for term, term_counts in counts.items() for category, count in enumerate(term_counts) if count]
+        yield pd.DataFrame({
+            "term": pd.Series([term for term, _, _ in rows], dtype=object),
+            "category": pd.Series([category for _, category, _ in rows], dtype="int32"),
+            "count": pd.Series([count for _, _, count in rows], dtype="int32"),
+        })
+
+    def dense_counts(row):
+        counts = [0] * num_categories
+        for category, count in row.counts:
+            counts[category] += count
+        return row.term, counts
+
+    # map literal of the category ids, looked up in the JVM
+    category_id = F.create_map(*[F.lit(value) for item in sorted(category_ids.items()) for value in item])
+    return reviews \
+        .select(category_id[F.col(CATEGORY_FIELD)].alias("category"), F.col(TEXT_FIELD).alias("text")) \
+        .mapInPandas(count_batches, TERM_COUNTS_SCHEMA) \
+        .groupBy("term") \
+        .agg(F.collect_list(F.struct("category", "count")).alias("counts")) \
+        .rdd \
+        .map(dense_counts)
+
+
+def export_term_counts(term_counts_rdd, path, categories, category_counts):
+    """
+    Write the term and category counts as a sparse matrix on the driver.
+    The counts are sorted by term and streamed to the driver one partition at a time, so the driver never holds more
+    than one partition of the counts (in addition to the compact arrays of the matrix).
+    :param term_counts_rdd: RDD of tuples of the form (term, list of counts indexed by category id).
+    :param path: The directory of the matrix.
+    :param categories: The alphabetically sorted list of categories.
+    :param category_counts: The number of reviews of each category (indexed by category id).
+    :return: The number of terms.
+    """
+    return write_term_count_matrix(path, categories, category_counts, term_counts_rdd.sortByKey().toLocalIterator())
+
+
+def chi_squared_values(term_counts_rdd, category_counts_broadcast, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Calculate the chi-squared value of each term for each category.
+    :param term_counts_rdd: RDD of tuples of the form (term, list of counts indexed by category id).
+    :param category_counts_broadcast: Broadcast variable of the number of reviews of each category (indexed by
+    category id).
+    :param batch_size: The number of terms whose chi-squared values are calculated at once.
+    :return: RDD of tuples of the form (category id, (chi-squared, term)).
+    """
+
+    def calculate_chi_squared(pairs):
+        category_counts = category_counts_broadcast.value
+        num_reviews = sum(category_counts)
+        # compute the chi-squared values of all categories for thousands of terms at once with NumPy
+        for term, category, chi_squared in chi_squared_batches(pairs, category_counts, num_reviews, batch_size):
+            yield category, (chi_squared, term)
+
+    return term_counts_rdd.mapPartitions(calculate_chi_squared)
+
+
+def top_terms_by_category(chi_squared_rdd, top_k=75):
+    """
+    Select the top K terms of each category.
+    :param chi_squared_rdd: RDD of tuples of the form (category id, (chi-squared, term)).
+    :param top_k: The number of terms to select for each category.
+    :return: RDD of tuples of the form (category id, list of tuples of the form (term, chi-squared)), with the terms
+    sorted by descending chi-squared value.
+    """
+
+    def add_term(heap, value):
+        # if the heap of terms for the category is full, replace the term with the lowest chi-squared value
+        if len(heap) >= top_k:
+            heapq.heappushpop(heap, value)
+        else:
+            heapq.heappush(heap, value)
+        return heap
+
+    def merge_heaps(heap, other_heap):
+        for value in other_heap:
+            add_term(heap, value)
+        return heap
+
+    def sorted_terms(heap):
+        return [(term, chi_squared) for chi_squared, term in sorted(heap, reverse=True)]
+
+    return chi_squared_rdd \
+        .aggregateByKey([], add_term, merge_heaps) \
+        .mapValues(sorted_terms)
+
+
+def top_terms(category_review_rdd, stopwords, category_counts, top_k=75, batch_size=DEFAULT_BATCH_SIZE,
+              tokenization="partitions", reviews=None, category_ids=None):
+    """
+    Compute the top K terms of each category.
+    The stopwords and the category counts are broadcast to the executors.
+    :param category_review_rdd: RDD of tuples of the form (category id, review text).
+    :param stopwords: A (frozen) set of stopwords.
+    :param category_counts: The number of reviews of each category (indexed by category id).
+    :param top_k: The number of terms to select for each category.
+    :param batch_size: The number of terms whose chi-squared values are calculated at once.
+    :param tokenization: How the reviews are tokenized and counted (one of TOKENIZATION_MODES): "partitions" for
+    mapPartitions, "arrow" for a pandas function.
+    :param reviews: DataFrame of the reviews (see read_reviews()), counted instead of the RDD by the arrow mode.
+    :param category_ids: A dictionary mapping categories to their ids (required by the arrow mode).
+    :return: RDD of tuples of the form (category id, list of tuples of the form (term, chi-squared)).
+    """
+    if tokenization not in TOKENIZATION_MODES:
+        raise ValueError("Unknown tokenization mode '%s', options are %s" % (tokenization, TOKENIZATION_MODES))
+    if tokenization == "arrow" and (reviews is None or category_ids is None):
+        raise ValueError("The arrow tokenization mode requires the reviews DataFrame and the category ids")
+
+    sc = category_review_rdd.context
+    stopwords_broadcast = sc.broadcast(frozenset(stopwords))
+    category_counts_broadcast = sc.broadcast(list(category_counts))
+    if tokenization == "arrow":
+        term_counts_rdd = term_category_counts_arrow(reviews, category_ids, stopwords_broadcast, len(category_counts))
+    else:
+        term_counts_rdd = term_category_counts(category_review_rdd, stopwords_broadcast, len(category_counts))
+    chi_squared_rdd = chi_squared_values(term_counts_rdd, category_counts_broadcast, batch_size)
+    return top_terms_by_category(chi_squared_rdd, top_k)
+
+
+def pickled_size(rdd):
+    """
+    Get the size of the function an RDD ships with each of its tasks, i.e. its pipelined transformations including
+    everything their closures capture, pickled the way PySpark pickles it.
+    A broadcast variable only adds its id to the pickled function.
+    :param rdd: An RDD created by a transformation (map(), flatMap(), mapPartitions(), ...).
+    :return: The size in bytes.
+    """
+    return len(CloudPickleSerializer().dumps(rdd.func))
@@ -0,0 +1,160 @@
+"""
+Chi-squared top K terms of each category with Spark SQL.
+
+The same computation as the RDD pipeline (chi_squared_rdd.py), expressed with DataFrame column expressions only, so
+that it runs entirely in the JVM (no Python UDFs, no data is pickled to Python workers):
+
+- the review texts are split with the pattern of the shared tokenizer, lowercased and deduplicated per review
+  (array_distinct), and the terms are exploded into (category, term) rows
+- short terms are filtered out and the stopwords are removed with an anti join against a broadcast DataFrame
+- the rows are grouped by term and category, the number of reviews of each category is joined as a broadcast table,
+  and the chi-squared values are calculated with column expressions
+- the top K terms of each category are selected with row_number() over a window partitioned by category
+
+The output file has the format of output_rdd.txt (and for the same input, the same content).
+"""
+import argparse
+import os
+
+from pyspark.sql import SparkSession, Window
+from pyspark.sql import functions as F
+
+from tokenizer import MIN_TERM_LENGTH, TOKEN_PATTERN, load_stopwords
+
+# columns of the reviews dataset read by the pipeline (reading with a schema skips the schema inference pass)
+REVIEW_SCHEMA = "category string, reviewText string"
+
+
+def load_stopwords_df(spark, path="stopwords.txt"):
+    """
+    Load the stopwords into a DataFrame.
+    :param spark: The SparkSession.
+    :param path: The path of the stopwords file.
+    :return: DataFrame with the column term.
+    """
+    return spark.createDataFrame([(term,) for term in sorted(load_stopwords(path))], "term string")
+
+
+def review_terms(reviews, stopwords):
+    """
+    Get the unique terms of each review.
+    :param reviews: DataFrame with the columns category and reviewText.
+    :param stopwords: DataFrame with the column term.
+    :return: DataFrame with the columns category and term, with one row for each unique term of each review.
+    """
+    # split before lowercasing, as the shared tokenizer does for non-ASCII texts
+    tokens = F.expr("array_distinct(transform(split(reviewText, '%s'), token -> lower(token)))" % TOKEN_PATTERN.pattern)
+    return reviews \
+        .select("category", F.explode(tokens).alias("term")) \
+        .where(F.length("term") >= MIN_TERM_LENGTH) \
+        .join(F.broadcast(stopwords), "term", "left_anti")
+
+
+def term_category_counts(terms):
+    """
+    Count the number of reviews containing each term for each category.
+    :param terms: DataFrame with the columns category and term (see review_terms()).
+    :return: DataFrame with the columns term, category and a (the number of reviews).
+    """
+    return terms.groupBy("term", "category").agg(F.count("*").alias("a"))
+
+
+def chi_squared_values(term_counts, category_counts):
+    """
+    Calculate the chi-squared value of each term for each category with reviews containing the term.
+    :param term_counts: DataFrame with the columns term, category and a (see term_category_counts()).
+    :param category_counts: DataFrame with the columns category and category_count (the number of reviews).
+    :return: DataFrame with the columns category, term and chi_squared.
+    """
+    # number of documents in c which contain t
+    a = F.col("a").cast("double")
+    # number of documents not in c which contain t
+    b = (F.sum("a").over(Window.partitionBy("term")) - F.col("a")).cast("double")
+    # number of documents in c without t
+    c = (F.col("category_count") - F.col("a")).cast("double")
+
+    # the category counts (one row per category) are small enough to be broadcast to every task
+    total = category_counts.select(F.sum("category_count").cast("double").alias("n"))
+    values = term_counts \
+        .join(F.broadcast(category_counts), "category") \
+        .crossJoin(F.broadcast(total)) \
+        .select("category", "term", a.alias("a"), b.alias("b"), c.alias("c"), "n")
+    # number of documents not in c without t
+    d = F.col("n") - F.col("a") - F.col("b") - F.col("c")
+
+    # the same floating point operations in the same order as the NumPy kernel, so the values are identical
+    difference = F.col("a") * d - F.col("b") * F.col("c")
+    numerator = F.col("n") * (difference * difference)
+    denominator = (F.col("a") + F.col("b")) * (F.col("a") + F.col("c")) * (F.col("b") + d) * (F.col("c") + d)
+    return values.select(
+        "category", "term",
+        F.when(denominator > 0, numerator / denominator).otherwise(F.lit(0.0)).alias("chi_squared"))
+
+
+def rank_top_terms(values, top_k=75):
+    """
+    Select the top K terms of each category.
+    :param values: DataFrame with the columns category, term and chi_squared (see chi_squared_values()).
+    :param top_k: The number of terms to select for each category.
+    :return: DataFrame with the columns category, rank, term and chi_squared.
+    """
+    # ties are broken by term, as in the RDD pipeline
+    window = Window.partitionBy("category").orderBy(F.desc("chi_squared"), F.desc("term"))
+    return values \
+        .select("*", F.row_number().over(window).alias("rank")) \
+        .where(F.col("rank") <= top_k) \
+        .select("category", "rank", "term", "chi_squared")
+
+
+def top_terms(reviews, stopwords, top_k=75):
+    """
+    Compute the top K terms of each category.
+    :param reviews: DataFrame with the columns category and reviewText.
+    :param stopwords: DataFrame with the column term.
+    :param top_k: The number of terms to select for each category.
+    :return: DataFrame with the columns category, rank, term and chi_squared.
+    """
+    category_counts = reviews.groupBy("category").agg(F.count("*").alias("category_count"))
+    term_counts = term_category_counts(review_terms(reviews, stopwords))
+    return rank_top_terms(chi_squared_values(term_counts, category_counts), top_k)
+
+
+def write_top_terms(rows, path):
+    """
+    Write the top terms in the format of output_rdd.txt.
+    The file is written next to its final path and renamed, so readers never see a partially written file.
+    :param rows: The collected rows of top_terms().
+    :param path: The path of the output file.
+    :return: Nothing.
+    """
+    terms_for_category = {}
+    for row in sorted(rows, key=lambda row: (row.category, row.rank)):
+        terms_for_category.setdefault(row.category, []).append((row.term, row.chi_squared))
+
+    # Format of each output line: "<category> term1:chi_squared1 term2:chi_squared2 ... term75:chi_squared75"
+    # finally, append the list of tokens to the end of the file
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w") as file:
+        for category, terms in terms_for_category.items():
+            file.write("<%s>" % category + " ")
+            for token, chi_square in terms:
+                file.write("%s:%f" % (token, chi_square) + " ")
+            file.write("\n")
+        tokens = sorted(set(term for terms in terms_for_category.values() for term, _ in terms))
+        file.write(" ".join(tokens) + "\n")
+    os.replace(temporary_path, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute the top K chi-squared terms of each category with Spark SQL.")
+    parser.add_argument("-i", "--input", type=str, help="Path to the reviews file.",
+                        default="hdfs:///user/dic23_shared/amazon-reviews/full/reviews_devset.json")
+    parser.add_argument("-s", "--stopwords", type=str, help="Path to the stopwords file.", default="stopwords.txt")
+    parser.add_argument("-o", "--output", type=str, help="Path of the output file.", default="output_sql.txt")
+    parser.add_argument("-k", "--top-k", type=int, default=75, help="Number of terms to select for each category.")
+    args = parser.parse_args()
+
+    spark = SparkSession.builder.appName("ChiSquaredSQL").getOrCreate()
+    reviews = spark.read.schema(REVIEW_SCHEMA).json(args.input)
+    write_top_terms(top_terms(reviews, load_stopwords_df(spark, args.stopwords), args.top_k).collect(), args.output)
+    spark.stop()
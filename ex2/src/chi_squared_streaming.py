@@ -0,0 +1,166 @@
+"""
+Chi-squared top K terms of each category over a stream of reviews with Spark Structured Streaming.
+
+Reviews (JSON lines in the format of the reviews dataset) are read from the files appearing in a watched directory.
+A single stateful streaming aggregation keeps the number of reviews containing each term of a fixed vocabulary for
+each category, and, under a reserved term (as in ex1's TermCounter), the number of reviews of each category. After
+each micro-batch, the complete aggregated table is passed to foreachBatch(), which calculates the chi-squared values
+and the top K terms of each category with the batch implementation (chi_squared_sql.py) and writes them to the output
+file.
+
+State size: the state holds one count per (term, category) pair and per category, and only terms of the vocabulary
+are counted, so it has at most (vocabulary size + 1) x (number of categories) rows, however many reviews and distinct
+terms the feed brings. Reviews are never kept in the state. The table re-ranked after each micro-batch is the state,
+so the re-ranking is bounded by the same size. Spark's state store cannot evict entries of an aggregation other than
+by a watermark, which would restrict the counts to a time window, so the bound is the vocabulary: a text file with
+one term per line, or a term count matrix (see term_count_matrix.py, e.g. written by the RDD pipeline from the
+historical reviews), from which the --vocabulary-size terms contained in the most reviews are taken. The counts of
+the terms of the vocabulary, the category counts and thus the chi-squared values are exact. Terms outside the
+vocabulary are not ranked, so a new vocabulary (e.g. from a matrix of more recent reviews) is picked up by restarting
+the query with it (with the same checkpoint, the counts of terms already in the vocabulary are kept, new terms start
+at zero).
+
+Spark keeps the state in its state store and checkpoints it, so a restarted query continues with the counts of all
+files processed before (with --checkpoint).
+
+The query can be tested locally with the file source as a stand-in for the review feed, e.g. with
+--master local[*] and --available-now, after copying (parts of) a reviews file into the watched directory. For the
+devset with a vocabulary containing all of its terms (e.g. the matrix written by export_term_counts() of
+chi_squared_rdd.py), the output file is identical to output_rdd.txt.
+"""
+import argparse
+import logging
+import os
+
+import numpy as np
+from pyspark.sql import SparkSession
+from pyspark.sql import functions as F
+
+from chi_squared_sql import (REVIEW_SCHEMA, chi_squared_values, load_stopwords_df, rank_top_terms, review_terms,
+                             term_category_counts, write_top_terms)
+from term_count_matrix import TermCountMatrix
+
+logger = logging.getLogger(__name__)
+
+# reserved "term" under which the number of reviews of each category is counted
+# (cannot collide with a real term, which has at least two characters)
+CATEGORY_COUNTS_TERM = ""
+
+
+def load_vocabulary(spark, path, size=None):
+    """
+    Load the vocabulary counted by the streaming query.
+    :param spark: The SparkSession.
+    :param path: A text file with one term per line, or the directory of a term count matrix.
+    :param size: The maximum number of terms: the first lines of a text file, or the terms of a matrix contained in the
+    most reviews (default: all terms).
+    :return: DataFrame with the column term.
+    """
+    if os.path.isdir(path):
+        matrix = TermCountMatrix(path)
+        rows = np.arange(len(matrix.vocabulary))
+        if size is not None and size < len(rows):
+            # the terms contained in the most reviews (ties broken by row, i.e. alphabetically)
+            rows = np.lexsort((rows, -matrix.term_counts()))[:size]
+        terms = [matrix.vocabulary[row] for row in rows.tolist()]
+    else:
+        with open(path, "r") as f:
+            terms = [line.strip() for line in f if line.strip()]
+        if size is not None:
+            terms = terms[:size]
+    return spark.createDataFrame([(term,) for term in terms], "term string")
+
+
+def streaming_counts(reviews, stopwords, vocabulary):
+    """
+    Define the stateful aggregation of the term and category counts of a stream of reviews.
+    :param reviews: Streaming DataFrame with the columns category and reviewText.
+    :param stopwords: DataFrame with the column term.
+    :param vocabulary: DataFrame with the column term, the terms which are counted (bounding the state).
+    :return: Streaming DataFrame with the columns term, category and a (the number of reviews), with the
+    number of reviews of each category under the term CATEGORY_COUNTS_TERM.
+    """
+    documents = reviews.select("category", F.lit(CATEGORY_COUNTS_TERM).alias("term"))
+    # the vocabulary is a static table, joined to each micro-batch
+    terms = review_terms(reviews, stopwords).join(F.broadcast(vocabulary), "term")
+    return term_category_counts(terms.unionByName(documents))
+
+
+def top_terms_from_counts(counts, top_k=75):
+    """
+    Compute the top K terms of each category from the aggregated counts.
+    :param counts: DataFrame with the columns term, category and a (see streaming_counts()).
+    :param top_k: The number of terms to select for each category.
+    :return: DataFrame with the columns category, rank, term and chi_squared.
+    """
+    category_counts = counts \
+        .where(F.col("term") == CATEGORY_COUNTS_TERM) \
+        .select("category", F.col("a").alias("category_count"))
+    term_counts = counts.where(F.col("term") != CATEGORY_COUNTS_TERM)
+    return rank_top_terms(chi_squared_values(term_counts, category_counts), top_k)
+
+
+def start_query(spark, input_dir, output_path, vocabulary_path, vocabulary_size=None, stopwords_path="stopwords.txt",
+                top_k=75, max_files_per_trigger=None, checkpoint=None, available_now=False):
+    """
+    Start the streaming query.
+    :param spark: The SparkSession.
+    :param input_dir: The directory watched for new review files.
+    :param output_path: The path of the output file, rewritten after each micro-batch.
+    :param vocabulary_path: The path of the vocabulary (see load_vocabulary()).
+    :param vocabulary_size: The maximum number of terms of the vocabulary.
+    :param stopwords_path: The path of the stopwords file.
+    :param top_k: The number of terms to select for each category.
+    :param max_files_per_trigger: The maximum number of new files read per micro-batch (default: all new files).
+    :param checkpoint: The checkpoint directory of the query (default: a temporary directory).
+    :param available_now: Whether to process the files that are in the directory now and stop.
+    :return: The StreamingQuery.
+    """
+    reader = spark.readStream.schema(REVIEW_SCHEMA)
+    if max_files_per_trigger:
+        reader = reader.option("maxFilesPerTrigger", max_files_per_trigger)
+    vocabulary = load_vocabulary(spark, vocabulary_path, vocabulary_size)
+    logger.info("Counting the %d terms of the vocabulary %s" % (vocabulary.count(), vocabulary_path))
+    counts = streaming_counts(reader.json(input_dir), load_stopwords_df(spark, stopwords_path), vocabulary)
+
+    def update_top_terms(batch_counts, batch_id):
+        # the complete output mode passes the whole aggregated table, i.e. the counts of all reviews so far.
+        # It is read twice (term and category counts), so persist it instead of recomputing the micro-batch
+        batch_counts.persist()
+        write_top_terms(top_terms_from_counts(batch_counts, top_k).collect(), output_path)
+        batch_counts.unpersist()
+        logger.info("Batch %d: wrote the top %d terms of each category to %s" % (batch_id, top_k, output_path))
+
+    writer = counts.writeStream.outputMode("complete").foreachBatch(update_top_terms)
+    if checkpoint:
+        writer = writer.option("checkpointLocation", checkpoint)
+    if available_now:
+        writer = writer.trigger(availableNow=True)
+    return writer.start()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    parser = argparse.ArgumentParser(description="Compute the top K chi-squared terms of each category over a stream "
+                                                 "of review files with Spark Structured Streaming.")
+    parser.add_argument("-i", "--input-dir", type=str, required=True, help="Directory watched for new review files.")
+    parser.add_argument("-v", "--vocabulary", type=str, required=True,
+                        help="Terms to count (bounding the state): a text file with one term per line, or the "
+                             "directory of a term count matrix.")
+    parser.add_argument("--vocabulary-size", type=int,
+                        help="Maximum number of terms (of a matrix: the terms contained in the most reviews).")
+    parser.add_argument("-s", "--stopwords", type=str, help="Path to the stopwords file.", default="stopwords.txt")
+    parser.add_argument("-o", "--output", type=str, help="Path of the output file.", default="output_streaming.txt")
+    parser.add_argument("-k", "--top-k", type=int, default=75, help="Number of terms to select for each category.")
+    parser.add_argument("--max-files-per-trigger", type=int, help="Maximum number of new files per micro-batch.")
+    parser.add_argument("--checkpoint", type=str, help="Checkpoint directory (for restarting the query).")
+    parser.add_argument("--available-now", action="store_true",
+                        help="Process the files in the directory and stop (e.g. for testing).")
+    args = parser.parse_args()
+
+    spark = SparkSession.builder.appName("ChiSquaredStreaming").getOrCreate()
+    query = start_query(spark, args.input_dir, args.output, args.vocabulary, args.vocabulary_size, args.stopwords,
+                        args.top_k, args.max_files_per_trigger, args.checkpoint, args.available_now)
+    query.awaitTermination()
+    spark.stop()
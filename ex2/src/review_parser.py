@@ -0,0 +1 @@
+../../ex1/src/review_parser.py
\ No newline at end of file
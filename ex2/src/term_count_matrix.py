@@ -0,0 +1 @@
+../../ex1/src/term_count_matrix.py
\ No newline at end of file
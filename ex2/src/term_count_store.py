@@ -0,0 +1 @@
+../../ex1/src/term_count_store.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../ex1/src/tokenizer.py
\ No newline at end of file
@@ -4,6 +4,7 @@ import json
 import os
 import requests
 import argparse
+import struct
 import time
 import datetime
 
@@ -37,6 +38,103 @@ def process_img(img_path):
     return base64_image
 
 
+def encode_length_prefixed_images(img_paths):
+    """
+    Encode local image files in the length-prefixed binary format of the /api/detect/binary endpoint:
+    for each image, the length (4-byte big-endian) and the UTF-8 encoded filename, followed by the length and the raw bytes of the image.
+    """
+    chunks = []
+    for path in img_paths:
+        name = os.path.basename(path).encode("utf-8")
+        with open(path, "rb") as f:
+            img_bytes = f.read()
+        chunks += [struct.pack(">I", len(name)), name, struct.pack(">I", len(img_bytes)), img_bytes]
+    return b"".join(chunks)
+
+
+def build_request(base_url, img_paths, model, upload_format="json", stream=False):
+    """
+    Build the keyword arguments of requests.post() for sending images to the API.
+    With stream=True, the detections are requested as a streamed (newline-delimited JSON) response.
+
+    upload_format is one of
+    - "json": Base64 strings in a JSON payload (/api/detect)
+    - "multipart": files of a multipart/form-data request (/api/detect/binary)
+    - "binary": length-prefixed binary stream (/api/detect/binary)
+    """
+    request_kwargs = _build_upload(base_url, img_paths, model, upload_format)
+    if stream:
+        request_kwargs.setdefault("headers", {})["Accept"] = "application/x-ndjson"
+        request_kwargs["stream"] = True
+    return request_kwargs
+
+
+def _build_upload(base_url, img_paths, model, upload_format):
+    if upload_format == "json":
+        img_payload_dicts = [
+            {"name": os.path.basename(path), "content": process_img(path)}
+            for path in img_paths
+        ]
+        return {
+            "url": f"{base_url}/api/detect",
+            "data": json.dumps({"images": img_payload_dicts, "model": model}),
+            "headers": {"Content-Type": "application/json"},
+        }
+    if upload_format == "multipart":
+        files = []
+        for path in img_paths:
+            with open(path, "rb") as f:
+                files.append(("images", (os.path.basename(path), f.read(), "image/jpeg")))
+        return {
+            "url": f"{base_url}/api/detect/binary",
+            "params": {"model": model},
+            "files": files,
+        }
+    if upload_format == "binary":
+        return {
+            "url": f"{base_url}/api/detect/binary",
+            "params": {"model": model},
+            "data": encode_length_prefixed_images(img_paths),
+            "headers": {"Content-Type": "application/octet-stream"},
+        }
+    raise ValueError(f"Unknown upload format '{upload_format}'")
+
+
+def read_streamed_response(response, request_start_time):
+    """
+    Consume a streamed (newline-delimited JSON) response line by line, as the detections of the images arrive.
+
+    Returns the response content in the format of the non-streamed response and the time (in seconds, since request_start_time
+    as returned by time.perf_counter()) until the first detection arrived.
+    """
+    predictions = []
+    summary = {}
+    time_to_first_result = None
+    for line in response.iter_lines():
+        if not line:
+            continue
+        item = json.loads(line)
+        if item.get("summary"):
+            # trailer line with the timing stats of the request
+            summary = item
+            continue
+        if time_to_first_result is None:
+            time_to_first_result = time.perf_counter() - request_start_time
+        predictions.append(item)
+        if "error" in item:
+            print(f"Detection failed for '{item['filename']}': {item['error']}")
+        else:
+            print(f"Received detections for '{item['filename']}' ({len(predictions)} images)")
+
+    if not summary:
+        raise ValueError("Streamed response ended without summary line")
+    response_content = {"predictions": predictions}
+    response_content.update(
+        {key: value for key, value in summary.items() if key != "summary"}
+    )
+    return response_content, time_to_first_result
+
+
 def write_json_to_file(json: str, path: str):
     with open(path, "w") as file:
         file.write(json)
@@ -84,12 +182,28 @@ if __name__ == "__main__":
         help="model to use for inference.",
         default="resnet50_v1_fpn_640x640",
     )
+    parser.add_argument(
+        "-u",
+        "--upload-format",
+        type=str,
+        choices=["json", "multipart", "binary"],
+        help="how the images are uploaded: Base64 strings in JSON, multipart/form-data files or a length-prefixed binary stream.",
+        default="json",
+    )
+    parser.add_argument(
+        "-s",
+        "--stream",
+        action="store_true",
+        help="request a streamed response and process the detection of each image as soon as it arrives.",
+    )
 
     args = parser.parse_args()
     input_dir = args.input_dir
     output_dir = args.output_dir
     model = args.model
     base_url = args.base_url
+    upload_format = args.upload_format
+    stream = args.stream
 
     if not os.path.isdir(input_dir):
         raise ValueError(f"Input directory '{input_dir}' does not exist.")
@@ -105,56 +219,49 @@ if __name__ == "__main__":
         )
 
     print(f"Found {len(img_paths)} images in '{input_dir}'")
-    print("Encoding images as array of Base64 strings")
+    print(f"Encoding images for upload format '{upload_format}'")
 
     encoding_start_time = time.time()
-    base64_imgs = [process_img(path) for path in img_paths]
+    request_kwargs = build_request(base_url, img_paths, model, upload_format, stream)
     encoding_time = time.time() - encoding_start_time
     print(f"Encoding took {encoding_time} seconds")
 
-    filenames = [os.path.basename(path) for path in img_paths]
-
-    img_payload_dicts = [
-        {"name": name, "content": content}
-        for name, content in zip(filenames, base64_imgs)
-    ]
-
-    url = f"{base_url}/api/detect"
-    headers = {"Content-Type": "application/json"}
+    url = request_kwargs["url"]
 
     print(f"Sending warm up request to API")
     # First, send "warm-up request" to the model server (inference for first image(s) always takes longer)
     # in real-life settings, the request made by a client is very unlikely to be the very first ever
     # so, response time measurements for this request aren't meaningful metrics for the general performance of the model server
-    warmup_request_payload = json.dumps(
-        {
-            "images": [
-                img_payload_dicts[0],
-                img_payload_dicts[0],
-                img_payload_dicts[0],
-            ],
-            "model": model,
-        }
+    warmup_request = requests.post(
+        **build_request(base_url, [img_paths[0]] * 3, model, upload_format)
     )
-    warmup_request = requests.post(url, data=warmup_request_payload, headers=headers)
     print(f"Received response with status code {warmup_request.status_code}")
 
     print("Proceeding with actual data...")
-    payload = json.dumps({"images": img_payload_dicts, "model": model})
 
     upload_start_datetime, start_datetime_str = get_current_timestamp()
     print(f"Sending request to API")
-    response = requests.post(url, data=payload, headers=headers)
-    request_time = (
-        response.elapsed.total_seconds()
-    )  # https://stackoverflow.com/a/43260678/13727176
+    request_start_time = time.perf_counter()
+    response = requests.post(**request_kwargs)
     print(f"Received response with status code {response.status_code}")
+    time_to_first_result = None
+    if stream:
+        response.raise_for_status()
+        response_content, time_to_first_result = read_streamed_response(
+            response, request_start_time
+        )
+        # response.elapsed only measures the time until the headers arrived
+        request_time = time.perf_counter() - request_start_time
+        print(f"First detection arrived after {time_to_first_result} seconds")
+    else:
+        request_time = (
+            response.elapsed.total_seconds()
+        )  # https://stackoverflow.com/a/43260678/13727176
+        response_content = response.json()
     print(
         f"Request (sending input data and receiving response with results) took {request_time} seconds"
     )
 
-    response_content = response.json()
-
     server_processing_time = response_content["processing_time"]
     print(f"Server processed data in {server_processing_time} seconds")
 
@@ -180,6 +287,10 @@ if __name__ == "__main__":
     result["input_folder_name"] = input_dir.split("/")[-1]
     result["api_url"] = url
     result["model"] = model
+    result["upload_format"] = upload_format
+    result["stream"] = stream
+    result["time_to_first_result"] = time_to_first_result
+    result["encoding_time"] = encoding_time
 
     output_file_path = os.path.join(
         output_dir,
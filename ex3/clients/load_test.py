@@ -0,0 +1,217 @@
+"""
+Load test for the Flask object detection API.
+
+Sends detection requests from several concurrent clients and reports the throughput (requests and images per second)
+and the latency percentiles, e.g. for comparing the development server (python app.py) with the production serving
+mode (gunicorn) or different worker/thread/batching configurations.
+"""
+import argparse
+import datetime
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from client_flask_api import get_image_paths, process_img, write_json_to_file
+
+
+def send_request(session, url, payload, use_async, poll_interval, poll_timeout):
+    """
+    Sends a detection request and waits for its result.
+
+    Returns:
+        the latency of the request in seconds
+
+    Raises:
+        TimeoutError: if the result of an asynchronous request is not available within poll_timeout seconds
+    """
+    start_time = time.perf_counter()
+    if not use_async:
+        response = session.post(url, data=payload, headers={"Content-Type": "application/json"})
+        response.raise_for_status()
+    else:
+        response = session.post(f"{url}/async", data=payload, headers={"Content-Type": "application/json"})
+        response.raise_for_status()
+        status_url = url.rsplit("/api/detect", 1)[0] + response.json()["status_url"]
+        while True:
+            response = session.get(status_url)
+            if response.status_code != 202:
+                response.raise_for_status()
+                break
+            if time.perf_counter() - start_time > poll_timeout:
+                raise TimeoutError(f"No result for {status_url} after {poll_timeout} seconds")
+            time.sleep(poll_interval)
+    return time.perf_counter() - start_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load test for the object detection API. Sends requests with images from a given input folder from several concurrent clients."
+    )
+    parser.add_argument(
+        "-i",
+        "--input_dir",
+        type=str,
+        help="Path to directory where images should be uploaded from.",
+        required=True,
+    )
+    parser.add_argument(
+        "-b",
+        "--base-url",
+        type=str,
+        help="base URL of the API.",
+        default="http://localhost:8502",
+    )
+    parser.add_argument(
+        "-m",
+        "--model",
+        type=str,
+        help="model to use for inference.",
+        default="ssd_mobilenet_v2",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        help="number of concurrent clients.",
+        default=8,
+    )
+    parser.add_argument(
+        "-n",
+        "--num-requests",
+        type=int,
+        help="total number of requests.",
+        default=200,
+    )
+    parser.add_argument(
+        "--images-per-request",
+        type=int,
+        help="number of images sent with each request.",
+        default=1,
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="use the asynchronous detection endpoint (submit a job and poll its result).",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        help="seconds between polls of the asynchronous endpoint.",
+        default=0.05,
+    )
+    parser.add_argument(
+        "--poll-timeout",
+        type=float,
+        help="seconds after which an asynchronous request without result counts as failed.",
+        default=300,
+    )
+    parser.add_argument(
+        "-o",
+        "--output_dir",
+        type=str,
+        help="Path to directory where the load test result JSON should be stored (optional).",
+    )
+
+    args = parser.parse_args()
+
+    img_paths = get_image_paths(args.input_dir)
+    if len(img_paths) == 0:
+        raise ValueError(
+            f"Input directory {args.input_dir} does not contain any .jpg images."
+        )
+
+    # the payloads are prepared up front, so that the clients only measure the API
+    payloads = []
+    for request_num in range(args.num_requests):
+        paths = [
+            img_paths[(request_num * args.images_per_request + i) % len(img_paths)]
+            for i in range(args.images_per_request)
+        ]
+        payloads.append(
+            json.dumps(
+                {
+                    "images": [
+                        {"name": os.path.basename(path), "content": process_img(path)}
+                        for path in paths
+                    ],
+                    "model": args.model,
+                }
+            )
+        )
+
+    url = f"{args.base_url.rstrip('/')}/api/detect"
+
+    # one session (connection) per client thread
+    sessions = threading.local()
+
+    def run(payload):
+        if not hasattr(sessions, "session"):
+            sessions.session = requests.Session()
+        try:
+            return send_request(
+                sessions.session, url, payload, args.use_async, args.poll_interval, args.poll_timeout
+            )
+        except (requests.RequestException, TimeoutError) as e:
+            print(f"Request failed: {e}")
+            return None
+
+    print("Sending warm up request to API")
+    if run(payloads[0]) is None:
+        raise RuntimeError("Warm up request failed")
+
+    print(
+        f"Sending {args.num_requests} requests with {args.images_per_request} image(s) each from {args.concurrency} concurrent clients"
+    )
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        latencies = list(executor.map(run, payloads))
+    total_time = time.perf_counter() - start_time
+
+    # failed requests are counted, but neither in the throughput nor in the latencies
+    num_failed = sum(latency is None for latency in latencies)
+    num_succeeded = args.num_requests - num_failed
+    if num_succeeded == 0:
+        raise RuntimeError("All requests failed")
+    latencies = np.array([latency for latency in latencies if latency is not None])
+    result = {
+        "api_url": url,
+        "model": args.model,
+        "async": args.use_async,
+        "concurrency": args.concurrency,
+        "num_requests": args.num_requests,
+        "failed_requests": num_failed,
+        "images_per_request": args.images_per_request,
+        "total_time": total_time,
+        "requests_per_second": num_succeeded / total_time,
+        "images_per_second": num_succeeded * args.images_per_request / total_time,
+        "latency_p50": float(np.percentile(latencies, 50)),
+        "latency_p90": float(np.percentile(latencies, 90)),
+        "latency_p99": float(np.percentile(latencies, 99)),
+        "latency_mean": float(latencies.mean()),
+    }
+    if num_failed:
+        print(f"{num_failed} of {args.num_requests} requests failed")
+    print(f"Throughput: {result['requests_per_second']:.2f} requests/s, {result['images_per_second']:.2f} images/s")
+    print(
+        f"Latency: p50 {result['latency_p50']:.3f} s, p90 {result['latency_p90']:.3f} s, p99 {result['latency_p99']:.3f} s"
+    )
+
+    try:
+        batching_metrics = requests.get(f"{args.base_url.rstrip('/')}/api/metrics").json()
+        result["server_metrics"] = batching_metrics.get(args.model)
+    except (requests.RequestException, ValueError):
+        # servers without batching do not expose metrics
+        pass
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        timestamp = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        output_file_path = os.path.join(args.output_dir, f"load_test_{args.model}_{timestamp}.json")
+        print(f"Writing result to '{output_file_path}'")
+        write_json_to_file(json.dumps(result), output_file_path)
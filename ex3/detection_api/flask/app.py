@@ -1,30 +1,83 @@
-import time
 import os
+import re
+import struct
+import tempfile
+import time
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import tensorflow as tf
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, Response, request, jsonify, make_response
 import datetime
 from datetime import timezone
 import base64
 
+from batcher import DynamicBatcher
+
+# newline-delimited JSON: one JSON object per line, see stream_detections()
+NDJSON_MIMETYPE = "application/x-ndjson"
+
 
 def create_app():
     app = Flask(__name__)
 
+    # has to happen before the models are loaded (TF's thread pools are created with the first operation)
+    configure_tf_threads()
+
     model_config = {
         # key is the model name, value is the path to the saved model in the file system
         "resnet50_v1_fpn_640x640": get_model_path("resnet50_v1_fpn_640x640_base64"),
         "ssd_mobilenet_v2": get_model_path("ssd_mobilenet_v2_base64"),
     }
 
+    # images of concurrent requests are collected into batches of up to MAX_BATCH_SIZE images,
+    # waiting at most MAX_BATCH_WAIT_MS milliseconds for a batch to fill up
+    max_batch_size = int(os.environ.get("MAX_BATCH_SIZE", 8))
+    max_batch_wait_time = float(os.environ.get("MAX_BATCH_WAIT_MS", 5)) / 1000
+    # after a model rejected a batch, images are run one by one for BATCHING_RETRY_INTERVAL_S seconds
+    batching_retry_interval = float(os.environ.get("BATCHING_RETRY_INTERVAL_S", 300))
+
     models = {}
     for model_name, model_path in model_config.items():
         print(f"Loading model {model_name} from {model_path}")
         detector = tf.saved_model.load(model_path)
         print(f"Model {model_name} loaded successfully")
         predict_fn = detector.signatures["serving_default"]
-        models[model_name] = predict_fn
+        models[model_name] = DynamicBatcher(
+            predict_fn,
+            max_batch_size=max_batch_size,
+            max_wait_time=max_batch_wait_time,
+            batching_retry_interval=batching_retry_interval,
+        )
 
     app.models = models
+    app.model_config = model_config
+
+    # results of asynchronous detection jobs are stored as files, so that any worker process of the server can serve
+    # them (the worker polled for a result is not necessarily the one that ran the job)
+    async_results_dir = os.environ.get(
+        "ASYNC_RESULTS_DIR", os.path.join(tempfile.gettempdir(), "detection_jobs")
+    )
+    os.makedirs(async_results_dir, exist_ok=True)
+    # a job still pending after ASYNC_JOB_TIMEOUT_S seconds is reported as failed (e.g. its worker was killed or
+    # restarted), job files are deleted ASYNC_JOB_TTL_S seconds after they were last written
+    async_job_timeout = float(os.environ.get("ASYNC_JOB_TIMEOUT_S", 600))
+    async_job_ttl = max(
+        float(os.environ.get("ASYNC_JOB_TTL_S", 3600)), async_job_timeout
+    )
+    last_cleanup_time = 0.0
+    # the jobs only wait for the batchers, so a few threads are enough
+    async_executor = ThreadPoolExecutor(
+        max_workers=int(os.environ.get("ASYNC_JOB_THREADS", 4))
+    )
+
+    # batch size and queue wait time histograms of each model
+    @app.route("/api/metrics", methods=["GET"])
+    def metrics():
+        return make_response(
+            jsonify({model: batcher.metrics() for model, batcher in app.models.items()}),
+            200,
+        )
 
     # routing http posts to this method
     @app.route("/api/detect", methods=["POST"])
@@ -37,24 +90,79 @@ def create_app():
         # get the json data from the request body and convert it to a python dictionary object
         data = request.get_json(force=True)
 
-        model = data.get("model")
-        if not model:
+        batcher, images, error_response = parse_detection_request(app, data)
+        if error_response:
+            return error_response
+
+        if wants_stream():
+            return Response(
+                stream_detections(
+                    submit_images(batcher, images),
+                    incoming_request_time,
+                    incoming_request_time_str,
+                ),
+                mimetype=NDJSON_MIMETYPE,
+            )
+
+        data = detection_loop(batcher, images)
+
+        processing_time = (
+            datetime.datetime.utcnow() - incoming_request_time
+        ).total_seconds()
+        data["processing_time"] = processing_time
+        data["request_received_at"] = incoming_request_time_str
+
+        return make_response(jsonify(data), 200)
+
+    # binary upload: the images are sent as they are (no Base64 encoding, no JSON payload), either as the files of a
+    # multipart/form-data request (field "images") or as a length-prefixed stream (see read_length_prefixed_images())
+    @app.route("/api/detect/binary", methods=["POST"])
+    def detect_binary():
+        incoming_request_time, incoming_request_time_str = get_current_timestamp()
+
+        if request.mimetype == "multipart/form-data":
+            model = request.args.get("model") or request.form.get("model")
+        elif request.mimetype == "application/octet-stream":
+            model = request.args.get("model")
+        else:
             return make_response(
                 jsonify(
                     {
-                        "error": f'Model not specified. Please add it to the payload (key: "model"). Options are {model_config.keys()}'
+                        "error": "Unsupported content type. Use multipart/form-data or application/octet-stream"
                     }
                 ),
-                400,
+                415,
             )
-        predict_fn = app.models.get(model)
-        if not predict_fn:
-            return make_response(jsonify({"error": f"Model {model} not found"}), 404)
-        filenames = [img["name"] for img in data["images"]]
-        base64_imgs = [img["content"] for img in data["images"]]
-        img_bytes = [decode_base64(img) for img in base64_imgs]
 
-        data = detection_loop(predict_fn, list(zip(filenames, img_bytes)))
+        batcher, error_response = get_batcher(app, model)
+        if error_response:
+            return error_response
+
+        # the images of a length-prefixed stream are queued as soon as they have been read, so detection starts while
+        # the rest of the upload is read (multipart requests are parsed completely first)
+        if request.mimetype == "multipart/form-data":
+            futures = [
+                (file.filename, batcher.submit(file.read()))
+                for file in request.files.getlist("images")
+            ]
+        else:
+            try:
+                futures = [
+                    (filename, batcher.submit(img_bytes))
+                    for filename, img_bytes in read_length_prefixed_images(request.stream)
+                ]
+            except ValueError as e:
+                return make_response(jsonify({"error": str(e)}), 400)
+        if not futures:
+            return make_response(jsonify({"error": "No images in the request"}), 400)
+
+        if wants_stream():
+            return Response(
+                stream_detections(futures, incoming_request_time, incoming_request_time_str),
+                mimetype=NDJSON_MIMETYPE,
+            )
+
+        data = collect_detections(futures)
 
         processing_time = (
             datetime.datetime.utcnow() - incoming_request_time
@@ -64,9 +172,228 @@ def create_app():
 
         return make_response(jsonify(data), 200)
 
+    # asynchronous detection: the request returns immediately with a job id, the result is polled with GET requests
+    @app.route("/api/detect/async", methods=["POST"])
+    def submit_detection_job():
+        incoming_request_time, incoming_request_time_str = get_current_timestamp()
+
+        data = request.get_json(force=True)
+
+        batcher, images, error_response = parse_detection_request(app, data)
+        if error_response:
+            return error_response
+
+        # at most one cleanup per minute (per worker), rather than a background thread
+        nonlocal last_cleanup_time
+        if time.time() - last_cleanup_time > 60:
+            last_cleanup_time = time.time()
+            delete_expired_job_files(async_results_dir, async_job_ttl)
+
+        job_id = uuid.uuid4().hex
+        write_job_file(
+            async_results_dir,
+            job_id,
+            {
+                "status": "pending",
+                "request_received_at": incoming_request_time_str,
+                "started_at": time.time(),
+            },
+        )
+        async_executor.submit(
+            run_detection_job,
+            async_results_dir,
+            job_id,
+            batcher,
+            images,
+            incoming_request_time,
+            incoming_request_time_str,
+        )
+
+        return make_response(
+            jsonify({"job_id": job_id, "status_url": f"/api/detect/async/{job_id}"}),
+            202,
+        )
+
+    @app.route("/api/detect/async/<job_id>", methods=["GET"])
+    def get_detection_job(job_id):
+        # job ids are generated by the server, anything else must not be used as a file name
+        if not re.fullmatch(r"[0-9a-f]{32}", job_id):
+            return make_response(jsonify({"error": f"Job {job_id} not found"}), 404)
+        try:
+            with open(os.path.join(async_results_dir, job_id + ".json"), "r") as f:
+                job = json.load(f)
+        except FileNotFoundError:
+            return make_response(jsonify({"error": f"Job {job_id} not found"}), 404)
+
+        if (
+            job["status"] == "pending"
+            and time.time() - job["started_at"] > async_job_timeout
+        ):
+            job = {
+                "status": "error",
+                "error": f"Job did not finish within {async_job_timeout} seconds (the server process running it may have been restarted)",
+                "request_received_at": job["request_received_at"],
+            }
+
+        status_codes = {"pending": 202, "done": 200, "error": 500}
+        return make_response(jsonify(job), status_codes[job["status"]])
+
     return app
 
 
+def configure_tf_threads():
+    """
+    Limits the thread pools of TensorFlow, so that several worker processes do not oversubscribe the CPU.
+
+    TF_INTRA_OP_THREADS: threads used within an operation (e.g. a convolution)
+    TF_INTER_OP_THREADS: threads used for running independent operations in parallel
+    (0 or unset: TensorFlow's default, i.e. the number of cores)
+    """
+    intra_op_threads = int(os.environ.get("TF_INTRA_OP_THREADS", 0))
+    inter_op_threads = int(os.environ.get("TF_INTER_OP_THREADS", 0))
+    if intra_op_threads:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    if inter_op_threads:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    print(
+        f"TensorFlow thread pools: {intra_op_threads or 'default'} intra-op, {inter_op_threads or 'default'} inter-op threads"
+    )
+
+
+def get_batcher(app, model: str):
+    """
+    Looks up the batcher of a model.
+
+    Returns:
+        tuple (batcher, error_response) where error_response is None if the model exists
+    """
+    if not model:
+        return None, make_response(
+            jsonify(
+                {
+                    "error": f'Model not specified. Please add it to the payload (key: "model"). Options are {app.model_config.keys()}'
+                }
+            ),
+            400,
+        )
+    batcher = app.models.get(model)
+    if not batcher:
+        return None, make_response(jsonify({"error": f"Model {model} not found"}), 404)
+    return batcher, None
+
+
+def read_exactly(stream, size: int):
+    data = stream.read(size)
+    # a stream may return fewer bytes than requested before its end
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def read_length_prefixed_images(stream):
+    """
+    Reads images from a length-prefixed binary stream. For each image, the stream contains
+    - the length of the filename (4-byte big-endian unsigned integer) and the UTF-8 encoded filename
+    - the length of the image (4-byte big-endian unsigned integer) and the raw image bytes
+
+    Yields:
+        tuples (filename, img_bytes)
+    """
+    while True:
+        header = read_exactly(stream, 4)
+        if not header:
+            return
+        if len(header) < 4:
+            raise ValueError("Truncated stream: incomplete filename length")
+        (name_length,) = struct.unpack(">I", header)
+        name = read_exactly(stream, name_length)
+        if len(name) < name_length:
+            raise ValueError("Truncated stream: incomplete filename")
+        header = read_exactly(stream, 4)
+        if len(header) < 4:
+            raise ValueError("Truncated stream: incomplete image length")
+        (img_length,) = struct.unpack(">I", header)
+        img_bytes = read_exactly(stream, img_length)
+        if len(img_bytes) < img_length:
+            raise ValueError(f"Truncated stream: incomplete image {name.decode('utf-8')}")
+        yield name.decode("utf-8"), img_bytes
+
+
+def wants_stream():
+    """
+    Whether the client asked for a streamed response (query parameter stream=1 or Accept: application/x-ndjson).
+    """
+    if request.args.get("stream", "").lower() in ("1", "true"):
+        return True
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def parse_detection_request(app, data: dict):
+    """
+    Extracts the model and the images from the payload of a detection request.
+
+    Returns:
+        tuple (batcher, images, error_response) where images is a list of tuples (filename, img_bytes)
+        and error_response is None if the request is valid
+    """
+    batcher, error_response = get_batcher(app, data.get("model"))
+    if error_response:
+        return None, None, error_response
+    filenames = [img["name"] for img in data["images"]]
+    base64_imgs = [img["content"] for img in data["images"]]
+    img_bytes = [decode_base64(img) for img in base64_imgs]
+    return batcher, list(zip(filenames, img_bytes)), None
+
+
+def run_detection_job(
+    results_dir: str,
+    job_id: str,
+    batcher: DynamicBatcher,
+    images: list,
+    incoming_request_time,
+    incoming_request_time_str: str,
+):
+    """
+    Performs object detection for an asynchronous request and stores the result of the job.
+    """
+    try:
+        data = detection_loop(batcher, images)
+        data["processing_time"] = (
+            datetime.datetime.utcnow() - incoming_request_time
+        ).total_seconds()
+        data["status"] = "done"
+    except Exception as e:
+        data = {"status": "error", "error": str(e)}
+    data["request_received_at"] = incoming_request_time_str
+    write_job_file(results_dir, job_id, data)
+
+
+def write_job_file(results_dir: str, job_id: str, job: dict):
+    # write to a temporary file first, so that a polling request never reads a partially written result
+    path = os.path.join(results_dir, job_id + ".json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(job, f)
+    os.replace(path + ".tmp", path)
+
+
+def delete_expired_job_files(results_dir: str, ttl: float):
+    """
+    Deletes the files of asynchronous jobs (and left over temporary files) last written more than ttl seconds ago.
+    """
+    expiry_time = time.time() - ttl
+    for filename in os.listdir(results_dir):
+        path = os.path.join(results_dir, filename)
+        try:
+            if os.path.getmtime(path) < expiry_time:
+                os.remove(path)
+        except FileNotFoundError:
+            # deleted by another worker in the meantime
+            pass
+
+
 def get_model_path(model_name, version=1):
     path = os.path.join(
         os.getcwd(), "models", model_name, str(version)
@@ -78,23 +405,44 @@ def decode_base64(string):
     return base64.b64decode(string)
 
 
-def detection_loop(predict_fn, images: list):
+def detection_loop(batcher: DynamicBatcher, images: list):
     """
     Performs object detection on a list of images.
 
+    All images are queued at once, so they can be batched with each other and with the images of concurrent requests.
+
     Args:
-        predict_fn: the prediction function of the object detection model (accepting Base64-encoded image as input)
+        batcher: the batcher of the object detection model
         images: list of tuples (filename, img_bytes) where filename is the name of the image and img_bytes contains the Base64-encoded image
     """
 
+    return collect_detections(submit_images(batcher, images))
+
+
+def submit_images(batcher: DynamicBatcher, images: list):
+    """
+    Queues images for detection.
+
+    Returns:
+        list of tuples (filename, future)
+    """
+    return [(filename, batcher.submit(img_bytes)) for filename, img_bytes in images]
+
+
+def collect_detections(futures: list):
+    """
+    Waits for the detections of queued images.
+
+    Args:
+        futures: list of tuples (filename, future) with the futures returned by the batcher
+    """
+
     predictions = []
     inf_times = []
 
-    for image in images:
-        filename, img_bytes = image
-        inference_start_time = time.time()
-        result = predict_fn(tf.convert_to_tensor([img_bytes], dtype=tf.string))
-        end_time = time.time()
+    for filename, future in futures:
+        # the inference time of an image is the duration of the batch it was processed in
+        result, inference_time = future.result()
 
         predictions.append(
             {
@@ -102,7 +450,6 @@ def detection_loop(predict_fn, images: list):
                 "boxes": process_detection_result(result),
             }
         )
-        inference_time = end_time - inference_start_time
         inf_times.append(inference_time)
 
     avg_inf_time = sum(inf_times) / len(inf_times)
@@ -116,6 +463,47 @@ def detection_loop(predict_fn, images: list):
     return data
 
 
+def stream_detections(futures: list, incoming_request_time, incoming_request_time_str: str):
+    """
+    Yields the detections of queued images as newline-delimited JSON, one line per image as soon as its detection
+    has finished (i.e. not necessarily in the order of the images), followed by a trailer line with the timing stats.
+
+    Args:
+        futures: list of tuples (filename, future) with the futures returned by the batcher
+    """
+    filenames = {future: filename for filename, future in futures}
+    inf_times = []
+    for future in as_completed(filenames):
+        try:
+            result, inference_time = future.result()
+        except Exception as e:
+            yield json.dumps({"filename": filenames[future], "error": str(e)}) + "\n"
+            continue
+        inf_times.append(inference_time)
+        yield json.dumps(
+            {
+                "filename": filenames[future],
+                "boxes": process_detection_result(result),
+                "inf_time": inference_time,
+            }
+        ) + "\n"
+
+    processing_time = (
+        datetime.datetime.utcnow() - incoming_request_time
+    ).total_seconds()
+    yield json.dumps(
+        {
+            "summary": True,
+            "num_images": len(futures),
+            "num_errors": len(futures) - len(inf_times),
+            "inf_time": inf_times,
+            "avg_inf_time": str(sum(inf_times) / len(inf_times)) if inf_times else None,
+            "processing_time": processing_time,
+            "request_received_at": incoming_request_time_str,
+        }
+    ) + "\n"
+
+
 def get_current_timestamp():
     now = (
         datetime.datetime.utcnow()
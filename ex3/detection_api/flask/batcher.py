@@ -0,0 +1,219 @@
+"""
+Server-side dynamic batching of object detection requests.
+
+Instead of calling the prediction function once per image, the images of all concurrent requests are put into a
+queue. A single worker thread per model takes up to `max_batch_size` images from the queue (waiting at most
+`max_wait_time` seconds for the batch to fill up after the first image arrived) and runs them through the model
+with as few `predict_fn` calls as possible. The results are fanned back out to the callers via futures.
+
+The base64 signature of the models exported by get_pretrained_models.py accepts a batch of JPEG strings of any
+dimensions and runs the model on each image inside the graph, so a whole batch is served by a single `predict_fn`
+call. If a batch fails (e.g. because of an invalid image), its images are run one by one, so that only the invalid
+images fail. Models that do not accept more than one image per call (e.g. models exported by earlier versions of
+get_pretrained_models.py, which stacked the decoded images into a single tensor for TF Hub models that only support
+a batch dimension of 1) are detected when a batch fails with an invalid argument error while each of its images
+succeeds on its own. Batching is then paused for `batching_retry_interval` seconds, during which each image is run
+on its own, and probed again afterwards.
+
+The batch sizes and the time images spend waiting in the queue are recorded in histograms.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import tensorflow as tf
+
+# upper bounds of the histogram buckets
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64]
+QUEUE_WAIT_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+
+class Histogram:
+    """
+    Thread-safe histogram with fixed buckets (counts of observations less than or equal to each upper bound).
+    """
+
+    def __init__(self, buckets: list):
+        """
+        Args:
+            buckets: sorted list of the upper bounds of the buckets (an overflow bucket is added)
+        """
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            bucket = len(self.buckets)
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    bucket = index
+                    break
+            self.counts[bucket] += 1
+            self.count += 1
+            self.sum += value
+
+    def to_dict(self):
+        """
+        Returns the histogram in a JSON-serializable format.
+        """
+        with self._lock:
+            bucket_names = [str(upper_bound) for upper_bound in self.buckets] + ["+Inf"]
+            return {
+                "buckets": dict(zip(bucket_names, self.counts)),
+                "count": self.count,
+                "sum": self.sum,
+            }
+
+
+class DynamicBatcher:
+    """
+    Collects images across requests into batches for a prediction function.
+    """
+
+    def __init__(
+        self,
+        predict_fn,
+        max_batch_size: int = 8,
+        max_wait_time: float = 0.005,
+        batching_retry_interval: float = 300,
+    ):
+        """
+        Args:
+            predict_fn: the prediction function of the object detection model (accepting a batch of Base64-encoded images as input)
+            max_batch_size: maximum number of images per batch
+            max_wait_time: maximum time (in seconds) to wait for further images after the first image of a batch arrived
+            batching_retry_interval: time (in seconds) for which batching is paused after the model rejected a batch
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_time = max_wait_time
+        self.batching_retry_interval = batching_retry_interval
+        self._batching_paused_until = None
+        self.batch_size_histogram = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_wait_histogram = Histogram(QUEUE_WAIT_BUCKETS)
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, img_bytes: bytes) -> Future:
+        """
+        Queues an image for detection.
+
+        Returns:
+            future resolving to a tuple (result, inference_time) where result is the output of the model for the image
+            (with a batch dimension of 1) and inference_time the duration of the batch in seconds
+        """
+        future = Future()
+        self._queue.put((img_bytes, time.perf_counter(), future))
+        return future
+
+    def metrics(self):
+        return {
+            "batch_size": self.batch_size_histogram.to_dict(),
+            "queue_wait_seconds": self.queue_wait_histogram.to_dict(),
+            "supports_batching": self.supports_batching,
+        }
+
+    @property
+    def supports_batching(self):
+        """
+        Whether images are currently run through the model in batches.
+        """
+        if self.max_batch_size <= 1:
+            return False
+        return (
+            self._batching_paused_until is None
+            or time.perf_counter() >= self._batching_paused_until
+        )
+
+    def _collect_batch(self):
+        # block until the first image arrives, then wait for more images until the batch is full or the time is up
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_time
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            try:
+                self._process_batch(batch)
+            except Exception as e:
+                # keep the worker alive, otherwise the futures of all later images would never be resolved
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _process_batch(self, batch: list):
+        batch_start_time = time.perf_counter()
+        self.batch_size_histogram.observe(len(batch))
+        for _, enqueued_at, _ in batch:
+            self.queue_wait_histogram.observe(batch_start_time - enqueued_at)
+
+        outcomes = self._predict([img_bytes for img_bytes, _, _ in batch])
+        inference_time = time.perf_counter() - batch_start_time
+        for (_, _, future), (result, error) in zip(batch, outcomes):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result((result, inference_time))
+
+    def _predict(self, images: list):
+        """
+        Runs a batch of images through the model with a single call (or one call per image if that fails).
+
+        Returns:
+            list with a tuple (result, error) for each image
+        """
+        batch_rejected = False
+        if len(images) > 1 and self.supports_batching:
+            try:
+                result = self.predict_fn(tf.convert_to_tensor(images, dtype=tf.string))
+                return [
+                    (_slice_result(result, position), None)
+                    for position in range(len(images))
+                ]
+            except tf.errors.InvalidArgumentError:
+                # either an invalid image or a model that does not accept batches
+                batch_rejected = True
+            except Exception:
+                # e.g. out of memory: run the images one by one, but keep batching
+                pass
+
+        outcomes = []
+        for img_bytes in images:
+            try:
+                result = self.predict_fn(
+                    tf.convert_to_tensor([img_bytes], dtype=tf.string)
+                )
+                outcomes.append((result, None))
+            except Exception as e:
+                outcomes.append((None, e))
+
+        if batch_rejected and all(error is None for _, error in outcomes):
+            # the images are valid on their own, so the model does not accept batches
+            print(
+                f"Model does not support batches of images, running images one by one for {self.batching_retry_interval} seconds"
+            )
+            self._batching_paused_until = (
+                time.perf_counter() + self.batching_retry_interval
+            )
+        return outcomes
+
+
+def _slice_result(result: dict, position: int):
+    """
+    Extracts the output for a single image from the output of a batch (keeping a batch dimension of 1).
+    """
+    return {key: value[position : position + 1] for key, value in result.items()}
@@ -0,0 +1,34 @@
+"""
+Gunicorn configuration of the production serving mode of the detection API.
+
+    gunicorn -c gunicorn.conf.py "app:create_app()"
+
+Each worker process loads the models once (the app is not preloaded in the master process, as TensorFlow is not
+fork-safe) and serves requests with a pool of threads. The threads of a worker share its models and its request
+batchers, so one worker with many threads batches best and needs the least memory; more workers help if the
+request handling itself (JSON and Base64 decoding) becomes the bottleneck.
+
+Environment variables:
+- WEB_CONCURRENCY: number of worker processes (default: 1)
+- THREADS: number of request threads per worker (default: 16)
+- PORT: port to listen on (default: 8502)
+- TF_INTRA_OP_THREADS / TF_INTER_OP_THREADS: TensorFlow thread pools of each worker
+  (default: the cores divided among the workers, so that the workers do not oversubscribe the CPU)
+"""
+import os
+
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+threads = int(os.environ.get("THREADS", 16))
+worker_class = "gthread"
+bind = f"0.0.0.0:{os.environ.get('PORT', 8502)}"
+
+# loading the models takes a while, and large batches of images on a CPU can take longer than the default of 30 seconds
+timeout = int(os.environ.get("TIMEOUT", 300))
+preload_app = False
+
+# the workers inherit the environment of the master process
+cores_per_worker = max(1, (os.cpu_count() or 1) // workers)
+os.environ.setdefault("TF_INTRA_OP_THREADS", str(cores_per_worker))
+os.environ.setdefault("TF_INTER_OP_THREADS", str(min(2, cores_per_worker)))
+
+accesslog = "-"
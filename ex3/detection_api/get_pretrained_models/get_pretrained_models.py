@@ -57,10 +57,25 @@ def _preprocess(bytes_inputs):
 
 
 def _get_serve_image_fn(model):
+    # the TF Hub detection models only accept a batch dimension of 1, so instead of stacking the decoded images into a
+    # single tensor, the model is called once per image inside the graph: a single call of the signature can then serve
+    # a whole batch of images (which may even have different sizes), e.g. the batches of the Flask API's batcher
+    outputs = model.__call__.get_concrete_function(
+        tf.TensorSpec([1, None, None, 3], tf.uint8)
+    ).structured_outputs
+    # the outputs for a single image (without the batch dimension of 1), stacked by map_fn
+    output_signature = {
+        key: tf.TensorSpec(output.shape[1:], output.dtype)
+        for key, output in outputs.items()
+    }
+
+    def _detect(bytes_input):
+        detections = model(_preprocess(bytes_input)[tf.newaxis])
+        return {key: detections[key][0] for key in output_signature}
+
     @tf.function(input_signature=[tf.TensorSpec([None], tf.string)])
     def serve_image_fn(bytes_inputs):
-        decoded_images = tf.map_fn(_preprocess, bytes_inputs, dtype=tf.uint8)
-        return model(decoded_images)
+        return tf.map_fn(_detect, bytes_inputs, fn_output_signature=output_signature)
 
     return serve_image_fn
 